@@ -1,58 +1,213 @@
-from flask import Flask, request, redirect, render_template, flash, jsonify
+from flask import Flask, Blueprint, current_app, request, redirect, render_template, flash, jsonify, Response, g, send_file
 from flask_cors import CORS
 from werkzeug.exceptions import Unauthorized
-from flask_debugtoolbar import DebugToolbarExtension
 import os
-from dotenv import load_dotenv
-from models import db, connect_db, User, Rental, Reservation, Message, Conversation
+from config import PROFILES
+from models import db, connect_db, constraint_name, User, Rental, Reservation, Message, Conversation, PROFILE_INCLUDES, RESERVATIONS_NO_OVERLAP
 from sqlalchemy import and_, or_
-from helpers import create_jwt
-import base64
-from io import BytesIO
-from PIL import Image
-from aws import upload_file, download
+from sqlalchemy.exc import IntegrityError
+from helpers import create_jwt, encode_cursor, decode_cursor, parse_date
+from auth import require_user, get_bearer_token, verify_token
+from routing import remember_writer, wrote_recently
+from response_cache import cached_response
+from passwords import PasswordPoolBusy
+from ratelimit import login_retry_after, is_unknown_username, remember_unknown_username, forget_unknown_username
+import math
+from images import submit_rental_image
+from image_cache import get_variant, UnreadableImage, IMAGE_FORMATS, IMAGE_MAX_DIMENSION
+from pubsub import broker, conversation_channel, user_channel
+import queue
+from aws import download
+from bulk import bulk_cli, iter_rows, load_rows, BULK_MAX_REPORTED_ERRORS, INTEGER_MAX
+import io
+import metrics
 
 
 BASE_URL = "http://127.0.0.1:"
 
-load_dotenv()
+bp = Blueprint('sharebnb', __name__)
 
-app = Flask(__name__)
-CORS(app)
 
-app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
+def create_app(profile=None):
+    """Creates the Flask app for a profile: "dev", "test" or "prod".
 
-debug = DebugToolbarExtension(app)
+    Defaults to the APP_PROFILE environment variable, else "prod", so a
+    server started without configuration never runs dev extensions.
+    `flask` commands get "dev" from .flaskenv.
+    """
 
-connect_db(app)
+    profile = profile or os.environ.get('APP_PROFILE', 'prod')
+
+    app = Flask(__name__)
+    app.config.from_object(PROFILES[profile])
+    CORS(app)
+
+    if app.config['DEBUG_TOOLBAR']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    metrics.init_app(app)
+    app.register_blueprint(bp)
+    app.cli.add_command(bulk_cli)
+
+    return app
 
 
 DEFAULT_IMAGE_URL = "/static/images/default_profile_img.png"
 
+RENTALS_PAGE_SIZE = 20
+RENTALS_MAX_PAGE_SIZE = 100
+RENTALS_MAX_IDS = 100
+
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 200
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+NDJSON_BATCH_SIZE = 500
+
+SSE_KEEPALIVE_SECONDS = 15
+
+SEARCH_MAX_RADIUS_KM = 500
+
+# Image urls never change content, so clients may cache them for a year
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def wants_ndjson():
+    """True if the client asked for a streamed NDJSON response, either with
+    `Accept: application/x-ndjson` or `?stream=1`"""
+
+    if request.args.get('stream') == '1':
+        return True
+
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+
+    return best == NDJSON_MIMETYPE
+
+def ndjson_response(*queries, serialize=None):
+    """Streams the serialized rows of each query as NDJSON, one row per line.
+
+    Rows are fetched in server-side batches with yield_per, so memory use
+    stays flat however many rows there are. `serialize` turns a row into a
+    dict (default: its serialize() method).
+    """
+
+    dumps = current_app.json.dumps
+
+    if serialize is None:
+        serialize = lambda row: row.serialize()
+
+    def generate():
+        for query in queries:
+            for row in query.yield_per(NDJSON_BATCH_SIZE):
+                yield dumps(serialize(row)) + '\n'
+
+    return Response(metrics.stream_with_metrics(generate()), mimetype=NDJSON_MIMETYPE)
+
+def rental_fields():
+    """Returns the ?fields= list of rental keys, or None for all of them.
+
+    Raises ValueError naming any unknown field.
+    """
+
+    if not request.args.get('fields'):
+        return None
+
+    fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+    unknown = [f for f in fields if f not in Rental.FIELD_COLUMNS]
+    if unknown or not fields:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}' if unknown
+                         else 'fields must not be empty')
+
+    return fields
+
+def conversation_messages_page(conversation_id):
+    """Returns a JSON response of one page of a conversation's messages,
+    using the before/after/after_id and limit query params"""
+
+    args = request.args
+
+    limit = args.get('limit', MESSAGES_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MESSAGES_MAX_PAGE_SIZE))
+
+    before = args.get('before', type=int)
+    after = args.get('after', type=int)
+    if after is None:
+        after = args.get('after_id', type=int)
+
+    if before is not None and after is not None:
+        return jsonify(message='Use either before or after, not both'), 400
+
+    try:
+        messages, has_more = Message.get_conversation_page(
+            conversation_id, before=before, after=after, limit=limit)
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+
+    serialized = [message.serialize() for message in messages]
+
+    return jsonify(messages=serialized, has_more=has_more)
+
+def bulk_load_response(kind, override):
+    """Loads the NDJSON (or, for Content-Type: text/csv, CSV) request body
+    into `kind` rows, streaming it rather than reading it all at once"""
+
+    fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+
+    inserted, errors = load_rows(kind, iter_rows(stream, fmt), override=override)
+
+    return jsonify(inserted=inserted,
+                   error_count=len(errors),
+                   errors=errors[:BULK_MAX_REPORTED_ERRORS])
+
+def format_sse(message, dumps):
+    """Formats a serialized message as a Server-Sent Event"""
+
+    return f"id: {message['id']}\nevent: message\ndata: {dumps(message)}\n\n"
 
-def decode_and_upload_photo(photo_data):
-    """Decodes a 64byte photo and uploads to s3 bucket"""
+def sse_response(channel, backlog=()):
+    """Streams messages published to `channel` as Server-Sent Events.
 
-    url = photo_data['url']
-    #TODO: Grab the mimetype off of the URL (Look up a module to do so)
+    `backlog` (serialized messages, oldest first) is sent before anything
+    live. Subscribes first so nothing published in between is lost.
+    """
 
-    # returned_bytes = photo_data['bytes'][index:]
+    dumps = current_app.json.dumps
+    subscription = broker.subscribe(channel)
+    last_id = backlog[-1]['id'] if backlog else 0
 
-    returned_bytes = photo_data['bytes'].split(',', 1)[1].strip()
+    def generate():
+        for message in backlog:
+            yield format_sse(message, dumps)
 
-    img_bytes = base64.b64decode(returned_bytes)
-    img_io = BytesIO(img_bytes)
+        while True:
+            try:
+                message = subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
 
-    with open(f'rental_pics/{url}', 'wb') as f:
-        f.write(img_io.read())
+            if message['id'] > last_id:
+                yield format_sse(message, dumps)
 
-    upload_file(f'rental_pics/{url}')
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no'})
+    # Also runs when the body is never iterated, e.g. for HEAD requests
+    response.call_on_close(lambda: broker.unsubscribe(subscription))
 
-    os.remove(f'rental_pics/{url}')
+    return response
+
+def publish_message(message):
+    """Publishes a new message to its conversation's and both users' channels"""
+
+    serialized = message.serialize()
+
+    broker.publish(conversation_channel(message.conversation_id), serialized)
+    broker.publish(user_channel(message.sender_username), serialized)
+    broker.publish(user_channel(message.recipient_username), serialized)
 
 # def download_and_encode_photo(image_url):
 #     """Downloads photo from s3 and encodes it to 64-bits to send in json
@@ -72,10 +227,62 @@ def decode_and_upload_photo(photo_data):
 #     return encoded_string
 
 
+@bp.app_errorhandler(PasswordPoolBusy)
+def password_pool_busy(e):
+    """Sheds load when the bcrypt pool is full, instead of queueing"""
+
+    return jsonify(message='Too many requests, try again shortly'), 429, {'Retry-After': '1'}
+
+def client_keys():
+    """Identifies the caller for read-your-writes: their ip, and their
+    username if they sent a valid token"""
+
+    keys = [f'ip:{request.remote_addr}']
+
+    token = get_bearer_token()
+    username = verify_token(token) if token else None
+    if username:
+        keys.append(f'user:{username}')
+
+    return keys
+
+@bp.before_app_request
+def route_reads_to_replica():
+    """Lets GET requests read from a replica, unless this client wrote
+    something in the last few seconds"""
+
+    g.db_wrote = False
+    g.use_replica = (request.method in ('GET', 'HEAD')
+                     and not wrote_recently(client_keys()))
+
+@bp.after_app_request
+def remember_recent_writer(response):
+    """Sends this client's reads to the primary for a while after a write.
+
+    Marks the ip and the token's username, and the username signup or login
+    just wrote for, since the client's next requests carry that user's token.
+    """
+
+    if g.get('db_wrote'):
+        keys = client_keys()
+        if g.get('signed_in_username'):
+            keys.append(f'user:{g.signed_in_username}')
+        remember_writer(keys)
+
+    return response
+
+@bp.get('/metrics')
+def get_metrics():
+    """Returns this process's request, database, S3 and cache metrics in
+    the Prometheus text format"""
+
+    return Response(metrics.render_metrics(),
+                    mimetype='text/plain; version=0.0.4')
+
 ##############################################################################
 # User signup/login
 
-@app.post('/signup')
+@bp.post('/signup')
 def signup():
     """Handle user signup."""
 
@@ -103,22 +310,43 @@ def signup():
         )
 
     db.session.commit()
+    forget_unknown_username(user_data['username'])
+    g.signed_in_username = user_data['username']
 
     token = create_jwt(user_data["username"])
 
     return jsonify(token=token)
 
-@app.post('/login')
+@bp.post('/login')
 def login():
     """Handle user login"""
 
     login_data = request.get_json()
-    login_status = User.authenticate(username=login_data['username'],
+    username = login_data['username']
+
+    # Turn away brute-force traffic before it reaches the db or bcrypt
+    retry_after = login_retry_after(username, request.remote_addr)
+    if retry_after:
+        return (jsonify(message='Too many login attempts, try again later'), 429,
+                {'Retry-After': str(math.ceil(retry_after))})
+
+    if is_unknown_username(username):
+        return Unauthorized()
+
+    login_status = User.authenticate(username=username,
                                      password=login_data['password'])
 
     if (login_status is False):
+        # authenticate already loaded the user if it exists, so this only
+        # queries the db for unknown usernames
+        if db.session.get(User, username) is None:
+            remember_unknown_username(username)
         return Unauthorized()
 
+    # Saves the new hash if authenticate rehashed the password
+    db.session.commit()
+    g.signed_in_username = username
+
     token = create_jwt(login_data["username"])
 
     return jsonify(token=token)
@@ -126,24 +354,190 @@ def login():
 ##############################################################################
 # Rentals routes:
 
-@app.get('/rentals')
+@bp.get('/rentals')
+@cached_response('rentals')
 def get_rentals():
-    """Returns json data of all rentals"""
-    rentals = Rental.query.all()
-    serialized = [r.serialize() for r in rentals]
+    """Returns json data of one page of rentals
+
+    Optional query params:
+    - location, min_price, max_price, owner: filters
+    - sort: "id" (default), "price" or "rating" (top rated first)
+    - limit: page size (default 20, max 100)
+    - cursor: next_cursor from the previous page
+    - fields: comma-separated keys to return, e.g. "id,price,location";
+      only their columns are SELECTed
+    - ids: comma-separated rental ids (max 100); returns just those
+      rentals, in that order, with one query, ignoring the other params
+      except fields
+
+    With `Accept: application/x-ndjson` or `?stream=1`, streams every
+    matching rental (ordered by id) as NDJSON instead of one page.
+    """
+
+    args = request.args
+
+    try:
+        fields = rental_fields()
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+
+    if args.get('ids'):
+        try:
+            ids = [int(id) for id in args['ids'].split(',')]
+        except ValueError:
+            return jsonify(message='ids must be comma-separated integers'), 400
+        if len(ids) > RENTALS_MAX_IDS:
+            return jsonify(message=f'At most {RENTALS_MAX_IDS} ids'), 400
+
+        rentals = Rental.get_many(list(dict.fromkeys(ids)), fields=fields)
+
+        return jsonify(rentals=[Rental.serialize_row(r, fields) for r in rentals])
+
+    sort = args.get('sort', 'id')
+    if sort not in ('id', 'price', 'rating'):
+        return jsonify(message='sort must be "id", "price" or "rating"'), 400
+
+    limit = args.get('limit', RENTALS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, RENTALS_MAX_PAGE_SIZE))
+
+    after = None
+    if args.get('cursor'):
+        try:
+            after = decode_cursor(args['cursor'])
+        except ValueError:
+            return jsonify(message='Invalid cursor'), 400
+        if len(after) != (1 if sort == 'id' else 2):
+            return jsonify(message='Cursor does not match sort'), 400
+
+    query = Rental.filter_by_params(
+        location=args.get('location'),
+        min_price=args.get('min_price', type=int),
+        max_price=args.get('max_price', type=int),
+        owner_username=args.get('owner'),
+    )
+
+    # Read-only, so select plain rows rather than Rental objects
+    sort_columns = {'price': ('price',), 'rating': ('rating_mean',)}
+    query = query.with_entities(
+        *Rental.row_columns(fields, extra=sort_columns.get(sort, ()))
+    )
+
+    if wants_ndjson():
+        return ndjson_response(
+            query.order_by(Rental.id),
+            serialize=lambda row: Rental.serialize_row(row, fields),
+        )
+
+    rentals, next_key = Rental.get_page(query, sort=sort, after=after,
+                                        limit=limit)
+    serialized = [Rental.serialize_row(r, fields) for r in rentals]
+    next_cursor = encode_cursor(next_key) if next_key else None
+
+    return jsonify(rentals=serialized, next_cursor=next_cursor)
+
+@bp.get('/rentals/search')
+@cached_response('rentals')
+def search_rentals():
+    """Returns json data of rentals matching a search, best match first
+
+    Query params (q, or lat and lon, or both):
+    - q: words to find in the description or location
+    - lat, lon: only rentals within radius_km (default 10, max 500) of here,
+      closest first when there's no q; results include distance_km
+    - limit: max results (default 20, max 100)
+    """
+
+    args = request.args
+
+    text = args.get('q', '').strip() or None
+    lat = args.get('lat', type=float)
+    lon = args.get('lon', type=float)
+    radius_km = args.get('radius_km', 10, type=float)
+
+    near = None
+    if lat is not None or lon is not None:
+        if lat is None or lon is None or not -90 <= lat <= 90 or not -180 <= lon <= 180:
+            return jsonify(message='lat and lon must both be given and valid'), 400
+        if not 0 < radius_km <= SEARCH_MAX_RADIUS_KM:
+            return jsonify(message=f'radius_km must be between 0 and {SEARCH_MAX_RADIUS_KM}'), 400
+        near = (lat, lon, radius_km)
+
+    if text is None and near is None:
+        return jsonify(message='Search needs q, or lat and lon'), 400
+
+    limit = args.get('limit', RENTALS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, RENTALS_MAX_PAGE_SIZE))
+
+    results = Rental.search(text=text, near=near, limit=limit)
+
+    serialized = []
+    for rental, distance_km in results:
+        rental_data = rental.serialize()
+        if distance_km is not None:
+            rental_data['distance_km'] = round(distance_km, 3)
+        serialized.append(rental_data)
 
     return jsonify(rentals=serialized)
 
-@app.post('/rentals/<username>/add')
+@bp.get('/rentals/available')
+@cached_response('rentals', 'reservations')
+def get_available_rentals():
+    """Returns json data of one page of rentals free for a whole date range
+
+    Required query params: start, end (YYYY-MM-DD, inclusive).
+    Optional: location, min_price, max_price, limit and cursor, as for
+    /rentals (sorted by id).
+    """
+
+    args = request.args
+
+    try:
+        start_date = parse_date(args.get('start', ''))
+        end_date = parse_date(args.get('end', ''))
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+
+    if end_date < start_date:
+        return jsonify(message='end is before start'), 400
+
+    limit = args.get('limit', RENTALS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, RENTALS_MAX_PAGE_SIZE))
+
+    after = None
+    if args.get('cursor'):
+        try:
+            after = decode_cursor(args['cursor'])
+        except ValueError:
+            return jsonify(message='Invalid cursor'), 400
+        if len(after) != 1:
+            return jsonify(message='Cursor does not match sort'), 400
+
+    query = Rental.filter_by_params(
+        location=args.get('location'),
+        min_price=args.get('min_price', type=int),
+        max_price=args.get('max_price', type=int),
+    ).filter(Rental.available_between(start_date, end_date))
+    query = query.with_entities(*Rental.row_columns())
+
+    rentals, next_key = Rental.get_page(query, after=after, limit=limit)
+    serialized = [Rental.serialize_row(r) for r in rentals]
+    next_cursor = encode_cursor(next_key) if next_key else None
+
+    return jsonify(rentals=serialized, next_cursor=next_cursor)
+
+@bp.post('/rentals/<username>/add')
+@require_user
 def add_rental(username):
-    """Allows a user to add a new rental"""
+    """Allows a user to add a new rental
+
+    The photo is resized and uploaded in the background, so this responds
+    202 straight away with image_status "pending".
+    """
 
     rental = request.get_json()
 
     photo_data = rental['rentalPhotos']
 
-    decode_and_upload_photo(photo_data)
-
     rd = rental['rentalData']
 
     rental_data = Rental.add_rental(
@@ -151,39 +545,71 @@ def add_rental(username):
         location=rd['location'],
         price=int(rd['price']),
         owner_username=username,
-        url=rd['url']
+        url=rd['url'],
+        image_status='pending',
+        latitude=rd.get('latitude'),
+        longitude=rd.get('longitude')
     )
 
     db.session.commit()
 
+    # Serialized before the job is queued, since it may update the rental
+    # at any moment from then on
     serialized = rental_data.serialize()
 
-    return jsonify(rental=serialized)
+    submit_rental_image(current_app._get_current_object(), serialized['id'], photo_data)
+
+    return jsonify(rental=serialized), 202
 
-@app.get('/rentals/<username>')
+@bp.post('/rentals/<username>/bulk')
+@require_user
+def add_rentals_bulk(username):
+    """Adds many rentals for a user from an NDJSON or CSV body, one rental
+    per row (no photos). Reports each rejected row."""
+
+    return bulk_load_response('rentals', {'owner_username': username})
+
+@bp.get('/rentals/<username>')
+@cached_response('users', 'rentals')
 def get_user_rentals(username):
     """Returns json data of all rentals for a single user"""
 
-    user = User.query.get_or_404(username)
+    User.query.get_or_404(username)
 
-    rentals = user.rentals
+    rentals = db.session.query(*Rental.row_columns()).filter(
+        Rental.owner_username == username
+    )
 
-    serialized = [r.serialize() for r in rentals]
+    serialized = [Rental.serialize_row(r) for r in rentals]
 
     return jsonify(rentals=serialized)
 
-@app.get('/rentals/<int:rental_id>')
+@bp.get('/rentals/<int:rental_id>')
+@cached_response('rentals')
 def get_user_rental(rental_id):
-    """Returns json data of single user's rental"""
+    """Returns json data of single user's rental
+
+    Optional query params:
+    - fields: comma-separated keys to return
+    """
 
-    rental = Rental.query.filter(
+    try:
+        fields = rental_fields()
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+
+    query = Rental.query.filter(
         and_(Rental.id == rental_id)
-    ).first()
+    )
+    if fields is not None:
+        query = query.options(Rental.load_fields(fields))
+
+    rental = query.first()
 
     if (not rental):
         return jsonify(rental=None)
 
-    serialized = rental.serialize()
+    serialized = rental.serialize(fields)
 
     return jsonify(rental=serialized)
 
@@ -201,33 +627,120 @@ def get_user_rental(rental_id):
 
 #     return '/rentals/<int:rental_id>/new-reservation'
 
+##############################################################################
+# Images routes:
+
+@bp.get('/images/<path:key>')
+def get_image(key):
+    """Serves a photo from the S3 bucket, optionally resized and converted
+
+    Optional query params:
+    - w, h: fit within this many pixels (max 2000; never upscaled)
+    - fmt: "webp", "jpeg" or "png"
+
+    Originals and resized copies are cached on disk, so S3 is only hit the
+    first time. Supports Range and conditional requests.
+    """
+
+    width = request.args.get('w', type=int)
+    height = request.args.get('h', type=int)
+    fmt = request.args.get('fmt')
+
+    for size in (width, height):
+        if size is not None and not 0 < size <= IMAGE_MAX_DIMENSION:
+            return jsonify(message=f'w and h must be 1 to {IMAGE_MAX_DIMENSION}'), 400
+
+    if fmt is not None and fmt not in IMAGE_FORMATS:
+        return jsonify(message='fmt must be one of ' + ', '.join(IMAGE_FORMATS)), 400
+
+    # A cached file can be evicted between being found and being read; the
+    # second attempt sees the miss and fetches it again
+    for attempt in range(2):
+        try:
+            image = get_variant(key, width=width, height=height, fmt=fmt)
+            if image is None:
+                return jsonify(message='Image not found'), 404
+
+            path, mimetype = image
+            response = send_file(path, mimetype=mimetype, conditional=True,
+                                 max_age=IMAGE_MAX_AGE)
+            break
+        except UnreadableImage:
+            return jsonify(message="Image can't be resized or converted"), 415
+        except FileNotFoundError:
+            if attempt:
+                raise
+
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+
+    return response
+
 ##############################################################################
 # User routes:
 
-@app.get('/users/<username>')
+@bp.get('/users/<username>')
+@cached_response('users', 'rentals')
 def get_user(username):
     """Returns json data a user + all rentals they have"""
-    user = User.query.get_or_404(username)
-    serialized_user = user.serialize()
-    rentals = Rental.query.filter(Rental.owner_username == username).all()
-    serialized_rentals = [r.serialize() for r in rentals]
 
-    return jsonify(user=serialized_user, rentals=serialized_rentals)
+    profile = User.get_profile(username, include=('rentals',))
+
+    if profile is None:
+        return jsonify(message='User not found'), 404
+
+    return jsonify(profile)
+
+@bp.get('/users/<username>/profile')
+@require_user
+def get_user_profile(username):
+    """Returns json data of a user's own profile
+
+    Optional query params:
+    - include: comma-separated sections to add, any of "rentals",
+      "reservations" (counts made and upcoming) and "messages" (unread
+      count)
+    """
+
+    include = [i.strip() for i in request.args.get('include', '').split(',')
+               if i.strip()]
+    unknown = [i for i in include if i not in PROFILE_INCLUDES]
+    if unknown:
+        return jsonify(message=f'Unknown include: {", ".join(unknown)}'), 400
+
+    profile = User.get_profile(username, include=include)
+
+    if profile is None:
+        return jsonify(message='User not found'), 404
+
+    return jsonify(profile)
 
 
 ##############################################################################
 # Reservations routes:
 
-@app.get('/reservations/<username>/')
+@bp.get('/reservations/<username>/')
+@require_user
 def get_user_reservations(username):
-    """Returns json data of all of a user's reservations"""
+    """Returns json data of all of a user's reservations
 
-    reservations = Reservation.query.filter(Reservation.renter == username)
-    serialized = [r.serialize() for r in reservations]
+    Streams NDJSON with `Accept: application/x-ndjson` or `?stream=1`.
+    """
+
+    reservations = db.session.query(*Reservation.row_columns()).filter(
+        Reservation.renter == username
+    )
+
+    if wants_ndjson():
+        return ndjson_response(reservations.order_by(Reservation.id),
+                               serialize=Reservation.serialize_row)
+
+    serialized = [Reservation.serialize_row(r) for r in reservations]
 
     return jsonify(reservations=serialized)
 
-@app.get('/reservations/<username>/<int:reservation_id>')
+@bp.get('/reservations/<username>/<int:reservation_id>')
+@require_user
 def get_user_reservation(username, reservation_id):
     """Returns json data of a single user reservation"""
 
@@ -242,51 +755,138 @@ def get_user_reservation(username, reservation_id):
 
     return jsonify(reservation=serialized)
 
-@app.post('/reservations/<username>/add')
+@bp.post('/reservations/<username>/add')
+@require_user
 def add_reservation(username):
     """Allows a user to add a new reservation"""
 
     reservation_data = request.get_json()
 
-    start_date = reservation_data['start_date']
-    end_date = reservation_data['end_date']
-    rental_id = reservation_data['rental_id']
+    rental_id = reservation_data.get('rental_id')
     rating = reservation_data.get('rating')
 
-    if rating is not None:
-        # Rating is provided
-        reservation = Reservation.add_reservation(start_date=start_date, end_date=end_date, rental_id=rental_id, renter=username, rating=rating)
-    else:
-        # Rating is not provided
-        reservation = Reservation.add_reservation(start_date=start_date, end_date=end_date, rental_id=rental_id, renter=username)
-
-    db.session.commit()
+    if type(rental_id) is not int or not 0 < rental_id <= INTEGER_MAX:
+        return jsonify(message='rental_id must be a positive whole number'), 400
+
+    try:
+        start_date = parse_date(reservation_data['start_date'])
+        end_date = parse_date(reservation_data['end_date'])
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+
+    if end_date < start_date:
+        return jsonify(message='end_date is before start_date'), 400
+
+    if db.session.get(Rental, rental_id) is None:
+        return jsonify(message='Rental not found'), 404
+
+    if Reservation.overlapping(rental_id, start_date, end_date).first():
+        return jsonify(message='Rental is already booked for those dates'), 409
+
+    try:
+        if rating is not None:
+            # Rating is provided
+            reservation = Reservation.add_reservation(start_date=start_date, end_date=end_date, rental_id=rental_id, renter=username, rating=rating)
+        else:
+            # Rating is not provided
+            reservation = Reservation.add_reservation(start_date=start_date, end_date=end_date, rental_id=rental_id, renter=username)
+
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify(message=str(e)), 400
+    except IntegrityError as e:
+        db.session.rollback()
+        if constraint_name(e) == RESERVATIONS_NO_OVERLAP:
+            # Lost a race with another booking
+            return jsonify(message='Rental is already booked for those dates'), 409
+        if db.session.get(Rental, rental_id) is None:
+            return jsonify(message='Rental not found'), 404
+        return jsonify(message='Invalid reservation'), 400
 
     serialized = reservation.serialize()
 
     return jsonify(reservation=serialized)
 
+@bp.post('/reservations/<username>/bulk')
+@require_user
+def add_reservations_bulk(username):
+    """Adds many reservations for a user from an NDJSON or CSV body, one
+    reservation per row. Reports each rejected row."""
+
+    return bulk_load_response('reservations', {'renter': username})
+
 ##############################################################################
 # Messages routes:
 
-@app.get('/messages/<username>')
+@bp.get('/messages/<username>')
+@require_user
 def get_user_messages(username):
-    """Returns JSON data of all messages for a single user"""
+    """Returns JSON data of all messages for a single user, oldest first
 
-    user = User.query.get_or_404(username)
+    Streams NDJSON with `Accept: application/x-ndjson` or `?stream=1`.
+    """
 
-    sent_messages = Message.query.filter_by(sender=user).all()
-    received_messages = Message.query.filter_by(recipient=user).all()
+    User.query.get_or_404(username)
 
-    serialized = [message.serialize() for message in sent_messages] + [message.serialize() for message in received_messages]
+    query = Message.for_user(username).with_entities(*Message.row_columns())
+
+    if wants_ndjson():
+        return ndjson_response(query, serialize=Message.serialize_row)
+
+    serialized = [Message.serialize_row(row) for row in query]
 
     return jsonify(messages=serialized)
 
-@app.get('/messages/<username>/<int:message_id>')
+@bp.get('/messages/<username>/inbox')
+@require_user
+def get_user_inbox(username):
+    """Returns JSON data of one page of a user's inbox: one row per
+    conversation, newest first, with its last message and unread count
+
+    Optional query params:
+    - limit: page size (default 50, max 200)
+    - before: conversation id, returns the page of older conversations
+    """
+
+    args = request.args
+
+    limit = args.get('limit', MESSAGES_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MESSAGES_MAX_PAGE_SIZE))
+
+    try:
+        rows, has_more = Conversation.get_inbox(
+            username, before=args.get('before', type=int), limit=limit)
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+
+    serialized = [
+        {
+            'conversation': conversation.serialize(),
+            'last_message': message.serialize(),
+            'unread_count': unread_count,
+        }
+        for conversation, message, unread_count in rows
+    ]
+
+    return jsonify(conversations=serialized, has_more=has_more)
+
+@bp.get('/messages/<username>/events')
+@require_user(query_token=True)
+def stream_user_messages(username):
+    """Streams every new message sent or received by a user as
+    Server-Sent Events"""
+
+    User.query.get_or_404(username)
+
+    return sse_response(user_channel(username))
+
+@bp.get('/messages/<username>/<int:message_id>')
+@require_user
 def get_user_message(username, message_id):
     """Returns JSON data of a single user's message"""
 
-    message = Message.query.filter_by(sender=username, id=message_id).first()
+    message = Message.query.filter_by(sender_username=username, id=message_id).first()
 
     if not message:
         return jsonify(message=None)
@@ -295,7 +895,8 @@ def get_user_message(username, message_id):
 
     return jsonify(message=serialized)
 
-@app.post('/messages')
+@bp.post('/messages')
+@require_user
 def send_message():
     data = request.get_json()
 
@@ -306,28 +907,25 @@ def send_message():
     receiver_username = data['recipient']
     message_text = data['content']
 
+    if sender_username != g.user['username']:
+        return jsonify(message='Forbidden'), 403
+
     sender = User.query.filter_by(username=sender_username).first()
     recipient = User.query.filter_by(username=receiver_username).first()
 
     if not sender or not recipient:
         return jsonify(message='Sender or receiver not found'), 404
 
-    conversation = Conversation.query.filter(
-        or_(
-            and_(Conversation.user1 == sender, Conversation.user2 == recipient),
-            and_(Conversation.user1 == recipient, Conversation.user2 == sender)
-        )
-    ).first()
-
-    if not conversation:
-        conversation = Conversation(user1=sender, user2=recipient)
-        db.session.add(conversation)
+    conversation, created = Conversation.get_or_create(sender.username, recipient.username)
 
-    message = Message(content=message_text, sender=sender, recipient=recipient, conversation=conversation)
-    db.session.add(message)
+    message = Message.create_message(message_text, sender.username,
+                                     recipient.username, conversation.id)
     db.session.commit()
 
-    messages = Message.query.filter_by(conversation=conversation).order_by(Message.timestamp).all()
+    publish_message(message)
+
+    messages, has_more = Message.get_conversation_page(conversation.id,
+                                                       limit=MESSAGES_PAGE_SIZE)
 
     # Serialize messages to dictionary format
     serialized_messages = [msg.serialize() for msg in messages]
@@ -337,37 +935,39 @@ def send_message():
 ##############################################################################
 # Conversations routes:
 
-@app.post('/conversations')
+@bp.post('/conversations')
+@require_user
 def create_conversation():
-    """Create a conversation between two users"""
+    """Create a conversation between two users, one of whom is the caller"""
 
     conversation_data = request.get_json()
     user1_username = conversation_data['user1']
     user2_username = conversation_data['user2']
 
-    # Check if a conversation already exists between the users
-    existing_conversation = Conversation.query.filter(
-        Conversation.user1.has(username=user1_username),
-        Conversation.user2.has(username=user2_username)
-    ).first()
+    if g.user['username'] not in (user1_username, user2_username):
+        return jsonify(message='Forbidden'), 403
 
-    if existing_conversation is not None:
+    # Check if a conversation already exists between the users
+    if Conversation.find(user1_username, user2_username) is not None:
         return jsonify(error='Conversation already exists')
 
-    # Create new conversation
     user1 = User.query.filter_by(username=user1_username).first()
     user2 = User.query.filter_by(username=user2_username).first()
 
     if user1 is None or user2 is None:
         return jsonify(error='Invalid user')
 
-    conversation = Conversation(user1=user1, user2=user2)
-    db.session.add(conversation)
+    # Create new conversation, unless a concurrent request just did
+    conversation, created = Conversation.get_or_create(user1_username, user2_username)
     db.session.commit()
 
+    if not created:
+        return jsonify(error='Conversation already exists')
+
     return jsonify(conversation=conversation.serialize())
 
-@app.get('/conversations/<username>')
+@bp.get('/conversations/<username>')
+@require_user
 def get_user_conversations(username):
     """Returns JSON data of all conversations for a single user"""
 
@@ -379,33 +979,89 @@ def get_user_conversations(username):
 
     return jsonify(conversations=serialized)
 
-@app.get('/conversations/<int:conversation_id>/messages')
+@bp.get('/conversations/<int:conversation_id>/messages')
+@require_user
 def get_conversation_messages_by_id(conversation_id):
-    """Returns JSON data of all messages in a single conversation"""
+    """Returns JSON data of one page of messages in a single conversation
+
+    Optional query params:
+    - limit: page size (default 50, max 200)
+    - before: message id, returns the page of older messages before it
+    - after (or after_id): message id, returns only messages newer than it,
+      for polling
+
+    Without a cursor returns the newest messages. Messages are oldest first;
+    has_more says whether there are more in the requested direction.
+    """
 
     conversation = Conversation.query.get_or_404(conversation_id)
 
-    messages = conversation.messages
-    messages.sort(key=lambda m: m.timestamp)  # Sort messages by timestamp
+    if not conversation.has_member(g.user['username']):
+        return jsonify(message='Forbidden'), 403
 
-    serialized = [message.serialize() for message in messages]
+    return conversation_messages_page(conversation.id)
 
-    return jsonify(messages=serialized)
+@bp.get('/conversations/<int:conversation_id>/events')
+@require_user(query_token=True)
+def stream_conversation_messages(conversation_id):
+    """Streams new messages in a conversation as Server-Sent Events
+
+    Reconnecting clients (Last-Event-ID header, or ?after_id=) first get the
+    messages they missed.
+    """
+
+    conversation = Conversation.query.get_or_404(conversation_id)
+
+    if not conversation.has_member(g.user['username']):
+        return jsonify(message='Forbidden'), 403
+
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after_id', type=int)
+
+    backlog = []
+    if after is not None:
+        try:
+            messages, has_more = Message.get_conversation_page(
+                conversation.id, after=after, limit=MESSAGES_MAX_PAGE_SIZE)
+        except ValueError as e:
+            return jsonify(message=str(e)), 400
+        backlog = [message.serialize() for message in messages]
+
+    return sse_response(conversation_channel(conversation.id), backlog)
+
+@bp.post('/conversations/<int:conversation_id>/read')
+@require_user
+def mark_conversation_read(conversation_id):
+    """Marks the messages the caller received in a conversation as read"""
 
-@app.get('/conversations/<sender>/<recipient>/messages')
+    conversation = Conversation.query.get_or_404(conversation_id)
+
+    username = g.user['username']
+    if not conversation.has_member(username):
+        return jsonify(message='Forbidden'), 403
+
+    marked = Message.mark_read(conversation.id, username)
+    db.session.commit()
+
+    return jsonify(marked=marked)
+
+@bp.get('/conversations/<sender>/<recipient>/messages')
+@require_user
 def get_conversation_messages_by_users(sender, recipient):
-    """Returns JSON data of all messages in a conversation between the sender and recipient"""
+    """Returns JSON data of one page of messages in a conversation between
+    the sender and recipient, one of whom must be the caller. Takes the
+    same query params as /conversations/<conversation_id>/messages"""
 
-    conversation = Conversation.query.filter(
-        Conversation.user1.has(username=sender) & Conversation.user2.has(username=recipient)
-    ).first()
+    if g.user['username'] not in (sender, recipient):
+        return jsonify(message='Forbidden'), 403
 
-    if not conversation:
-        return jsonify(messages=[])
+    conversation = Conversation.find(sender, recipient)
 
-    messages = conversation.messages
-    serialized_messages = [message.serialize() for message in messages]
+    if not conversation:
+        return jsonify(messages=[], has_more=False)
 
-    return jsonify(messages=serialized_messages)
+    return conversation_messages_page(conversation.id)
 
 
+app = create_app()
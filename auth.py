@@ -0,0 +1,103 @@
+import os
+import time
+from functools import wraps
+from flask import request, jsonify, g
+from cache import LRUCache
+from helpers import decode_jwt
+from models import User
+
+
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', 10000))
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 60))
+
+# token -> verified username, so repeat requests skip the signature check
+token_cache = LRUCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+# username -> serialized user, so repeat requests skip the users query
+principal_cache = LRUCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+
+def verify_token(token):
+    """Returns the username a token was issued to, or None if the token is
+    invalid or expired. Results are cached until the token's exp or
+    AUTH_CACHE_TTL, whichever comes first."""
+
+    username = token_cache.get(token)
+    if username is not None:
+        return username
+
+    payload = decode_jwt(token)
+    if payload is None:
+        return None
+
+    username = payload['username']
+    token_cache.set(token, username,
+                    ttl=min(AUTH_CACHE_TTL, payload['exp'] - time.time()))
+
+    return username
+
+
+def get_principal(username):
+    """Returns the serialized user for `username`, or None if there isn't one"""
+
+    principal = principal_cache.get(username)
+    if principal is not None:
+        return principal
+
+    user = User.query.get(username)
+    if user is None:
+        return None
+
+    principal = user.serialize()
+    principal_cache.set(username, principal)
+
+    return principal
+
+
+def get_bearer_token(query_token=False):
+    """Returns the token from an `Authorization: Bearer <token>` header.
+
+    With `query_token`, falls back to a `?token=` query param, since
+    EventSource (used for the Server-Sent Events routes) can't set headers.
+    Other routes don't accept it, so tokens stay out of their urls and logs.
+    """
+
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+
+    if scheme.lower() != 'bearer' or not token:
+        if query_token:
+            return request.args.get('token') or None
+        return None
+
+    return token.strip()
+
+
+def require_user(view=None, *, query_token=False):
+    """Decorator for routes that need a valid JWT.
+
+    Puts the caller's serialized user on `g.user`. For routes with a
+    `username` url param, the token must belong to that user. Use
+    `@require_user(query_token=True)` on Server-Sent Events routes to also
+    accept `?token=`.
+    """
+
+    if view is None:
+        return lambda view: require_user(view, query_token=query_token)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = get_bearer_token(query_token)
+        username = verify_token(token) if token else None
+        principal = get_principal(username) if username else None
+
+        if principal is None:
+            return jsonify(message='Unauthorized'), 401
+
+        if 'username' in kwargs and kwargs['username'] != username:
+            return jsonify(message='Forbidden'), 403
+
+        g.user = principal
+
+        return view(*args, **kwargs)
+
+    return wrapper
@@ -1,18 +1,136 @@
 import logging
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from contextlib import contextmanager
+from flask import g, has_request_context
+import io
 import os
 import mimetypes
+import threading
+import time
 
 
-s3 = boto3.client(
-  "s3",
-  "us-east-1",
-  aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-  aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+bucket = os.getenv('BUCKET_NAME')
+
+MB = 1024 * 1024
+
+# Multipart kicks in at 8MB and sends up to 8 parts at once; smaller objects
+# go up in a single PUT.
+transfer_config = TransferConfig(
+    multipart_threshold=8 * MB,
+    multipart_chunksize=8 * MB,
+    max_concurrency=8,
+    use_threads=True,
 )
 
-bucket = os.getenv('BUCKET_NAME')
+# Every upload thread can have max_concurrency parts in flight at once, so
+# size the pool for all of them or botocore discards connections.
+S3_MAX_POOL_CONNECTIONS = int(os.getenv(
+    'S3_MAX_POOL_CONNECTIONS',
+    transfer_config.max_concurrency * int(os.getenv('IMAGE_UPLOAD_WORKERS', 6)),
+))
+
+s3_config = Config(
+    region_name=os.getenv('AWS_REGION', 'us-east-1'),
+    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+    retries={
+        'mode': 'adaptive',
+        'max_attempts': int(os.getenv('S3_MAX_ATTEMPTS', 5)),
+    },
+)
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+s3_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def get_s3_client():
+    """Returns this process's shared S3 client, creating it on first use.
+
+    boto3 clients are thread-safe but must not be shared across a fork, so a
+    new one is built whenever the pid changes (e.g. in each gunicorn worker).
+    """
+
+    global _client, _client_pid
+
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            session = boto3.session.Session(
+                aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+            )
+            _client = session.client('s3', config=s3_config)
+            _client_pid = pid
+
+    return _client
+
+
+def _reset_client_after_fork():
+    global _client, _client_pid, _client_lock, _metrics_lock
+
+    _client = None
+    _client_pid = None
+    _client_lock = threading.Lock()
+    _metrics_lock = threading.Lock()
+    s3_metrics.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_client_after_fork)
+
+
+def record_s3_bytes(operation, n):
+    """Adds `n` to the byte counter of an S3 operation"""
+
+    with _metrics_lock:
+        stats = s3_metrics.setdefault(operation, _new_stats())
+        stats['bytes'] += n
+
+
+def _new_stats():
+    return {'count': 0, 'errors': 0, 'seconds': 0.0, 'bytes': 0}
+
+
+@contextmanager
+def timed_s3(operation):
+    """Records the count, errors and wall time of an S3 operation, and
+    adds the time to the current request's metrics"""
+
+    start = time.perf_counter()
+    failed = False
+
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        with _metrics_lock:
+            stats = s3_metrics.setdefault(operation, _new_stats())
+            stats['count'] += 1
+            stats['seconds'] += elapsed
+            if failed:
+                stats['errors'] += 1
+
+        if has_request_context() and 'metrics' in g:
+            g.metrics['s3_seconds'] += elapsed
+
+
+def get_s3_metrics():
+    """Returns a snapshot of the per-operation S3 counters"""
+
+    with _metrics_lock:
+        return {op: dict(stats) for op, stats in s3_metrics.items()}
 
 
 def upload_file(file_name,
@@ -27,22 +145,62 @@ def upload_file(file_name,
     """
     
     mimetype, encoding = mimetypes.guess_type(file_name)
-    print(bucket);
 
     # If S3 object_name was not specified, use file_name
     if object_name is None:
         object_name = os.path.basename(file_name)
 
-    s3_client = s3
+    s3_client = get_s3_client()
 
     try:
-        response = s3_client.upload_file(file_name, bucket, object_name, ExtraArgs={'ContentDisposition': 'inline',
-                                                                                    'ContentType': mimetype})
+        with timed_s3('upload'):
+            response = s3_client.upload_file(file_name, bucket, object_name, ExtraArgs={'ContentDisposition': 'inline',
+                                                                                        'ContentType': mimetype},
+                                             Config=transfer_config,
+                                             Callback=lambda n: record_s3_bytes('upload', n))
         return response
     except ClientError as e:
         logging.error(e)
         return False
 
+def upload_fileobj(fileobj, object_name, bucket=bucket, content_type=None):
+    """Upload a readable binary file object to an S3 bucket
+
+    Streams straight from `fileobj` (multipart for large objects), nothing
+    is written to local disk.
+
+    :param fileobj: File-like object to upload
+    :param object_name: S3 object name
+    :param bucket: Bucket to upload to
+    :param content_type: MIME type. If not specified it is guessed from object_name
+    :return: True if file was uploaded, else False
+    """
+
+    if content_type is None:
+        content_type, encoding = mimetypes.guess_type(object_name)
+
+    extra_args = {'ContentDisposition': 'inline'}
+    if content_type:
+        extra_args['ContentType'] = content_type
+
+    try:
+        with timed_s3('upload'):
+            get_s3_client().upload_fileobj(
+                fileobj, bucket, object_name, ExtraArgs=extra_args,
+                Config=transfer_config,
+                Callback=lambda n: record_s3_bytes('upload', n),
+            )
+        return True
+    except ClientError as e:
+        logging.error(e)
+        return False
+
+def upload_bytes(data, object_name, bucket=bucket, content_type=None):
+    """Upload in-memory bytes to an S3 bucket. See upload_fileobj"""
+
+    return upload_fileobj(io.BytesIO(data), object_name, bucket=bucket,
+                          content_type=content_type)
+
 def download(file_name, bucket=bucket, object_name=None ):
     """Downloads file from AWS S3 bucket
     :param file_name: File to upload
@@ -54,15 +212,40 @@ def download(file_name, bucket=bucket, object_name=None ):
     if object_name is None:
         object_name = os.path.basename(file_name)
 
-    s3_client = s3
+    s3_client = get_s3_client()
 
-    output = s3_client.download_file(bucket, object_name, file_name)
+    with timed_s3('download'):
+        output = s3_client.download_file(bucket, object_name, file_name,
+                                         Callback=lambda n: record_s3_bytes('download', n))
 
     
     return output
 
+def download_fileobj(object_name, fileobj, bucket=bucket):
+    """Downloads an S3 object into a writable binary file object
+
+    :param object_name: S3 object name
+    :param fileobj: File-like object to write to
+    :param bucket: Bucket to download from
+    :return: True if downloaded, False if there is no such object
+    """
+
+    try:
+        with timed_s3('download'):
+            get_s3_client().download_fileobj(
+                bucket, object_name, fileobj, Config=transfer_config,
+                Callback=lambda n: record_s3_bytes('download', n),
+            )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return False
+        raise
+
 def list_all_files(bucket):
     contents = []
-    for item in s3.list_objects(Bucket=bucket)['Contents']:
+    with timed_s3('list'):
+        response = get_s3_client().list_objects(Bucket=bucket)
+    for item in response['Contents']:
         contents.append(item)
     return contents
\ No newline at end of file
@@ -0,0 +1,47 @@
+"""Per-request cost of require_user: a cold token and user (signature
+check and users query) versus the cached path.
+
+    python benchmarks/auth_overhead.py
+"""
+
+import argparse
+
+from common import configure, bench_app, seed_users, measure, report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    configure()
+    app = bench_app()
+    seed_users(1)
+
+    import auth
+    from auth import require_user
+    from helpers import create_jwt
+
+    view = require_user(lambda username: 'ok')
+    headers = {'Authorization': f'Bearer {create_jwt("user0")}'}
+
+    def authenticate(clear):
+        if clear:
+            auth.token_cache.clear()
+            auth.principal_cache.clear()
+        with app.test_request_context('/', headers=headers):
+            assert view(username='user0') == 'ok'
+
+    def no_auth():
+        with app.test_request_context('/', headers=headers):
+            pass
+
+    report('request context only (baseline)', measure(no_auth, repeat=args.repeat))
+    report('require_user, cold caches', measure(lambda: authenticate(True),
+                                                repeat=args.repeat))
+    report('require_user, cached', measure(lambda: authenticate(False),
+                                           repeat=args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Shared setup for the benchmark scripts in this directory.
+
+Run a benchmark from the repo root, e.g. `python benchmarks/rentals_pagination.py`.
+They use BENCH_DATABASE_URL if it is set (point it at a scratch Postgres
+database for production-like numbers), else a fresh SQLite file. Every run
+drops and recreates the tables.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+from sqlalchemy.exc import SAWarning
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# bcrypt hash of "password" at cost 4, so seeding users needs no hashing
+PASSWORD_HASH = '$2b$04$S53nngduJE6xy8MDDjCShu7xw8NpIqk7cyUVgsRf.cjun2MpNqU.6'
+
+
+def configure():
+    """Sets the environment the app modules read at import time. Call
+    before importing them."""
+
+    url = os.environ.get('BENCH_DATABASE_URL')
+    if not url:
+        fd, path = tempfile.mkstemp(prefix='sharebnb-bench-', suffix='.db')
+        os.close(fd)
+        url = f'sqlite:///{path}'
+
+    os.environ.setdefault('SECRET_KEY', 'bench-secret')
+    os.environ.setdefault('BUCKET_NAME', 'sharebnb-bench')
+    os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+    os.environ['DATABASE_URL'] = url
+    os.environ['TEST_DATABASE_URL'] = url
+
+    # The overlapping User/Message relationship warnings would bury the results
+    warnings.simplefilter('ignore', SAWarning)
+
+
+def bench_app(profile='test'):
+    """Returns a `profile` app with empty tables, and its context pushed"""
+
+    from app import create_app
+    from models import db
+
+    app = create_app(profile)
+    app.app_context().push()
+
+    db.drop_all()
+    db.create_all()
+
+    return app
+
+
+def seed_users(count):
+    """Inserts users user0..user{count-1}, password "password" """
+
+    from sqlalchemy import insert
+    from models import db, User
+
+    db.session.execute(insert(User), [
+        {'username': f'user{i}', 'email': f'user{i}@example.com',
+         'password': PASSWORD_HASH, 'location': 'Oakland'}
+        for i in range(count)
+    ])
+    db.session.commit()
+
+
+def seed_rentals(count, users=1000, batch_size=10000):
+    """Inserts `count` synthetic rentals (see bulk.generate_rows)"""
+
+    from sqlalchemy import insert
+    from bulk import generate_rows
+    from models import db, Rental
+
+    batch = []
+    for i, row in enumerate(generate_rows('rentals', count, users=users)):
+        batch.append({**row, 'url': f'rental-{i}.jpg'})
+        if len(batch) == batch_size:
+            db.session.execute(insert(Rental), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(Rental), batch)
+    db.session.commit()
+
+
+def measure(fn, repeat=50, warmup=5):
+    """Calls fn() `repeat` times after `warmup` untimed calls. Returns the
+    p50, p95 and mean wall time in milliseconds."""
+
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    samples.sort()
+
+    return {
+        'p50': samples[len(samples) // 2],
+        'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'mean': sum(samples) / len(samples),
+    }
+
+
+def report(name, stats):
+    print(f"{name:<44} p50 {stats['p50']:8.2f}ms   p95 {stats['p95']:8.2f}ms   "
+          f"mean {stats['mean']:8.2f}ms")
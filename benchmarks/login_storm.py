@@ -0,0 +1,102 @@
+"""GET /rentals latency before and during a storm of logins.
+
+bcrypt runs on its own process pool, so the storm should barely move
+/rentals latency; excess logins get a fast 429 instead of queueing.
+Serves the app on a local threaded server and hits it over HTTP.
+
+    python benchmarks/login_storm.py [--threads 32] [--seconds 10]
+"""
+
+import argparse
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+from common import configure, bench_app, seed_rentals, measure, report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rounds', type=int, default=12,
+                        help='bcrypt cost factor')
+    args = parser.parse_args()
+
+    # Real cost factor, and no login throttling, so every login hashes
+    os.environ['BCRYPT_LOG_ROUNDS'] = str(args.rounds)
+    os.environ['LOGIN_ATTEMPTS_PER_USERNAME'] = '1000000'
+    os.environ['LOGIN_ATTEMPTS_PER_IP'] = '1000000'
+    configure()
+    app = bench_app()
+
+    import bcrypt
+    from sqlalchemy import insert
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    from models import db, User
+    from passwords import get_pool
+
+    password_hash = bcrypt.hashpw(b'password', bcrypt.gensalt(args.rounds)).decode()
+    db.session.execute(insert(User), [
+        {'username': f'user{i}', 'email': f'user{i}@example.com',
+         'password': password_hash}
+        for i in range(100)
+    ])
+    db.session.commit()
+    seed_rentals(10000, users=100)
+    get_pool()
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    # Slow-request warnings for the logins would bury the results
+    app.logger.setLevel('ERROR')
+    server = make_server('127.0.0.1', 0, app, threaded=True,
+                         request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    def get_rentals():
+        with urllib.request.urlopen(f'{base}/rentals?sort=price') as response:
+            response.read()
+
+    report('/rentals, idle', measure(get_rentals, repeat=200))
+
+    outcomes = Counter()
+    stop = time.monotonic() + args.seconds
+
+    def storm(i):
+        body = f'{{"username": "user{i % 100}", "password": "password"}}'.encode()
+        while time.monotonic() < stop:
+            request = urllib.request.Request(
+                f'{base}/login', data=body,
+                headers={'Content-Type': 'application/json'})
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    outcomes[response.status] += 1
+            except urllib.error.HTTPError as e:
+                outcomes[e.code] += 1
+
+    threads = [threading.Thread(target=storm, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)
+
+    report(f'/rentals, {args.threads} threads logging in',
+           measure(get_rentals, repeat=200, warmup=0))
+
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    print(f'logins over {args.seconds:.0f}s: ' +
+          ', '.join(f'{count} x {status}' for status, count in sorted(outcomes.items())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""GET /rentals throughput under the dev and prod profiles.
+
+dev logs every query (written to /dev/null here) and runs the debug
+toolbar, as with `flask run --debug`; prod does neither.
+
+    python benchmarks/profiles.py [--requests 2000]
+"""
+
+import argparse
+import contextlib
+import os
+import time
+
+from common import configure, bench_app, seed_users, seed_rentals
+
+
+def throughput(app, requests):
+    """Returns GET /rentals requests per second, with the response cache
+    invalidated before each so every request queries the database"""
+
+    from response_cache import response_cache
+
+    client = app.test_client()
+    start = time.perf_counter()
+
+    for _ in range(requests):
+        response_cache.bump(['rentals'])
+        assert client.get('/rentals?sort=price').status_code == 200
+
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    configure()
+    bench_app()
+    seed_users(100)
+    seed_rentals(10000, users=100)
+
+    from app import create_app
+
+    results = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for profile in ('dev', 'prod'):
+            # Read when the app is created, before the toolbar checks it
+            os.environ['FLASK_DEBUG'] = '1' if profile == 'dev' else '0'
+            app = create_app(profile)
+            with app.app_context():
+                throughput(app, 50)
+                results[profile] = throughput(app, args.requests)
+
+    for profile, rate in results.items():
+        print(f'{profile:<6} {rate:8.0f} requests/s')
+    print(f'prod is {results["prod"] / results["dev"]:.1f}x dev')
+
+
+if __name__ == '__main__':
+    main()
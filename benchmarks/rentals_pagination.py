@@ -0,0 +1,60 @@
+"""GET /rentals first-page vs deep-page latency over 1M rentals.
+
+Keyset pagination should cost the same at any depth; an OFFSET query for
+the same deep page is timed alongside for comparison.
+
+    python benchmarks/rentals_pagination.py [--rentals 1000000]
+"""
+
+import argparse
+
+from common import configure, bench_app, seed_users, seed_rentals, measure, report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rentals', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    configure()
+    app = bench_app()
+
+    from helpers import encode_cursor
+    from models import db, Rental
+    from response_cache import response_cache
+
+    print(f'Seeding {args.rentals} rentals...')
+    seed_users(1000)
+    seed_rentals(args.rentals)
+
+    client = app.test_client()
+    deep_id = args.rentals - 100
+    deep_price = db.session.query(Rental.price).filter(Rental.id == deep_id).scalar()
+
+    cases = [
+        ('first page, sort=id', '/rentals'),
+        ('deep page, sort=id', f'/rentals?cursor={encode_cursor((deep_id,))}'),
+        ('first page, sort=price', '/rentals?sort=price'),
+        ('deep page, sort=price',
+         f'/rentals?sort=price&cursor={encode_cursor((deep_price, deep_id))}'),
+        ('first page, location filter', '/rentals?location=Austin,%20TX'),
+        ('first page, price range', '/rentals?min_price=1000&max_price=1200'),
+    ]
+
+    def get_uncached(url):
+        # Invalidate the response cache, so every call hits the database
+        response_cache.bump(['rentals'])
+        response = client.get(url)
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    for name, url in cases:
+        report(name, measure(lambda: get_uncached(url), repeat=args.repeat))
+
+    report('deep page via OFFSET (for comparison)', measure(
+        lambda: Rental.query.order_by(Rental.id).offset(deep_id).limit(20).all(),
+        repeat=args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Serializing 100k rows per model: ORM objects + serialize() + the
+stdlib encoder, against column rows + serialize_row() + FastJSONProvider
+(orjson when installed).
+
+    python benchmarks/serialization.py [--rows 100000]
+"""
+
+import argparse
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+from common import configure, bench_app, seed_users, seed_rentals
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100_000)
+    args = parser.parse_args()
+
+    configure()
+    app = bench_app()
+
+    from flask.json.provider import DefaultJSONProvider
+    from json_provider import FastJSONProvider
+    from models import db, Rental, Reservation, Message, Conversation
+
+    print(f'Seeding {args.rows} rows per model...')
+    seed_users(2)
+    seed_rentals(args.rows, users=2)
+    db.session.execute(insert(Reservation), [
+        {'rental_id': i % args.rows + 1, 'renter': 'user1',
+         'start_date': date(2030, 1, 1) + timedelta(days=2 * (i // args.rows)),
+         'end_date': date(2030, 1, 1) + timedelta(days=2 * (i // args.rows)),
+         'rating': i % 5 + 1}
+        for i in range(args.rows)
+    ])
+    conversation = Conversation.create_conversation('user0', 'user1')
+    db.session.flush()
+    db.session.execute(insert(Message), [
+        {'content': f'Message {i}', 'conversation_id': conversation.id,
+         'sender_username': 'user0', 'recipient_username': 'user1'}
+        for i in range(args.rows)
+    ])
+    db.session.commit()
+
+    stdlib = DefaultJSONProvider(app)
+    fast = FastJSONProvider(app)
+    print(f'fast encoder: {"orjson" if fast.orjson else "stdlib (orjson not installed)"}')
+    print(f'{"":<12} {"load + serialize":>18} {"encode":>10} {"total":>10}')
+
+    for model in (Rental, Reservation, Message):
+        db.session.expunge_all()
+        data, load_ms = timed(lambda: [obj.serialize() for obj in model.query])
+        _, encode_ms = timed(lambda: stdlib.dumps(data))
+        print(f'{model.__name__:<12} {load_ms:16.0f}ms {encode_ms:8.0f}ms '
+              f'{load_ms + encode_ms:8.0f}ms   ORM + stdlib')
+
+        data, load_ms = timed(lambda: [model.serialize_row(row) for row in
+                                       db.session.query(*model.row_columns())])
+        _, encode_ms = timed(lambda: fast.dumps(data))
+        print(f'{"":<12} {load_ms:16.0f}ms {encode_ms:8.0f}ms '
+              f'{load_ms + encode_ms:8.0f}ms   rows + fast provider')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""GET /users/<username>/profile query count and latency, against
+building the same profile from the lazy User relationships.
+
+    python benchmarks/user_profile.py [--rentals 1000] [--messages 5000]
+"""
+
+import argparse
+import threading
+from datetime import date, timedelta
+
+from sqlalchemy import event, insert
+from sqlalchemy.engine import Engine
+
+from common import configure, bench_app, seed_users, measure, report
+
+
+def count_queries(fn):
+    """Returns how many SQL statements one call of fn() runs"""
+
+    statements = []
+    thread = threading.get_ident()
+
+    def record(*args):
+        if threading.get_ident() == thread:
+            statements.append(args[2])
+
+    event.listen(Engine, 'before_cursor_execute', record)
+    try:
+        fn()
+    finally:
+        event.remove(Engine, 'before_cursor_execute', record)
+
+    return len(statements)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rentals', type=int, default=1000)
+    parser.add_argument('--reservations', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    configure()
+    app = bench_app()
+
+    from helpers import create_jwt
+    from models import db, User, Rental, Reservation, Message, Conversation
+
+    seed_users(51)
+    db.session.execute(insert(Rental), [
+        {'description': f'Yard {i}', 'location': 'Oakland', 'price': 100,
+         'owner_username': 'user0', 'url': f'yard-{i}.jpg'}
+        for i in range(args.rentals)
+    ])
+    db.session.execute(insert(Reservation), [
+        {'rental_id': 1, 'renter': 'user0',
+         'start_date': date(2030, 1, 1) + timedelta(days=2 * i),
+         'end_date': date(2030, 1, 1) + timedelta(days=2 * i)}
+        for i in range(args.reservations)
+    ])
+    conversations = [Conversation.create_conversation('user0', f'user{i}')
+                     for i in range(1, 51)]
+    db.session.flush()
+    db.session.execute(insert(Message), [
+        {'content': f'Hello {i}', 'conversation_id': conversations[i % 50].id,
+         'sender_username': f'user{i % 50 + 1}', 'recipient_username': 'user0'}
+        for i in range(args.messages)
+    ])
+    db.session.commit()
+
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {create_jwt("user0")}'}
+    url = '/users/user0/profile?include=rentals,reservations,messages'
+
+    def endpoint():
+        assert client.get(url, headers=headers).status_code == 200
+
+    def lazy_relationships():
+        # The per-relationship loading get_profile replaces
+        db.session.expunge_all()
+        user = db.session.get(User, 'user0')
+        rentals = [rental.serialize() for rental in user.rentals]
+        reservations = len(user.reservations)
+        upcoming = sum(r.end_date >= date.today() for r in user.reservations)
+        unread = sum(m.read_at is None for m in user.user_received_messages)
+        return rentals, reservations, upcoming, unread
+
+    endpoint()
+    print(f'queries: endpoint {count_queries(endpoint)}, '
+          f'lazy relationships {count_queries(lazy_relationships)}')
+
+    report('GET /users/<username>/profile (all sections)',
+           measure(endpoint, repeat=args.repeat))
+    report('lazy relationships (for comparison)',
+           measure(lazy_relationships, repeat=args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+import csv
+import json
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from models import db, User, Rental, Reservation, RATING_VALUES
+from helpers import parse_date
+from passwords import hash_password, hash_passwords
+from geo import geohash_encode
+
+
+# Rows inserted per executemany, and per commit
+BULK_CHUNK_SIZE = 1000
+
+# Errors listed in a bulk API response; the rest are only counted
+BULK_MAX_REPORTED_ERRORS = 1000
+
+# Largest value an INTEGER column holds
+INTEGER_MAX = 2 ** 31 - 1
+
+# Errors that reject a row rather than the whole chunk: constraint
+# violations, and values the column can't hold
+ROW_ERRORS = (IntegrityError, DataError)
+
+
+def iter_rows(stream, fmt):
+    """Yields (row_number, row) for each row of a text stream.
+
+    `fmt` is "csv" (with a header row) or "ndjson". A row that can't be
+    parsed is yielded as a ValueError instead of a dict.
+    """
+
+    if fmt == 'csv':
+        for row_number, row in enumerate(csv.DictReader(stream), start=1):
+            yield row_number, row
+        return
+
+    for row_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield row_number, json.loads(line)
+        except ValueError:
+            yield row_number, ValueError('Invalid JSON')
+
+
+def _required(row, field):
+    value = row.get(field)
+
+    if value is None or value == '':
+        raise ValueError(f'{field} is required')
+
+    return value
+
+
+def _optional(row, field):
+    value = row.get(field)
+
+    return None if value == '' else value
+
+
+def _fits(model, field, value):
+    """Checks a string value against its column's length, if it has one"""
+
+    length = model.__table__.c[field].type.length
+    if value is not None and length is not None and len(value) > length:
+        raise ValueError(f'{field} must be at most {length} characters')
+
+    return value
+
+
+def validate_user(row):
+    """Returns the users table values for a row. Takes `password_hash`, or a
+    plain `password` that is hashed before insert."""
+
+    values = {
+        'username': str(_required(row, 'username')),
+        'email': str(_required(row, 'email')),
+        'location': _optional(row, 'location'),
+        'bio': _optional(row, 'bio'),
+        'image_url': _optional(row, 'image_url'),
+        'password': _optional(row, 'password_hash'),
+    }
+
+    if values['password'] is None:
+        values['password_plain'] = str(_required(row, 'password'))
+
+    return values
+
+
+def validate_rental(row):
+    """Returns the rentals table values for a row"""
+
+    price = int(_required(row, 'price'))
+    if not 0 <= price <= INTEGER_MAX:
+        raise ValueError(f'price must be from 0 to {INTEGER_MAX}')
+
+    latitude = _optional(row, 'latitude')
+    longitude = _optional(row, 'longitude')
+    if (latitude is None) != (longitude is None):
+        raise ValueError('latitude and longitude must be given together')
+
+    geohash = None
+    if latitude is not None:
+        latitude, longitude = float(latitude), float(longitude)
+        if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            raise ValueError('latitude/longitude out of range')
+        geohash = geohash_encode(latitude, longitude)
+
+    return {
+        'description': str(_required(row, 'description')),
+        'location': _fits(Rental, 'location', str(_required(row, 'location'))),
+        'price': price,
+        'owner_username': str(_required(row, 'owner_username')),
+        'url': _fits(Rental, 'url', _optional(row, 'url')),
+        'latitude': latitude,
+        'longitude': longitude,
+        'geohash': geohash,
+    }
+
+
+def validate_reservation(row):
+    """Returns the reservations table values for a row"""
+
+    start_date = parse_date(str(_required(row, 'start_date')))
+    end_date = parse_date(str(_required(row, 'end_date')))
+    if end_date < start_date:
+        raise ValueError('end_date is before start_date')
+
+    rating = _optional(row, 'rating')
+    if rating is not None:
+        rating = int(rating)
+        if rating not in RATING_VALUES:
+            raise ValueError('Rating must be a whole number from 1 to 5')
+
+    rental_id = int(_required(row, 'rental_id'))
+    if not 0 < rental_id <= INTEGER_MAX:
+        raise ValueError('rental_id out of range')
+
+    return {
+        'rental_id': rental_id,
+        'renter': str(_required(row, 'renter')),
+        'start_date': start_date,
+        'end_date': end_date,
+        'rating': rating,
+    }
+
+
+def hash_user_passwords(values):
+    """Hashes the plain passwords of a chunk of users across the bcrypt pool"""
+
+    plain = [v for v in values if 'password_plain' in v]
+    if not plain:
+        return
+
+    hashes = hash_passwords([v.pop('password_plain') for v in plain])
+    for v, hashed in zip(plain, hashes):
+        v['password'] = hashed
+
+
+def record_reservation_ratings(values):
+    """Adds the ratings of inserted reservations to their rentals' aggregates,
+    one UPDATE per rental"""
+
+    ratings = defaultdict(list)
+    for v in values:
+        if v['rating'] is not None:
+            ratings[v['rental_id']].append(v['rating'])
+
+    for rental_id, rental_ratings in ratings.items():
+        Rental.record_ratings(rental_id, rental_ratings)
+
+
+BULK_MODELS = {
+    'users': (User, validate_user, hash_user_passwords, None),
+    'rentals': (Rental, validate_rental, None, None),
+    'reservations': (Reservation, validate_reservation, None, record_reservation_ratings),
+}
+
+
+def _insert_chunk(model, chunk, errors, after_insert):
+    """Inserts a chunk with one executemany. If the database rejects a row,
+    retries row by row so only the bad rows are reported. Commits."""
+
+    values = [v for row_number, v in chunk]
+
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(model), values)
+        inserted = values
+    except ROW_ERRORS:
+        inserted = []
+        for row_number, v in chunk:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(model), [v])
+                inserted.append(v)
+            except ROW_ERRORS as e:
+                errors.append({'row': row_number, 'error': str(e.orig).strip().splitlines()[0]})
+
+    if after_insert and inserted:
+        after_insert(inserted)
+
+    db.session.commit()
+
+    return len(inserted)
+
+
+def load_rows(kind, rows, override=None, chunk_size=BULK_CHUNK_SIZE):
+    """Validates and inserts rows of a kind ("users", "rentals" or
+    "reservations") in chunks.
+
+    `rows` yields (row_number, row) as from iter_rows. `override` values
+    replace each row's (e.g. the owner for a user's own upload). Returns
+    (inserted_count, errors), errors being [{"row": n, "error": msg}].
+    """
+
+    model, validate, before_insert, after_insert = BULK_MODELS[kind]
+
+    inserted = 0
+    errors = []
+    chunk = []
+
+    def flush():
+        values = [v for row_number, v in chunk]
+        if before_insert:
+            before_insert(values)
+        return _insert_chunk(model, chunk, errors, after_insert)
+
+    for row_number, row in rows:
+        try:
+            if isinstance(row, Exception):
+                raise row
+            if not isinstance(row, dict):
+                raise ValueError('Row must be an object')
+            if override:
+                row = {**row, **override}
+            chunk.append((row_number, validate(row)))
+        except (ValueError, TypeError) as e:
+            errors.append({'row': row_number, 'error': str(e)})
+
+        if len(chunk) >= chunk_size:
+            inserted += flush()
+            chunk = []
+
+    if chunk:
+        inserted += flush()
+
+    return inserted, errors
+
+
+##############################################################################
+# Synthetic data for load tests
+
+CITIES = [
+    ('San Francisco, CA', 37.7749, -122.4194),
+    ('New York, NY', 40.7128, -74.0060),
+    ('Miami, FL', 25.7617, -80.1918),
+    ('Austin, TX', 30.2672, -97.7431),
+    ('Seattle, WA', 47.6062, -122.3321),
+    ('Chicago, IL', 41.8781, -87.6298),
+]
+
+ADJECTIVES = ['Sunny', 'Quiet', 'Spacious', 'Private', 'Shady', 'Cozy', 'Lush']
+SPACES = ['backyard', 'patio', 'garden', 'rooftop', 'pool', 'lawn', 'deck']
+
+
+def generate_rows(kind, count, users=1000, rentals=1000, seed=0):
+    """Yields `count` synthetic rows of a kind.
+
+    Users are user0..user{count-1} with password "password". Rentals are
+    owned by user0..user{users-1}; reservations point at rental ids
+    1..rentals and never overlap.
+    """
+
+    rng = random.Random(seed)
+
+    if kind == 'users':
+        password_hash = hash_password('password')
+        for i in range(count):
+            city = rng.choice(CITIES)[0]
+            yield {
+                'username': f'user{i}',
+                'email': f'user{i}@example.com',
+                'password_hash': password_hash,
+                'location': city,
+                'bio': f'Load test user {i}',
+            }
+
+    elif kind == 'rentals':
+        for i in range(count):
+            city, lat, lon = rng.choice(CITIES)
+            yield {
+                'description': f'{rng.choice(ADJECTIVES)} {rng.choice(SPACES)} #{i}',
+                'location': city,
+                'price': rng.randrange(50, 5000, 50),
+                'owner_username': f'user{rng.randrange(users)}',
+                'latitude': round(lat + rng.uniform(-0.2, 0.2), 6),
+                'longitude': round(lon + rng.uniform(-0.2, 0.2), 6),
+            }
+
+    elif kind == 'reservations':
+        first_day = date(2024, 1, 1)
+        for i in range(count):
+            # Each rental's reservations are back to back, 3 days apart
+            start = first_day + timedelta(days=3 * (i // rentals))
+            yield {
+                'rental_id': i % rentals + 1,
+                'renter': f'user{rng.randrange(users)}',
+                'start_date': start.isoformat(),
+                'end_date': (start + timedelta(days=1)).isoformat(),
+                'rating': rng.choice([None, *RATING_VALUES]),
+            }
+
+
+##############################################################################
+# CLI: flask bulk load / flask bulk generate
+
+KINDS = click.Choice(sorted(BULK_MODELS))
+
+
+@click.group('bulk')
+def bulk_cli():
+    """Bulk load and synthetic data commands."""
+
+
+@bulk_cli.command('load')
+@click.argument('kind', type=KINDS)
+@click.argument('path', type=click.Path(allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']),
+              help='Defaults to csv for .csv files, else ndjson.')
+@click.option('--chunk-size', default=BULK_CHUNK_SIZE, show_default=True)
+@with_appcontext
+def load_command(kind, path, fmt, chunk_size):
+    """Load KIND rows from an NDJSON or CSV file (- for stdin)."""
+
+    fmt = fmt or ('csv' if path.endswith('.csv') else 'ndjson')
+
+    with click.open_file(path, newline='', encoding='utf-8') as f:
+        start = time.perf_counter()
+        inserted, errors = load_rows(kind, iter_rows(f, fmt), chunk_size=chunk_size)
+        elapsed = time.perf_counter() - start
+
+    for error in errors[:BULK_MAX_REPORTED_ERRORS]:
+        click.echo(f"row {error['row']}: {error['error']}", err=True)
+
+    click.echo(f'{inserted} {kind} inserted, {len(errors)} rejected in '
+               f'{elapsed:.2f}s ({inserted / elapsed if elapsed else 0:.0f} rows/sec)')
+
+
+@bulk_cli.command('generate')
+@click.argument('kind', type=KINDS)
+@click.argument('count', type=int)
+@click.option('--users', default=1000, show_default=True,
+              help='Number of users rows may refer to.')
+@click.option('--rentals', default=1000, show_default=True,
+              help='Number of rentals reservations may refer to.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--out', type=click.Path(allow_dash=True), default='-')
+def generate_command(kind, count, users, rentals, seed, out):
+    """Write COUNT synthetic KIND rows as NDJSON."""
+
+    with click.open_file(out, 'w', encoding='utf-8') as f:
+        for row in generate_rows(kind, count, users=users, rentals=rentals, seed=seed):
+            f.write(json.dumps(row) + '\n')
@@ -0,0 +1,91 @@
+import os
+from functools import partial
+from dotenv import load_dotenv
+from routing import replica_binds
+
+load_dotenv()
+
+
+def engine_options(database_url, pool_size, max_overflow, statement_timeout_ms):
+    """Returns SQLALCHEMY_ENGINE_OPTIONS for `database_url`.
+
+    Pool sizing and the statement timeout only apply to Postgres; SQLite
+    (used for local runs and tests) keeps SQLAlchemy's defaults.
+    """
+
+    if not database_url or database_url.startswith('sqlite'):
+        return {}
+
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+        'connect_args': {'options': f'-c statement_timeout={statement_timeout_ms}'},
+    }
+
+
+# Pool settings per profile, for the primary and every replica alike
+DEFAULT_POOL = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    'statement_timeout_ms': int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000)),
+}
+TEST_POOL = {'pool_size': 5, 'max_overflow': 0, 'statement_timeout_ms': 30000}
+PROD_POOL = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+    'statement_timeout_ms': int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000)),
+}
+
+
+class Config:
+    """Settings shared by every profile"""
+
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    # Comma separated read replica urls; GET requests read from them
+    SQLALCHEMY_BINDS = replica_binds(os.environ.get('DATABASE_REPLICA_URLS'),
+                                     partial(engine_options, **DEFAULT_POOL))
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, **DEFAULT_POOL)
+
+    # Loads flask_debugtoolbar when True
+    DEBUG_TOOLBAR = False
+
+    # Requests slower than this are logged with their query counts
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+
+
+class DevConfig(Config):
+    """Local development: logs every query and shows the debug toolbar"""
+
+    SQLALCHEMY_ECHO = True
+    DEBUG_TOOLBAR = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = True
+
+
+class TestConfig(Config):
+    """Test runs, against TEST_DATABASE_URL (in-memory SQLite by default)"""
+
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', 'sqlite://')
+    SQLALCHEMY_BINDS = replica_binds(os.environ.get('TEST_DATABASE_REPLICA_URLS'),
+                                     partial(engine_options, **TEST_POOL))
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, **TEST_POOL)
+
+
+class ProdConfig(Config):
+    """Production: no query logging or dev extensions, larger pool"""
+
+    SQLALCHEMY_BINDS = replica_binds(os.environ.get('DATABASE_REPLICA_URLS'),
+                                     partial(engine_options, **PROD_POOL))
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(Config.SQLALCHEMY_DATABASE_URI, **PROD_POOL)
+
+
+PROFILES = {
+    'dev': DevConfig,
+    'test': TestConfig,
+    'prod': ProdConfig,
+}
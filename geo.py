@@ -0,0 +1,114 @@
+import math
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Length of the geohash stored on each rental (~4cm cells)
+GEOHASH_PRECISION = 12
+
+EARTH_RADIUS_KM = 6371.0
+
+KM_PER_DEGREE_LAT = 111.32
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    """Returns the geohash of a point"""
+
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    n_bits = 0
+    even = True
+
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+
+        if value >= mid:
+            bits = bits * 2 + 1
+            rng[0] = mid
+        else:
+            bits = bits * 2
+            rng[1] = mid
+
+        even = not even
+        n_bits += 1
+
+        if n_bits == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            n_bits = 0
+
+    return ''.join(chars)
+
+
+def cell_size_degrees(precision):
+    """Returns (lat_degrees, lon_degrees) of a geohash cell"""
+
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+
+    return 180 / 2 ** lat_bits, 360 / 2 ** lon_bits
+
+
+def covering_prefixes(lat, lon, radius_km):
+    """Returns geohash prefixes whose cells together cover the circle.
+
+    Picks the longest prefix whose cells are at least radius_km across,
+    then takes the cell holding the center and its 8 neighbours.
+    """
+
+    lon_scale = max(math.cos(math.radians(lat)), 0.01)
+    precision = 1
+
+    for p in range(GEOHASH_PRECISION, 0, -1):
+        lat_deg, lon_deg = cell_size_degrees(p)
+        if (lat_deg * KM_PER_DEGREE_LAT >= radius_km
+                and lon_deg * KM_PER_DEGREE_LAT * lon_scale >= radius_km):
+            precision = p
+            break
+
+    lat_deg, lon_deg = cell_size_degrees(precision)
+    prefixes = set()
+
+    for d_lat in (-lat_deg, 0, lat_deg):
+        for d_lon in (-lon_deg, 0, lon_deg):
+            p_lat = max(-90.0, min(90.0, lat + d_lat))
+            p_lon = (lon + d_lon + 180) % 360 - 180
+            prefixes.add(geohash_encode(p_lat, p_lon, precision))
+
+    return sorted(prefixes)
+
+
+def bounding_box(lat, lon, radius_km):
+    """Returns (min_lat, max_lat, min_lon, max_lon) of a box holding the
+    circle. The longitudes are None when the box reaches a pole or crosses
+    the antimeridian, where every longitude has to be searched."""
+
+    d_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = lat - d_lat, lat + d_lat
+
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), None, None
+
+    # Widest at the edge nearest a pole
+    d_lon = d_lat / math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    min_lon, max_lon = lon - d_lon, lon + d_lon
+
+    if min_lon < -180 or max_lon > 180:
+        return min_lat, max_lat, None, None
+
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points, in km"""
+
+    d_lat = math.radians(lat2 - lat1)
+    d_lon = math.radians(lon2 - lon1)
+    a = (math.sin(d_lat / 2) ** 2
+         + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2))
+         * math.sin(d_lon / 2) ** 2)
+
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
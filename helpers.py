@@ -1,22 +1,85 @@
 import jwt
 from dotenv import load_dotenv
 import os
+import base64
+import json
+import time
+from datetime import datetime
 
 load_dotenv()
 
 secret = os.environ['SECRET_KEY']
 
+JWT_EXPIRES_SECONDS = int(os.getenv('JWT_EXPIRES_SECONDS', 7 * 24 * 60 * 60))
+
 def create_jwt(username):
     """Creates jwt for user"""
 
+    now = int(time.time())
+
     payload = {
-        "username": username
+        "username": username,
+        "iat": now,
+        "exp": now + JWT_EXPIRES_SECONDS,
     }
     token = jwt.encode(payload, secret, algorithm="HS256")
 
 
     return token
 
+def decode_jwt(token):
+    """Verifies a HS256 jwt and returns its payload, or None if it is
+    invalid, expired or missing a username"""
+
+    try:
+        payload = jwt.decode(token, secret, algorithms=["HS256"],
+                             options={"require": ["exp", "iat"]})
+    except jwt.InvalidTokenError:
+        return None
+
+    if not isinstance(payload.get("username"), str):
+        return None
+
+    return payload
+
+def parse_date(value):
+    """Parses a 'YYYY-MM-DD' (or legacy 'M/D/YYYY') string into a date.
+
+    Raises ValueError if it is neither.
+    """
+
+    for fmt in ('%Y-%m-%d', '%m/%d/%Y'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+
+    raise ValueError(f'Invalid date: {value}')
+
+def encode_cursor(key):
+    """Encodes a keyset pagination key (tuple of values) as an opaque string"""
+
+    raw = json.dumps(list(key), separators=(',', ':')).encode('utf-8')
+
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """Decodes a cursor made by encode_cursor back into a tuple.
+
+    Raises ValueError if the cursor is malformed.
+    """
+
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+    if not isinstance(key, list) or not all(
+            isinstance(k, (int, float)) and not isinstance(k, bool) for k in key):
+        raise ValueError('Invalid cursor')
+
+    return tuple(key)
+
 # import jwt
 # >>> encoded_jwt = jwt.encode({"some": "payload"}, "secret", algorithm="HS256")
 # >>> print(encoded_jwt)
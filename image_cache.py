@@ -0,0 +1,196 @@
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from PIL import Image
+from aws import download_fileobj
+
+
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', 'rental_pics/cache')
+
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+IMAGE_MAX_DIMENSION = 2000
+
+IMAGE_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+}
+
+class UnreadableImage(Exception):
+    """The original can't be decoded, so it can't be resized or converted"""
+
+
+# Requests for the same file wait on one of these instead of each fetching
+# from S3 or resizing.
+_file_locks = [threading.Lock() for _ in range(64)]
+
+
+class DiskLRU:
+    """Directory of cached files, evicting the least recently used once
+    they add up to more than `max_bytes`.
+
+    Each process keeps its own index, so files another process evicts are
+    just treated as misses.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._sizes = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+
+        for mtime, name, size in sorted(entries):
+            self._sizes[name] = size
+            self._total += size
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def get(self, name):
+        """Returns the path of a cached file, or None"""
+
+        path = self.path(name)
+
+        with self._lock:
+            if name not in self._sizes:
+                return None
+            if not os.path.exists(path):
+                self._total -= self._sizes.pop(name)
+                return None
+            self._sizes.move_to_end(name)
+
+        return path
+
+    def put(self, name, write):
+        """Caches the file `write(f)` writes and returns its path.
+
+        Writes to a temp file first so readers never see a partial file.
+        """
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if write(f) is False:
+                    os.remove(tmp_path)
+                    return None
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self.path(name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._total += size - self._sizes.pop(name, 0)
+            self._sizes[name] = size
+            self._evict()
+
+        return self.path(name)
+
+    def _evict(self):
+        while self._total > self.max_bytes and len(self._sizes) > 1:
+            name, size = self._sizes.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the image disk cache, creating it on first use"""
+
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiskLRU(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
+
+    return _cache
+
+
+def _cached(name, write):
+    """Returns the cached file `name`, making it with `write` on a miss"""
+
+    cache = get_cache()
+    path = cache.get(name)
+    if path is not None:
+        return path
+
+    with _file_locks[hash(name) % len(_file_locks)]:
+        path = cache.get(name)
+        if path is None:
+            path = cache.put(name, write)
+
+    return path
+
+
+def get_original(key):
+    """Returns the path of the cached S3 original, or None if there is no
+    such object. Each original is fetched from S3 once while cached."""
+
+    name = 'original-' + hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    return _cached(name, lambda f: download_fileobj(key, f))
+
+
+def get_variant(key, width=None, height=None, fmt=None):
+    """Returns (path, mimetype) of the image `key` fit within width x height
+    (never upscaled) and encoded as `fmt` ("webp", "jpeg" or "png"), or
+    None if there is no such image.
+
+    Raises UnreadableImage if the original isn't an image Pillow can
+    decode, and FileNotFoundError if the original was evicted before it
+    could be read (fetching it again fixes that).
+    """
+
+    original = get_original(key)
+    if original is None:
+        return None
+
+    if width is None and height is None and fmt is None:
+        return original, mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+    def write(f):
+        try:
+            img = Image.open(original)
+            img.load()
+        except FileNotFoundError:
+            raise
+        except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+            raise UnreadableImage(key) from e
+
+        with img:
+            pil_format = IMAGE_FORMATS[fmt][0] if fmt else img.format
+            img.thumbnail((width or IMAGE_MAX_DIMENSION, height or IMAGE_MAX_DIMENSION))
+
+            if pil_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+
+            img.save(f, format=pil_format)
+
+    variant = f'{key}|{width}|{height}|{fmt}'
+    name = 'variant-' + hashlib.sha1(variant.encode('utf-8')).hexdigest()
+
+    path = _cached(name, write)
+    mimetype = IMAGE_FORMATS[fmt][1] if fmt else mimetypes.guess_type(key)[0]
+
+    return path, mimetype or 'application/octet-stream'
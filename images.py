@@ -0,0 +1,106 @@
+import base64
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from PIL import Image
+from models import db, Rental
+from aws import upload_bytes
+
+
+# Longest edge, in pixels, of each variant we upload. "full" keeps the
+# original S3 key so existing image urls keep working.
+IMAGE_VARIANTS = {
+    'thumbnail': 200,
+    'medium': 800,
+    'full': 1600,
+}
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+UPLOAD_WORKERS = int(os.getenv('IMAGE_UPLOAD_WORKERS', 6))
+
+image_pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS,
+                                thread_name_prefix='rental-image')
+upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS,
+                                 thread_name_prefix='rental-image-upload')
+
+
+def variant_key(url, variant):
+    """Returns the S3 object name for a variant of a rental photo"""
+
+    if variant == 'full':
+        return url
+
+    return f'{variant}/{url}'
+
+
+def make_variants(img_bytes):
+    """Resizes an image into each of IMAGE_VARIANTS.
+
+    Returns a dict of variant name -> encoded image bytes. Images are never
+    upscaled and keep their original format.
+    """
+
+    original = Image.open(BytesIO(img_bytes))
+    original.load()
+    fmt = original.format or 'JPEG'
+
+    variants = {}
+
+    for variant, size in IMAGE_VARIANTS.items():
+        img = original.copy()
+        img.thumbnail((size, size))
+
+        if fmt == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        out = BytesIO()
+        img.save(out, format=fmt)
+        variants[variant] = out.getvalue()
+
+    return variants
+
+
+def upload_variant(url, variant, data):
+    """Uploads one variant to S3. Returns False if the upload failed"""
+
+    return upload_bytes(data, variant_key(url, variant))
+
+
+def set_image_status(rental_id, status):
+    """Updates the image_status of a rental and commits"""
+
+    rental = db.session.get(Rental, rental_id)
+    rental.image_status = status
+    db.session.commit()
+
+
+def process_rental_image(app, rental_id, photo_data):
+    """Decodes, resizes and uploads a rental photo, then marks the rental's
+    image_status "ready" (or "failed")"""
+
+    with app.app_context():
+        set_image_status(rental_id, 'processing')
+
+        try:
+            encoded = photo_data['bytes'].split(',', 1)[1].strip()
+            variants = make_variants(base64.b64decode(encoded))
+
+            uploads = [
+                upload_pool.submit(upload_variant, photo_data['url'], variant, data)
+                for variant, data in variants.items()
+            ]
+
+            results = [u.result() for u in uploads]
+            status = 'failed' if False in results else 'ready'
+        except Exception:
+            logging.exception('Processing image for rental %s failed', rental_id)
+            status = 'failed'
+
+        set_image_status(rental_id, status)
+
+
+def submit_rental_image(app, rental_id, photo_data):
+    """Queues a rental photo for processing on the background image pool"""
+
+    return image_pool.submit(process_rental_image, app, rental_id, photo_data)
@@ -0,0 +1,49 @@
+from flask.json.provider import DefaultJSONProvider
+
+
+# dumps() arguments orjson can honour; separators are ignored since orjson
+# output is always compact
+ORJSON_DUMPS_ARGS = {'default', 'indent', 'separators'}
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes and decodes with orjson when it is
+    installed (pip install orjson), and with the stdlib json module
+    otherwise.
+
+    orjson output has the same keys, key order and values as the default
+    provider (dates still go through its `default`), but is always compact
+    and leaves non-ASCII characters unescaped.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+
+        try:
+            import orjson
+        except ImportError:
+            orjson = None
+
+        self.orjson = orjson
+
+    def dumps(self, obj, **kwargs):
+        # Any other argument is a stdlib-only option
+        if (self.orjson is None or set(kwargs) - ORJSON_DUMPS_ARGS
+                or kwargs.get('indent') not in (None, 2)):
+            return super().dumps(obj, **kwargs)
+
+        option = self.orjson.OPT_PASSTHROUGH_DATETIME | self.orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= self.orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= self.orjson.OPT_INDENT_2
+
+        return self.orjson.dumps(
+            obj, default=kwargs.get('default', self.default), option=option,
+        ).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if self.orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+
+        return self.orjson.loads(s)
@@ -0,0 +1,283 @@
+import threading
+import time
+from urllib.parse import urlencode
+from flask import current_app, g, has_request_context, request, stream_with_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from aws import get_s3_metrics
+from json_provider import FastJSONProvider
+from response_cache import get_response_cache_stats
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    """Prometheus counter with labels"""
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+
+        return lines
+
+
+class Histogram:
+    """Prometheus histogram with labels"""
+
+    def __init__(self, name, help, buckets, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            stats = self._values.get(labels)
+            if stats is None:
+                stats = self._values[labels] = {
+                    'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0}
+
+            # Bucket counts are cumulative: each counts values <= its bound
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    stats['buckets'][i] += 1
+            stats['count'] += 1
+            stats['sum'] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+
+        with self._lock:
+            items = sorted((labels, {**stats, 'buckets': list(stats['buckets'])})
+                           for labels, stats in self._values.items())
+
+        for labels, stats in items:
+            for bound, count in zip((*self.buckets, '+Inf'),
+                                    (*stats['buckets'], stats['count'])):
+                lines.append(f'{self.name}_bucket'
+                             f'{_labels(self.labelnames, labels, [("le", bound)])} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {stats["sum"]}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {stats["count"]}')
+
+        return lines
+
+
+REQUEST_LABELS = ('endpoint', 'method')
+
+requests_total = Counter(
+    'sharebnb_requests_total', 'Requests handled.',
+    ('endpoint', 'method', 'status'))
+request_seconds = Histogram(
+    'sharebnb_request_duration_seconds', 'Time to build each response.',
+    LATENCY_BUCKETS, REQUEST_LABELS)
+request_db_queries = Histogram(
+    'sharebnb_request_db_queries', 'Database queries run per request.',
+    QUERY_COUNT_BUCKETS, REQUEST_LABELS)
+request_db_seconds = Histogram(
+    'sharebnb_request_db_seconds', 'Time spent in database queries per request.',
+    LATENCY_BUCKETS, REQUEST_LABELS)
+request_serialization_seconds = Histogram(
+    'sharebnb_request_serialization_seconds', 'Time spent encoding JSON per request.',
+    LATENCY_BUCKETS, REQUEST_LABELS)
+request_s3_seconds = Histogram(
+    'sharebnb_request_s3_seconds', 'Time spent in S3 operations per request.',
+    LATENCY_BUCKETS, REQUEST_LABELS)
+slow_requests_total = Counter(
+    'sharebnb_slow_requests_total', 'Requests slower than SLOW_REQUEST_MS.',
+    REQUEST_LABELS)
+
+REQUEST_METRICS = (requests_total, request_seconds, request_db_queries,
+                   request_db_seconds, request_serialization_seconds,
+                   request_s3_seconds, slow_requests_total)
+
+
+
+def record_serialization(seconds):
+    """Adds JSON encoding time to the current request's totals"""
+
+    if has_request_context() and 'metrics' in g:
+        g.metrics['serialization_seconds'] += seconds
+
+
+class TimedJSONProvider(FastJSONProvider):
+    """Flask JSON provider (orjson when installed) that records how long
+    encoding takes"""
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            record_serialization(time.perf_counter() - start)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+
+    if has_request_context() and 'metrics' in g:
+        g.metrics['db_queries'] += 1
+        g.metrics['db_seconds'] += elapsed
+
+
+def start_request_metrics():
+    g.metrics = {
+        'start': time.perf_counter(),
+        'db_queries': 0,
+        'db_seconds': 0.0,
+        'serialization_seconds': 0.0,
+        's3_seconds': 0.0,
+    }
+
+
+def stream_with_metrics(generator):
+    """Wraps a streamed response body (as stream_with_context) so the
+    queries and JSON encoding done while it is sent count towards its
+    request's metrics"""
+
+    stats = g.get('metrics')
+    if stats is not None:
+        stats['streamed'] = True
+
+    def generate():
+        # Flask may push a fresh app context, and so a fresh g, for the stream
+        if stats is not None:
+            g.metrics = stats
+        yield from generator
+
+    return stream_with_context(generate())
+
+
+def logged_path():
+    """Returns the request's path and query string, minus any `?token=`
+    (a JWT, on the Server-Sent Events routes)"""
+
+    if 'token' not in request.args:
+        return request.full_path
+
+    args = [(key, value) for key, value in request.args.items(multi=True)
+            if key != 'token']
+
+    return f'{request.path}?{urlencode(args)}'
+
+
+def finish_request_metrics(response):
+    """Records the request's metrics, and logs it if it was slow.
+
+    A body from stream_with_metrics is generated as it is sent, after this
+    returns, so its request is recorded once the response is closed.
+    """
+
+    stats = g.pop('metrics', None)
+    if stats is None:
+        return response
+
+    app = current_app._get_current_object()
+    labels = (request.endpoint or 'unknown', request.method)
+    path = logged_path()
+
+    if stats.get('streamed') and response.is_streamed:
+        # Put back for stream_with_metrics to add to
+        g.metrics = stats
+        response.call_on_close(
+            lambda: record_request(app, stats, labels, response.status_code, path))
+    else:
+        record_request(app, stats, labels, response.status_code, path)
+
+    return response
+
+
+def record_request(app, stats, labels, status_code, path):
+    """Adds a finished request to the metrics. Runs outside the request
+    for streamed responses, so takes what it needs as arguments."""
+
+    elapsed = time.perf_counter() - stats['start']
+
+    requests_total.inc((*labels, str(status_code)))
+    request_seconds.observe(labels, elapsed)
+    request_db_queries.observe(labels, stats['db_queries'])
+    request_db_seconds.observe(labels, stats['db_seconds'])
+    request_serialization_seconds.observe(labels, stats['serialization_seconds'])
+    request_s3_seconds.observe(labels, stats['s3_seconds'])
+
+    if elapsed * 1000 > app.config['SLOW_REQUEST_MS']:
+        slow_requests_total.inc(labels)
+        app.logger.warning(
+            'Slow request: %s %s took %.0fms (%d queries, %.0fms in db, '
+            '%.0fms encoding JSON, %.0fms in S3)',
+            labels[1], path, elapsed * 1000,
+            stats['db_queries'], stats['db_seconds'] * 1000,
+            stats['serialization_seconds'] * 1000, stats['s3_seconds'] * 1000)
+
+
+def init_app(app):
+    """Times every request of `app`"""
+
+    app.json = TimedJSONProvider(app)
+    app.before_request(start_request_metrics)
+    app.after_request(finish_request_metrics)
+
+
+def render_metrics():
+    """Returns every metric in the Prometheus text format"""
+
+    lines = []
+
+    for metric in REQUEST_METRICS:
+        lines.extend(metric.render())
+
+    s3_stats = get_s3_metrics()
+    for stat, kind, help in (
+        ('count', 'counter', 'S3 operations.'),
+        ('errors', 'counter', 'S3 operations that failed.'),
+        ('seconds', 'counter', 'Time spent in S3 operations.'),
+        ('bytes', 'counter', 'Bytes sent to or received from S3.'),
+    ):
+        name = f'sharebnb_s3_{stat}_total'
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {kind}')
+        for operation, stats in sorted(s3_stats.items()):
+            lines.append(f'{name}{_labels(("operation",), (operation,))} {stats[stat]}')
+
+    cache_stats = get_response_cache_stats()
+    for stat in ('hits', 'misses'):
+        name = f'sharebnb_response_cache_{stat}_total'
+        lines.append(f'# HELP {name} Response cache {stat}.')
+        lines.append(f'# TYPE {name} counter')
+        lines.append(f'{name} {cache_stats[stat]}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,32 @@
+-- Converts reservations.start_date/end_date from free text ('2/6/2023' or
+-- '2023-02-06') to real dates, and stops two reservations of the same
+-- rental from overlapping. Postgres only.
+--
+-- Overlapping reservations that already exist make the last statement
+-- fail; cancel or move them first.
+
+BEGIN;
+
+ALTER TABLE reservations
+    ALTER COLUMN start_date TYPE date USING (
+        CASE WHEN start_date ~ '^\d{4}-' THEN start_date::date
+             ELSE to_date(start_date, 'MM/DD/YYYY') END
+    ),
+    ALTER COLUMN end_date TYPE date USING (
+        CASE WHEN end_date ~ '^\d{4}-' THEN end_date::date
+             ELSE to_date(end_date, 'MM/DD/YYYY') END
+    );
+
+ALTER TABLE reservations
+    ADD CONSTRAINT ck_reservations_dates_ordered CHECK (start_date <= end_date);
+
+CREATE INDEX ix_reservations_rental_id_dates
+    ON reservations (rental_id, start_date, end_date);
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+ALTER TABLE reservations
+    ADD CONSTRAINT reservations_no_overlap
+    EXCLUDE USING gist (rental_id WITH =, daterange(start_date, end_date, '[]') WITH &&);
+
+COMMIT;
@@ -0,0 +1,46 @@
+-- Adds the rating aggregate columns to rentals and fills them from the
+-- existing ratings and rated reservations. Postgres only.
+
+BEGIN;
+
+ALTER TABLE rentals
+    ADD COLUMN rating_count integer NOT NULL DEFAULT 0,
+    ADD COLUMN rating_sum integer NOT NULL DEFAULT 0,
+    ADD COLUMN rating_mean double precision NOT NULL DEFAULT 0,
+    ADD COLUMN rating_1_count integer NOT NULL DEFAULT 0,
+    ADD COLUMN rating_2_count integer NOT NULL DEFAULT 0,
+    ADD COLUMN rating_3_count integer NOT NULL DEFAULT 0,
+    ADD COLUMN rating_4_count integer NOT NULL DEFAULT 0,
+    ADD COLUMN rating_5_count integer NOT NULL DEFAULT 0;
+
+WITH all_ratings AS (
+    SELECT rental_id, rating FROM ratings
+    UNION ALL
+    SELECT rental_id, rating FROM reservations WHERE rating IS NOT NULL
+), totals AS (
+    SELECT rental_id,
+           count(*) AS n,
+           sum(rating) AS total,
+           count(*) FILTER (WHERE rating = 1) AS n1,
+           count(*) FILTER (WHERE rating = 2) AS n2,
+           count(*) FILTER (WHERE rating = 3) AS n3,
+           count(*) FILTER (WHERE rating = 4) AS n4,
+           count(*) FILTER (WHERE rating = 5) AS n5
+    FROM all_ratings
+    GROUP BY rental_id
+)
+UPDATE rentals
+SET rating_count = totals.n,
+    rating_sum = totals.total,
+    rating_mean = totals.total::double precision / totals.n,
+    rating_1_count = totals.n1,
+    rating_2_count = totals.n2,
+    rating_3_count = totals.n3,
+    rating_4_count = totals.n4,
+    rating_5_count = totals.n5
+FROM totals
+WHERE rentals.id = totals.rental_id;
+
+CREATE INDEX ix_rentals_rating_mean_id ON rentals (rating_mean, id);
+
+COMMIT;
@@ -0,0 +1,21 @@
+-- Adds full-text search (a generated tsvector column with a GIN index) and
+-- the coordinates/geohash used by radius search to rentals. Postgres only.
+-- Existing rentals have no coordinates until they are set.
+
+BEGIN;
+
+ALTER TABLE rentals
+    ADD COLUMN latitude double precision,
+    ADD COLUMN longitude double precision,
+    ADD COLUMN geohash varchar(12);
+
+CREATE INDEX ix_rentals_geohash ON rentals (geohash);
+
+ALTER TABLE rentals ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(location, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(description, '')), 'B')
+) STORED;
+
+CREATE INDEX ix_rentals_search_vector ON rentals USING gin (search_vector);
+
+COMMIT;
@@ -0,0 +1,13 @@
+-- Adds read tracking to messages, for unread counts. Existing messages are
+-- treated as already read. Postgres only.
+
+BEGIN;
+
+ALTER TABLE messages ADD COLUMN read_at timestamp;
+
+UPDATE messages SET read_at = "timestamp";
+
+CREATE INDEX ix_messages_recipient_username_read_at
+    ON messages (recipient_username, read_at);
+
+COMMIT;
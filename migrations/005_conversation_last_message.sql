@@ -0,0 +1,26 @@
+-- Adds the denormalized last message of each conversation, used by the
+-- inbox, and indexes messages by sender. Postgres only.
+
+BEGIN;
+
+ALTER TABLE conversations
+    ADD COLUMN last_message_id integer,
+    ADD COLUMN last_message_at timestamp;
+
+UPDATE conversations
+SET last_message_id = latest.id,
+    last_message_at = latest."timestamp"
+FROM (
+    SELECT DISTINCT ON (conversation_id) conversation_id, id, "timestamp"
+    FROM messages
+    ORDER BY conversation_id, "timestamp" DESC, id DESC
+) AS latest
+WHERE conversations.id = latest.conversation_id;
+
+ALTER TABLE conversations
+    ADD CONSTRAINT fk_conversations_last_message_id
+    FOREIGN KEY (last_message_id) REFERENCES messages (id) ON DELETE SET NULL;
+
+CREATE INDEX ix_messages_sender_username ON messages (sender_username);
+
+COMMIT;
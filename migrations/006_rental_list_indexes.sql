@@ -0,0 +1,18 @@
+-- Adds the composite indexes behind GET /rentals keyset pagination and its
+-- location, price and owner filters. Postgres only.
+--
+-- Built CONCURRENTLY so writes to rentals carry on meanwhile, which can't
+-- happen inside a transaction; run it without --single-transaction. If a
+-- build fails, drop the INVALID index it leaves and run this again.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_rentals_price_id
+    ON rentals (price, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_rentals_location_id
+    ON rentals (location, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_rentals_location_price_id
+    ON rentals (location, price, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_rentals_owner_username_id
+    ON rentals (owner_username, id);
@@ -0,0 +1,16 @@
+-- Adds the processing status of each rental's photo. Existing rentals'
+-- photos are already uploaded, so they are "ready". Postgres only.
+--
+-- Also fixes up a nullable image_status column added by hand.
+
+BEGIN;
+
+ALTER TABLE rentals ADD COLUMN IF NOT EXISTS image_status varchar(20);
+
+UPDATE rentals SET image_status = 'ready' WHERE image_status IS NULL;
+
+ALTER TABLE rentals
+    ALTER COLUMN image_status SET DEFAULT 'ready',
+    ALTER COLUMN image_status SET NOT NULL;
+
+COMMIT;
@@ -0,0 +1,9 @@
+-- Adds the index conversation history pages seek on, newest or oldest
+-- first from a (timestamp, id) cursor. Postgres only.
+--
+-- Built CONCURRENTLY so new messages can still be sent meanwhile; run it
+-- without --single-transaction. If the build fails, drop the INVALID
+-- index it leaves and run this again.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_conversation_id_timestamp
+    ON messages (conversation_id, "timestamp", id);
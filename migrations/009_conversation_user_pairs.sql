@@ -0,0 +1,58 @@
+-- Gives each pair of users a single conversation, stored with the
+-- usernames in code point order, and enforces it. Postgres only.
+--
+-- Duplicate conversations of a pair (either orientation) are merged into
+-- the oldest one: their messages move over and the duplicates are deleted.
+-- Sending messages and starting conversations wait until this commits.
+-- Needs 005_conversation_last_message.sql.
+
+BEGIN;
+
+LOCK TABLE conversations, messages IN SHARE ROW EXCLUSIVE MODE;
+
+-- Each conversation and the oldest conversation of its pair
+CREATE TEMPORARY TABLE conversation_merges ON COMMIT DROP AS
+SELECT id, min(id) OVER (PARTITION BY pair_user1, pair_user2) AS keep_id
+FROM (
+    SELECT id,
+           least(user1_username COLLATE "C", user2_username COLLATE "C") AS pair_user1,
+           greatest(user1_username COLLATE "C", user2_username COLLATE "C") AS pair_user2
+    FROM conversations
+) AS pairs;
+
+DELETE FROM conversation_merges WHERE id = keep_id;
+
+UPDATE messages
+SET conversation_id = conversation_merges.keep_id
+FROM conversation_merges
+WHERE messages.conversation_id = conversation_merges.id;
+
+DELETE FROM conversations
+WHERE id IN (SELECT id FROM conversation_merges);
+
+-- A merged conversation's last message may have come from a duplicate
+UPDATE conversations
+SET last_message_id = latest.id,
+    last_message_at = latest."timestamp"
+FROM (
+    SELECT DISTINCT ON (conversation_id) conversation_id, id, "timestamp"
+    FROM messages
+    WHERE conversation_id IN (SELECT keep_id FROM conversation_merges)
+    ORDER BY conversation_id, "timestamp" DESC, id DESC
+) AS latest
+WHERE conversations.id = latest.conversation_id;
+
+UPDATE conversations
+SET user1_username = user2_username,
+    user2_username = user1_username
+WHERE (user1_username COLLATE "C") > user2_username;
+
+ALTER TABLE conversations
+    ADD CONSTRAINT uq_conversations_user_pair
+        UNIQUE (user1_username, user2_username),
+    ADD CONSTRAINT ck_conversations_user_pair_ordered
+        CHECK ((user1_username COLLATE "C") <= user2_username);
+
+CREATE INDEX ix_conversations_user2_username ON conversations (user2_username);
+
+COMMIT;
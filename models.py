@@ -1,10 +1,34 @@
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, CheckConstraint, DDL, event, func, tuple_, update, cast, or_, table, column, literal_column, select
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import load_only, selectinload
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
+from functools import partial
+from helpers import parse_date
+from passwords import hash_password, check_password, needs_rehash
+from routing import RoutingSession
+from geo import GEOHASH_PRECISION, EARTH_RADIUS_KM, geohash_encode, covering_prefixes, bounding_box
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+RATING_VALUES = (1, 2, 3, 4, 5)
+
+# Sections a user profile can include
+PROFILE_INCLUDES = ('rentals', 'reservations', 'messages')
+
+# Postgres exclusion constraint stopping a rental's reservations overlapping
+RESERVATIONS_NO_OVERLAP = 'reservations_no_overlap'
+
+
+def constraint_name(error):
+    """Returns the name of the constraint an IntegrityError violated, or
+    None if the driver doesn't say (psycopg does, SQLite doesn't)"""
+
+    diag = getattr(error.orig, 'diag', None)
+
+    return getattr(diag, 'constraint_name', None)
 
 
 class User(db.Model):
@@ -64,11 +88,70 @@ class User(db.Model):
             "location": self.location
         }
 
+    @classmethod
+    def get_profile(cls, username, include=()):
+        """Returns the profile of `username` as a dict, or None if there is
+        no such user.
+
+        `include` picks sections from PROFILE_INCLUDES: "rentals" (the
+        user's rentals), "reservations" (counts of reservations made, total
+        and upcoming) and "messages" (count of unread received messages).
+        The user row and every count come from one SELECT with correlated
+        subqueries; rentals are loaded with one more (selectinload) query.
+        """
+
+        columns = [cls]
+
+        if 'reservations' in include:
+            made = Reservation.renter == cls.username
+            columns.append(
+                select(func.count(Reservation.id)).where(made)
+                .scalar_subquery().label('reservation_count'))
+            columns.append(
+                select(func.count(Reservation.id))
+                .where(made, Reservation.end_date >= func.current_date())
+                .scalar_subquery().label('upcoming_reservation_count'))
+
+        if 'messages' in include:
+            columns.append(
+                select(func.count(Message.id))
+                .where(Message.recipient_username == cls.username,
+                       Message.read_at.is_(None))
+                .scalar_subquery().label('unread_message_count'))
+
+        # select() always returns Rows, even when only the user is selected
+        query = select(*columns).where(cls.username == username)
+        if 'rentals' in include:
+            query = query.options(selectinload(cls.rentals))
+
+        row = db.session.execute(query).first()
+        if row is None:
+            return None
+
+        user = row[0]
+        profile = {'user': user.serialize()}
+
+        if 'rentals' in include:
+            profile['rentals'] = [r.serialize() for r in user.rentals]
+        if 'reservations' in include:
+            profile['reservations'] = {
+                'total': row.reservation_count,
+                'upcoming': row.upcoming_reservation_count,
+            }
+        if 'messages' in include:
+            profile['unread_messages'] = row.unread_message_count
+
+        return profile
+
     @classmethod
     def signup(cls, username, email, password, location, bio, image_url):
-        """Sign up user. Hashes password and adds to db"""
+        """Sign up user. Hashes password and adds to db
+
+        Hashing runs on the bcrypt process pool; raises PasswordPoolBusy if
+        it is full.
+        """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hash_password(password)
 
         user = User(
             username=username,
@@ -87,14 +170,17 @@ class User(db.Model):
         """Find user with `username` and `password`.
 
         If this can't find matching user (or if password is wrong), returns
-        False.
+        False. If the password hash uses an old cost factor it is replaced
+        (caller commits). Raises PasswordPoolBusy if the bcrypt pool is full.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = check_password(user.password, password)
             if is_auth:
+                if needs_rehash(user.password):
+                    user.password = hash_password(password)
                 return user
 
         return False
@@ -105,6 +191,15 @@ class Rental(db.Model):
 
     __tablename__ = 'rentals'
 
+    __table_args__ = (
+        db.Index('ix_rentals_price_id', 'price', 'id'),
+        db.Index('ix_rentals_location_id', 'location', 'id'),
+        db.Index('ix_rentals_location_price_id', 'location', 'price', 'id'),
+        db.Index('ix_rentals_owner_username_id', 'owner_username', 'id'),
+        db.Index('ix_rentals_rating_mean_id', 'rating_mean', 'id'),
+        db.Index('ix_rentals_geohash', 'geohash'),
+    )
+
     def __repr__(self):
         return f"<Rental #{self.id}: {self.description}>"
 
@@ -133,43 +228,381 @@ class Rental(db.Model):
         nullable=True
     )
 
+    latitude = db.Column(
+        db.Float,
+        nullable=True
+    )
+
+    longitude = db.Column(
+        db.Float,
+        nullable=True
+    )
+
+    # Set from latitude/longitude; radius searches scan geohash prefix ranges
+    geohash = db.Column(
+        db.String(GEOHASH_PRECISION),
+        nullable=True
+    )
+
+    # One of "pending", "processing", "ready" or "failed"
+    image_status = db.Column(
+        db.String(20),
+        nullable=False,
+        default='ready'
+    )
+
     owner_username = db.Column(
         db.Text,
         db.ForeignKey('users.username', ondelete='CASCADE'),
         nullable=False,
     )
 
+    # Aggregates over every Rating and rated Reservation of this rental,
+    # kept up to date by record_rating
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_mean = db.Column(db.Float, nullable=False, default=0)
+    rating_1_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_2_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_3_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_4_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_5_count = db.Column(db.Integer, nullable=False, default=0)
+
     reservations = db.relationship('Reservation', backref='rentals')
 
     ratings = db.relationship('Rating', backref='rentals')
 
     @classmethod
-    def add_rental(cls, description, location, price, owner_username, url):
+    def add_rental(cls, description, location, price, owner_username, url,
+                   image_status='ready', latitude=None, longitude=None):
         """Class method to add a rental to the database"""
 
+        has_coords = latitude is not None and longitude is not None
+
         rental = Rental(
             description=description,
             location=location,
             price=price,
             owner_username=owner_username,
-            url=url
+            url=url,
+            image_status=image_status,
+            latitude=latitude,
+            longitude=longitude,
+            geohash=geohash_encode(latitude, longitude) if has_coords else None
         )
 
         db.session.add(rental)
         return rental
 
-    def serialize(self):
-        """Serialize to dictionary."""
+    @classmethod
+    def record_rating(cls, rental_id, rating):
+        """Adds one rating to a rental's aggregate columns. See record_ratings"""
 
-        return {
-            "id": self.id,
-            "description": self.description,
-            "location": self.location,
-            "price": self.price,
-            "owner_username": self.owner_username,
-            "url": self.url
+        cls.record_ratings(rental_id, [rating])
+
+    @classmethod
+    def record_ratings(cls, rental_id, ratings):
+        """Adds a list of ratings to a rental's aggregate columns.
+
+        Done as a single UPDATE so concurrent ratings can't lose each other's
+        increments. Raises ValueError if any rating isn't an int from 1 to 5
+        (4.0 and True compare equal to ints, but aren't).
+        """
+
+        if any(type(rating) is not int or rating not in RATING_VALUES
+               for rating in ratings):
+            raise ValueError('Rating must be a whole number from 1 to 5')
+
+        if not ratings:
+            return
+
+        n = len(ratings)
+        total = sum(ratings)
+
+        values = {
+            cls.rating_count: cls.rating_count + n,
+            cls.rating_sum: cls.rating_sum + total,
+            cls.rating_mean: cast(cls.rating_sum + total, db.Float) / (cls.rating_count + n),
         }
 
+        for value in set(ratings):
+            histogram_count = getattr(cls, f'rating_{value}_count')
+            values[histogram_count] = histogram_count + ratings.count(value)
+
+        db.session.execute(
+            update(cls)
+            .where(cls.id == rental_id)
+            .values(values)
+            .execution_options(synchronize_session=False)
+        )
+
+    @classmethod
+    def filter_by_params(cls, location=None, min_price=None, max_price=None,
+                         owner_username=None):
+        """Returns a query of rentals matching the given (optional) filters"""
+
+        query = cls.query
+
+        if location is not None:
+            query = query.filter(cls.location == location)
+        if min_price is not None:
+            query = query.filter(cls.price >= min_price)
+        if max_price is not None:
+            query = query.filter(cls.price <= max_price)
+        if owner_username is not None:
+            query = query.filter(cls.owner_username == owner_username)
+
+        return query
+
+    @classmethod
+    def search(cls, text=None, near=None, limit=20):
+        """Returns up to `limit` (rental, distance_km) pairs.
+
+        With `text`, rentals whose description or location match, best first
+        (Postgres tsvector/GIN, or SQLite FTS5). With `near` as
+        (lat, lon, radius_km), only rentals within the radius, closest first
+        if there is no `text`. distance_km is None without `near`.
+        """
+
+        query = cls.query
+
+        if text:
+            dialect = db.session.get_bind(mapper=cls).dialect.name
+
+            if dialect == 'postgresql':
+                tsquery = func.websearch_to_tsquery('english', text)
+                vector = literal_column('rentals.search_vector')
+                query = (query
+                         .filter(vector.op('@@')(tsquery))
+                         .order_by(func.ts_rank(vector, tsquery).desc(), cls.id))
+            else:
+                fts = table('rentals_fts', column('rowid'), column('rank'))
+                query = (query
+                         .join(fts, fts.c.rowid == cls.id)
+                         .filter(literal_column('rentals_fts').op('MATCH')(_fts5_query(text)))
+                         .order_by(fts.c.rank, cls.id))
+
+        if near is None:
+            if not text:
+                query = query.order_by(cls.id)
+            return [(rental, None) for rental in query.limit(limit)]
+
+        lat, lon, radius_km = near
+        distance = cls.distance_km(lat, lon)
+
+        # Coarse filters on geohash cells (indexed) and the bounding box,
+        # then the exact distance, all in the database
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+        query = (query
+                 .add_columns(distance)
+                 .filter(or_(*[
+                     cls.geohash.between(prefix, prefix + 'z' * (GEOHASH_PRECISION - len(prefix)))
+                     for prefix in covering_prefixes(lat, lon, radius_km)
+                 ]))
+                 .filter(cls.latitude.between(min_lat, max_lat))
+                 .filter(distance <= radius_km))
+
+        if min_lon is not None:
+            query = query.filter(cls.longitude.between(min_lon, max_lon))
+
+        if not text:
+            query = query.order_by(distance, cls.id)
+
+        return [(rental, distance_km) for rental, distance_km in query.limit(limit)]
+
+    @classmethod
+    def distance_km(cls, lat, lon):
+        """Returns a SQL expression for the great-circle distance from
+        (lat, lon) to each rental, in km (the haversine formula, as
+        geo.haversine_km)"""
+
+        half_d_lat = func.radians(cls.latitude - lat) / 2
+        half_d_lon = func.radians(cls.longitude - lon) / 2
+        a = (func.sin(half_d_lat) * func.sin(half_d_lat)
+             + func.cos(func.radians(lat)) * func.cos(func.radians(cls.latitude))
+             * func.sin(half_d_lon) * func.sin(half_d_lon))
+
+        return 2 * EARTH_RADIUS_KM * func.asin(func.sqrt(a))
+
+    @classmethod
+    def available_between(cls, start_date, end_date):
+        """Returns a filter for rentals with no reservation overlapping
+        start_date..end_date (inclusive)"""
+
+        return ~Reservation.overlapping(cls.id, start_date, end_date).exists()
+
+    @classmethod
+    def get_page(cls, query, sort='id', after=None, limit=20):
+        """Returns (rentals, next_key) for one keyset page of `query`.
+
+        `sort` is "id", "price" or "rating" (highest mean first). `after` is
+        the key of the last row of the previous page: (id,), (price, id) or
+        (rating_mean, id). `next_key` is None on the last page. Seeks past
+        `after` instead of using OFFSET, so every page costs the same no
+        matter how deep it is.
+        """
+
+        if sort == 'price':
+            if after is not None:
+                query = query.filter(tuple_(cls.price, cls.id) > tuple_(*after))
+            query = query.order_by(cls.price, cls.id)
+        elif sort == 'rating':
+            if after is not None:
+                query = query.filter(tuple_(cls.rating_mean, cls.id) < tuple_(*after))
+            query = query.order_by(cls.rating_mean.desc(), cls.id.desc())
+        else:
+            if after is not None:
+                query = query.filter(cls.id > after[0])
+            query = query.order_by(cls.id)
+
+        rentals = query.limit(limit + 1).all()
+
+        if len(rentals) <= limit:
+            return rentals, None
+
+        rentals = rentals[:limit]
+        last = rentals[-1]
+        if sort == 'price':
+            next_key = (last.price, last.id)
+        elif sort == 'rating':
+            next_key = (last.rating_mean, last.id)
+        else:
+            next_key = (last.id,)
+
+        return rentals, next_key
+
+    # Serialized key -> columns it reads, for sparse fieldsets (?fields=)
+    FIELD_COLUMNS = {
+        "id": ("id",),
+        "description": ("description",),
+        "location": ("location",),
+        "price": ("price",),
+        "owner_username": ("owner_username",),
+        "url": ("url",),
+        "latitude": ("latitude",),
+        "longitude": ("longitude",),
+        "image_status": ("image_status",),
+        "rating_count": ("rating_count",),
+        "rating_mean": ("rating_mean", "rating_count"),
+        "rating_histogram": tuple(f"rating_{value}_count" for value in RATING_VALUES),
+    }
+
+    @classmethod
+    def row_columns(cls, fields=None, extra=()):
+        """Returns the columns serialize_row needs for `fields` (default
+        all), plus the `extra` column names"""
+
+        if fields is None:
+            fields = cls.FIELD_COLUMNS
+
+        names = {"id", *extra}
+        for field in fields:
+            names.update(cls.FIELD_COLUMNS[field])
+
+        return [getattr(cls, name) for name in sorted(names)]
+
+    @classmethod
+    def load_fields(cls, fields, extra=()):
+        """Returns a load_only option that SELECTs just the columns `fields`
+        (and `extra` column names) need"""
+
+        return load_only(*cls.row_columns(fields, extra))
+
+    @classmethod
+    def get_many(cls, ids, fields=None):
+        """Returns rows (see row_columns) of the rentals with these ids, in
+        the same order, with one IN query. Missing ids are skipped."""
+
+        rows = db.session.query(*cls.row_columns(fields)).filter(cls.id.in_(ids))
+
+        by_id = {row.id: row for row in rows}
+
+        return [by_id[id] for id in ids if id in by_id]
+
+    @classmethod
+    def serialize_row(cls, row, fields=None):
+        """Serialize a rental, or a row of its row_columns, to dictionary.
+
+        `fields` limits it to those keys (see FIELD_COLUMNS), reading no
+        other columns.
+        """
+
+        if fields is None:
+            fields = cls.FIELD_COLUMNS
+
+        # A Row converts to a dict in one call, much faster than reading
+        # its columns as attributes one by one
+        if isinstance(row, Row):
+            get = row._asdict().__getitem__
+        else:
+            get = partial(getattr, row)
+
+        data = {}
+
+        for field in fields:
+            if field == "rating_mean":
+                data[field] = get("rating_mean") if get("rating_count") else None
+            elif field == "rating_histogram":
+                data[field] = {
+                    str(value): get(f'rating_{value}_count')
+                    for value in RATING_VALUES
+                }
+            else:
+                data[field] = get(field)
+
+        return data
+
+    def serialize(self, fields=None):
+        """Serialize to dictionary (see serialize_row)"""
+
+        return self.serialize_row(self, fields)
+
+def _fts5_query(text):
+    """Quotes each word of `text` so FTS5 matches them all literally"""
+
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+# Full-text search index. Postgres: a generated tsvector column with a GIN
+# index. SQLite (local runs and tests): an FTS5 table kept in sync by
+# triggers.
+for ddl in (
+    """ALTER TABLE rentals ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(location, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED""",
+    "CREATE INDEX ix_rentals_search_vector ON rentals USING gin (search_vector)",
+):
+    event.listen(Rental.__table__, 'after_create', DDL(ddl).execute_if(dialect='postgresql'))
+
+for ddl in (
+    """CREATE VIRTUAL TABLE rentals_fts USING fts5(
+        description, location, content='rentals', content_rowid='id'
+    )""",
+    """CREATE TRIGGER rentals_fts_insert AFTER INSERT ON rentals BEGIN
+        INSERT INTO rentals_fts(rowid, description, location)
+        VALUES (new.id, new.description, new.location);
+    END""",
+    """CREATE TRIGGER rentals_fts_delete AFTER DELETE ON rentals BEGIN
+        INSERT INTO rentals_fts(rentals_fts, rowid, description, location)
+        VALUES ('delete', old.id, old.description, old.location);
+    END""",
+    """CREATE TRIGGER rentals_fts_update AFTER UPDATE OF description, location ON rentals BEGIN
+        INSERT INTO rentals_fts(rentals_fts, rowid, description, location)
+        VALUES ('delete', old.id, old.description, old.location);
+        INSERT INTO rentals_fts(rowid, description, location)
+        VALUES (new.id, new.description, new.location);
+    END""",
+):
+    event.listen(Rental.__table__, 'after_create', DDL(ddl).execute_if(dialect='sqlite'))
+
+event.listen(
+    Rental.__table__,
+    'after_drop',
+    DDL('DROP TABLE IF EXISTS rentals_fts').execute_if(dialect='sqlite'),
+)
+
+
 class Rating(db.Model):
     """ Rating for each rental """
 
@@ -204,7 +637,13 @@ class Rating(db.Model):
 
     @classmethod
     def add_rating(cls, rating, rental_id):
-        """Class method to add a rating to the database"""
+        """Class method to add a rating to the database
+
+        Also updates the rental's rating aggregates. Raises ValueError if
+        rating isn't 1 to 5.
+        """
+
+        Rental.record_rating(rental_id, rating)
 
         rating = Rating(
             rating=rating,
@@ -219,18 +658,28 @@ class Reservation(db.Model):
 
     __tablename__ = 'reservations'
 
+    # Postgres also gets an exclusion constraint (below the class) that
+    # stops two reservations of a rental from overlapping.
+    __table_args__ = (
+        CheckConstraint('start_date <= end_date',
+                        name='ck_reservations_dates_ordered'),
+        db.Index('ix_reservations_rental_id_dates',
+                 'rental_id', 'start_date', 'end_date'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True
     )
 
+    # Both dates are inclusive: a one day reservation has start_date == end_date
     start_date = db.Column(
-        db.String(50),
+        db.Date,
         nullable=False
     )
 
     end_date = db.Column(
-        db.String(50),
+        db.Date,
         nullable=False
     )
 
@@ -253,7 +702,17 @@ class Reservation(db.Model):
 
     @classmethod
     def add_reservation(cls, start_date, end_date, rental_id, renter, rating=None):
-        """Class method to add a reservation to the database"""
+        """Class method to add a reservation to the database
+
+        Dates may be date objects or 'YYYY-MM-DD' / 'M/D/YYYY' strings.
+        A rating also updates the rental's rating aggregates. Raises
+        ValueError if a date can't be parsed or rating isn't 1 to 5.
+        """
+
+        if isinstance(start_date, str):
+            start_date = parse_date(start_date)
+        if isinstance(end_date, str):
+            end_date = parse_date(end_date)
 
         reservation = Reservation(
             start_date=start_date,
@@ -263,27 +722,91 @@ class Reservation(db.Model):
             rating=rating,
         )
 
+        if rating is not None:
+            Rental.record_rating(rental_id, rating)
+
         db.session.add(reservation)
         return reservation
 
-    def serialize(self):
-        """Serialize to dictionary"""
+    @classmethod
+    def overlapping(cls, rental_id, start_date, end_date):
+        """Returns a query of reservations of `rental_id` that overlap
+        start_date..end_date (inclusive).
+
+        On Postgres this is the exclusion constraint's own expression, so
+        its GiST index answers it; elsewhere it compares the dates.
+        """
+
+        if db.session.get_bind(mapper=cls).dialect.name == 'postgresql':
+            return cls.query.filter(
+                cls.rental_id == rental_id,
+                func.daterange(cls.start_date, cls.end_date, '[]').op('&&')(
+                    func.daterange(start_date, end_date, '[]')),
+            )
+
+        return cls.query.filter(
+            cls.rental_id == rental_id,
+            cls.start_date <= end_date,
+            cls.end_date >= start_date,
+        )
+
+    @classmethod
+    def row_columns(cls):
+        """Returns the columns serialize_row reads, for queries that skip
+        building Reservation objects"""
+
+        return list(cls.__table__.columns)
+
+    @staticmethod
+    def serialize_row(row):
+        """Serialize a reservation, or a row of its row_columns, to dictionary"""
 
         return {
-            "id": self.id,
-            "start_date": self.start_date,
-            "end_date": self.end_date,
-            "rating": self.rating,
-            "rental_id": self.rental_id,
-            "renter": self.renter
+            "id": row.id,
+            "start_date": row.start_date.isoformat(),
+            "end_date": row.end_date.isoformat(),
+            "rating": row.rating,
+            "rental_id": row.rental_id,
+            "renter": row.renter
         }
 
+    def serialize(self):
+        """Serialize to dictionary"""
+
+        return self.serialize_row(self)
+
+
+# GiST exclusion constraint: no two reservations of a rental may overlap.
+# Its index serves Reservation.overlapping, which uses the same expression.
+Reservation.__table__.append_constraint(
+    ExcludeConstraint(
+        (Reservation.rental_id, '='),
+        (func.daterange(Reservation.start_date, Reservation.end_date, '[]'), '&&'),
+        name=RESERVATIONS_NO_OVERLAP,
+        using='gist',
+    ).ddl_if(dialect='postgresql')
+)
+
+event.listen(
+    Reservation.__table__,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'),
+)
+
 
 class Message(db.Model):
     """ Messages table """
 
     __tablename__ = 'messages'
 
+    __table_args__ = (
+        db.Index('ix_messages_conversation_id_timestamp',
+                 'conversation_id', 'timestamp', 'id'),
+        db.Index('ix_messages_recipient_username_read_at',
+                 'recipient_username', 'read_at'),
+        db.Index('ix_messages_sender_username', 'sender_username'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True
@@ -300,13 +823,20 @@ class Message(db.Model):
         default=datetime.utcnow
     )
 
+    # Set when the recipient reads it; NULL means unread
+    read_at = db.Column(
+        db.DateTime,
+        nullable=True
+    )
+
     conversation_id = db.Column(
         db.Integer,
         db.ForeignKey('conversations.id', ondelete='CASCADE'),
         nullable=False
     )
 
-    conversation = db.relationship('Conversation', backref='messages')
+    conversation = db.relationship('Conversation', backref='messages',
+                                   foreign_keys=[conversation_id])
 
     sender_username = db.Column(
         db.Text,
@@ -326,7 +856,10 @@ class Message(db.Model):
 
     @classmethod
     def create_message(cls, content, sender_username, recipient_username, conversation_id):
-        """Create a new message and add it to the database."""
+        """Create a new message and add it to the database.
+
+        Flushes to get its id, and makes it the conversation's last message.
+        """
 
         message = Message(
             content=content,
@@ -336,25 +869,125 @@ class Message(db.Model):
         )
 
         db.session.add(message)
+        db.session.flush()
+
+        Conversation.record_message(message)
         return message
 
-    def serialize(self):
-        """Serialize to dictionary."""
-        formatted_timestamp = self.timestamp.strftime('%I:%M %p, %B %dth, %Y')
+    @classmethod
+    def for_user(cls, username):
+        """Returns a query of every message sent or received by `username`,
+        oldest first"""
+
+        return cls.query.filter(or_(
+            cls.sender_username == username,
+            cls.recipient_username == username,
+        )).order_by(cls.timestamp, cls.id)
+
+    @classmethod
+    def mark_read(cls, conversation_id, recipient_username):
+        """Marks every unread message `recipient_username` received in a
+        conversation as read. Returns how many were marked."""
+
+        result = db.session.execute(
+            update(cls)
+            .where(cls.conversation_id == conversation_id,
+                   cls.recipient_username == recipient_username,
+                   cls.read_at.is_(None))
+            .values(read_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+
+        return result.rowcount
+
+    @classmethod
+    def get_conversation_page(cls, conversation_id, before=None, after=None,
+                              limit=50):
+        """Returns (messages, has_more) for one page of a conversation.
+
+        `before`/`after` are message ids to seek from. With `after`, returns
+        the oldest `limit` messages newer than it (for polling); otherwise
+        the newest `limit` messages older than `before` (or the newest
+        overall). Messages are always returned oldest first.
+
+        Raises ValueError if `before`/`after` is not in this conversation.
+        """
+
+        query = cls.query.filter(cls.conversation_id == conversation_id)
+        key = tuple_(cls.timestamp, cls.id)
+        anchor_id = after if after is not None else before
+
+        if anchor_id is not None:
+            anchor = db.session.get(cls, anchor_id)
+            if anchor is None or anchor.conversation_id != conversation_id:
+                raise ValueError('Unknown message cursor')
+            anchor_key = tuple_(anchor.timestamp, anchor.id)
+
+        if after is not None:
+            query = query.filter(key > anchor_key).order_by(cls.timestamp, cls.id)
+        else:
+            if before is not None:
+                query = query.filter(key < anchor_key)
+            query = query.order_by(cls.timestamp.desc(), cls.id.desc())
+
+        messages = query.limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+
+        if after is None:
+            messages.reverse()
+
+        return messages, has_more
+
+    @classmethod
+    def row_columns(cls):
+        """Returns the columns serialize_row reads, for queries that skip
+        building Message objects"""
+
+        return list(cls.__table__.columns)
+
+    @staticmethod
+    def serialize_row(row):
+        """Serialize a message, or a row of its row_columns, to dictionary"""
+        formatted_timestamp = row.timestamp.strftime('%I:%M %p, %B %dth, %Y')
         return {
-            "id": self.id,
-            "content": self.content,  # Updated attribute name
-            "sender": self.sender.username,
-            "receiver": self.recipient.username,  # Updated attribute name
-            "timestamp": formatted_timestamp
+            "id": row.id,
+            "content": row.content,  # Updated attribute name
+            "sender": row.sender_username,
+            "receiver": row.recipient_username,
+            "conversation_id": row.conversation_id,
+            "timestamp": formatted_timestamp,
+            "read_at": row.read_at.isoformat() if row.read_at else None
         }
 
+    def serialize(self):
+        """Serialize to dictionary."""
+
+        return self.serialize_row(self)
+
     
 class Conversation(db.Model):
     """ Conversations between users """
 
     __tablename__ = 'conversations'
 
+    # Each pair of users has one conversation, stored with the usernames in
+    # sorted order so either orientation is a single index lookup. Sorted
+    # by code point, as Python sorts them: on Postgres that's the "C"
+    # collation, not the database's.
+    __table_args__ = (
+        UniqueConstraint('user1_username', 'user2_username',
+                         name='uq_conversations_user_pair'),
+        CheckConstraint('(user1_username COLLATE "C") <= user2_username',
+                        name='ck_conversations_user_pair_ordered',
+                        ).ddl_if(dialect='postgresql'),
+        CheckConstraint('user1_username <= user2_username',
+                        name='ck_conversations_user_pair_ordered',
+                        ).ddl_if(callable_=lambda ddl, target, bind, compiler, **kw:
+                                 compiler.dialect.name != 'postgresql'),
+        db.Index('ix_conversations_user2_username', 'user2_username'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True
@@ -376,10 +1009,37 @@ class Conversation(db.Model):
 
     user2 = db.relationship('User', foreign_keys=[user2_username])
 
+    # Denormalized pointer to the newest message, kept up to date by
+    # record_message, so the inbox never has to scan messages
+    last_message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='SET NULL', use_alter=True,
+                      name='fk_conversations_last_message_id'),
+        nullable=True
+    )
+
+    last_message_at = db.Column(
+        db.DateTime,
+        nullable=True
+    )
+
+    @staticmethod
+    def user_pair(username_a, username_b):
+        """Returns the two usernames in the order a conversation stores them"""
+
+        return tuple(sorted((username_a, username_b)))
+
+    def has_member(self, username):
+        """Returns whether `username` is one of the two users in it"""
+
+        return username in (self.user1_username, self.user2_username)
+
     @classmethod
     def create_conversation(cls, user1_username, user2_username):
         """Create a new conversation between two users and add it to the database."""
 
+        user1_username, user2_username = cls.user_pair(user1_username, user2_username)
+
         conversation = Conversation(
             user1_username=user1_username,
             user2_username=user2_username
@@ -388,21 +1048,117 @@ class Conversation(db.Model):
         db.session.add(conversation)
         return conversation
 
+    @classmethod
+    def find(cls, username_a, username_b):
+        """Returns the conversation between two users (in either order), or None"""
+
+        user1_username, user2_username = cls.user_pair(username_a, username_b)
+
+        return cls.query.filter_by(
+            user1_username=user1_username,
+            user2_username=user2_username
+        ).first()
+
+    @classmethod
+    def get_or_create(cls, username_a, username_b):
+        """Returns (conversation, created) for the conversation between two users.
+
+        Safe against concurrent requests creating the same pair: the insert
+        runs in a savepoint, and if another transaction wins the unique index
+        we roll back to it and return that transaction's row.
+        """
+
+        conversation = cls.find(username_a, username_b)
+        if conversation is not None:
+            return conversation, False
+
+        try:
+            with db.session.begin_nested():
+                conversation = cls.create_conversation(username_a, username_b)
+        except IntegrityError:
+            return cls.find(username_a, username_b), False
+
+        return conversation, True
+
+    @classmethod
+    def record_message(cls, message):
+        """Makes a flushed `message` its conversation's last message, unless
+        a newer one already is (concurrent senders can commit out of order)"""
+
+        db.session.execute(
+            update(cls)
+            .where(cls.id == message.conversation_id)
+            .where(or_(
+                cls.last_message_id.is_(None),
+                tuple_(cls.last_message_at, cls.last_message_id)
+                < tuple_(message.timestamp, message.id),
+            ))
+            .values(last_message_id=message.id, last_message_at=message.timestamp)
+            .execution_options(synchronize_session=False)
+        )
+
+    @classmethod
+    def get_inbox(cls, username, before=None, limit=50):
+        """Returns (rows, has_more) for one page of a user's inbox.
+
+        Each row is (conversation, last_message, unread_count), newest
+        conversation first; conversations with no messages are left out.
+        `before` is a conversation id to seek past. Costs one query over
+        the user's conversations and unread messages, however many
+        messages they have.
+
+        Raises ValueError if `before` is not one of the user's conversations.
+        """
+
+        unread = (
+            db.session.query(Message.conversation_id,
+                             func.count(Message.id).label('unread_count'))
+            .filter(Message.recipient_username == username,
+                    Message.read_at.is_(None))
+            .group_by(Message.conversation_id)
+            .subquery()
+        )
+
+        query = (
+            db.session.query(cls, Message,
+                             func.coalesce(unread.c.unread_count, 0))
+            .join(Message, Message.id == cls.last_message_id)
+            .outerjoin(unread, unread.c.conversation_id == cls.id)
+            .filter(or_(cls.user1_username == username,
+                        cls.user2_username == username))
+        )
+
+        key = tuple_(cls.last_message_at, cls.id)
+
+        if before is not None:
+            anchor = db.session.get(cls, before)
+            if (anchor is None or anchor.last_message_at is None
+                    or username not in (anchor.user1_username, anchor.user2_username)):
+                raise ValueError('Unknown conversation cursor')
+            query = query.filter(key < tuple_(anchor.last_message_at, anchor.id))
+
+        rows = (query.order_by(cls.last_message_at.desc(), cls.id.desc())
+                .limit(limit + 1).all())
+
+        return rows[:limit], len(rows) > limit
+
     def serialize(self):
         """Serialize to dictionary."""
 
         return {
             "id": self.id,
             "user1_username": self.user1_username,
-            "user2_username": self.user2_username
+            "user2_username": self.user2_username,
+            "last_message_id": self.last_message_id,
+            "last_message_at": (self.last_message_at.isoformat()
+                                if self.last_message_at else None)
         }
 
 def connect_db(app):
     """Connect this database to provided Flask app.
 
-    You should call this in your Flask app.
+    You should call this in your Flask app. Doesn't push an app context;
+    scripts that use the db outside a request should push their own.
     """
 
-    app.app_context().push()
-    db.app = app
-    db.init_app(app)
\ No newline at end of file
+    db.init_app(app)
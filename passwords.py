@@ -0,0 +1,128 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+
+
+# bcrypt cost factor for new hashes. Changing it rehashes each user's
+# password the next time they log in.
+BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+
+BCRYPT_WORKERS = int(os.getenv('BCRYPT_WORKERS', os.cpu_count() or 1))
+
+# Hashes queued or running at once before callers get PasswordPoolBusy
+BCRYPT_MAX_PENDING = int(os.getenv('BCRYPT_MAX_PENDING', BCRYPT_WORKERS * 4))
+
+BCRYPT_TIMEOUT = 30
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(BCRYPT_MAX_PENDING)
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when too many password hashes are already queued"""
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _checkpw(hashed, password):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def get_pool():
+    """Returns this process's bcrypt process pool, creating it on first use.
+
+    Uses spawned (not forked) workers, so they don't inherit the app's
+    threads or database connections. A pool that broke because a worker
+    died (OOM kill, segfault) is replaced.
+    """
+
+    global _pool, _pool_pid
+
+    pid = os.getpid()
+    pool = _pool
+    if pool is not None and _pool_pid == pid and not pool._broken:
+        return pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid or _pool._broken:
+            from concurrent.futures import ProcessPoolExecutor
+
+            if _pool is not None and _pool_pid == pid:
+                _pool.shutdown(wait=False, cancel_futures=True)
+
+            _pool = ProcessPoolExecutor(
+                max_workers=BCRYPT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+            _pool_pid = pid
+
+    return _pool
+
+
+def _run(fn, *args):
+    """Runs fn(*args) on the pool and waits for the result.
+
+    Raises PasswordPoolBusy straight away if BCRYPT_MAX_PENDING calls are
+    already in flight, rather than queueing behind them. If the pool broke
+    (a worker died), retries once on a new one.
+    """
+
+    try:
+        return _submit_and_wait(fn, *args)
+    except BrokenProcessPool:
+        return _submit_and_wait(fn, *args)
+
+
+def _submit_and_wait(fn, *args):
+    if not _pending.acquire(blocking=False):
+        raise PasswordPoolBusy()
+
+    try:
+        future = get_pool().submit(fn, *args)
+    except BaseException:
+        _pending.release()
+        raise
+
+    future.add_done_callback(lambda f: _pending.release())
+
+    return future.result(timeout=BCRYPT_TIMEOUT)
+
+
+def hash_password(password):
+    """Returns a bcrypt hash of `password` at BCRYPT_LOG_ROUNDS"""
+
+    return _run(_hashpw, password, BCRYPT_LOG_ROUNDS)
+
+
+def hash_passwords(passwords):
+    """Returns bcrypt hashes of many passwords, spread over the whole pool.
+
+    For bulk loads; skips the BCRYPT_MAX_PENDING admission check.
+    """
+
+    chunksize = max(1, len(passwords) // (BCRYPT_WORKERS * 4))
+
+    return list(get_pool().map(_hashpw, passwords,
+                               [BCRYPT_LOG_ROUNDS] * len(passwords),
+                               chunksize=chunksize))
+
+
+def check_password(hashed, password):
+    """True if `password` matches the bcrypt hash `hashed`"""
+
+    return _run(_checkpw, hashed, password)
+
+
+def needs_rehash(hashed):
+    """True if `hashed` was made with a cost factor other than BCRYPT_LOG_ROUNDS"""
+
+    try:
+        return int(hashed.split('$')[2]) != BCRYPT_LOG_ROUNDS
+    except (IndexError, ValueError):
+        return True
@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import queue
+import threading
+
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+REDIS_CHANNEL_PREFIX = 'sharebnb:'
+
+
+class Subscription:
+    """A single listener's queue of messages published to a channel"""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def get(self, timeout=None):
+        """Returns the next message, raising queue.Empty after `timeout`"""
+
+        return self.queue.get(timeout=timeout)
+
+
+class InProcessBroker:
+    """Pub/sub between threads of this process.
+
+    Slow subscribers whose queue is full miss messages rather than blocking
+    the publisher.
+    """
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel)
+
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscriptions.get(channel, ()))
+
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                logging.warning('Dropping message for slow subscriber on %s', channel)
+
+
+class RedisBroker:
+    """Pub/sub across processes and nodes through Redis.
+
+    Publishes go to Redis; one listener thread per process receives every
+    sharebnb channel and hands messages to local subscribers through an
+    InProcessBroker. Requires the optional `redis` package.
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._local = InProcessBroker()
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def subscribe(self, channel):
+        self._ensure_listener()
+        return self._local.subscribe(channel)
+
+    def unsubscribe(self, subscription):
+        self._local.unsubscribe(subscription)
+
+    def publish(self, channel, message):
+        self._redis.publish(REDIS_CHANNEL_PREFIX + channel, json.dumps(message))
+
+    def _ensure_listener(self):
+        with self._listener_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen,
+                                                  name='pubsub-listener',
+                                                  daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(REDIS_CHANNEL_PREFIX + '*')
+
+        for item in pubsub.listen():
+            channel = item['channel'].decode('utf-8')[len(REDIS_CHANNEL_PREFIX):]
+            self._local.publish(channel, json.loads(item['data']))
+
+
+def create_broker():
+    """Returns a RedisBroker if PUBSUB_REDIS_URL is set, else an
+    InProcessBroker (only delivers within a single process)"""
+
+    url = os.getenv('PUBSUB_REDIS_URL')
+
+    if url:
+        return RedisBroker(url)
+
+    return InProcessBroker()
+
+
+broker = create_broker()
+
+
+def conversation_channel(conversation_id):
+    return f'conversation:{conversation_id}'
+
+
+def user_channel(username):
+    return f'user:{username}'
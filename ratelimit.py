@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from cache import LRUCache
+
+
+# Login attempts allowed per minute (and burst size)
+LOGIN_ATTEMPTS_PER_USERNAME = int(os.getenv('LOGIN_ATTEMPTS_PER_USERNAME', 5))
+LOGIN_ATTEMPTS_PER_IP = int(os.getenv('LOGIN_ATTEMPTS_PER_IP', 30))
+
+# How long an unknown username is remembered, so repeat attempts skip the db
+UNKNOWN_USERNAME_TTL = int(os.getenv('UNKNOWN_USERNAME_TTL', 30))
+
+RATELIMIT_CACHE_SIZE = 100000
+
+
+class MemoryBucketStore:
+    """Token buckets kept in this process's memory"""
+
+    def __init__(self, maxsize=RATELIMIT_CACHE_SIZE):
+        self._buckets = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        """Takes a token from bucket `key` (refilling at `rate` per second up
+        to `capacity`). Returns 0 if allowed, else seconds until a token is
+        available."""
+
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, last = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+
+            if tokens >= 1:
+                self._buckets.set(key, (tokens - 1, now), ttl=capacity / rate)
+                return 0
+
+            self._buckets.set(key, (tokens, now), ttl=capacity / rate)
+            return (1 - tokens) / rate
+
+
+TAKE_TOKEN_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBucketStore:
+    """Token buckets shared by every app process through Redis. Requires
+    the optional `redis` package."""
+
+    def __init__(self, url):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(TAKE_TOKEN_SCRIPT)
+
+    def take(self, key, capacity, rate):
+        """See MemoryBucketStore.take"""
+
+        return float(self._take(keys=[f'sharebnb:ratelimit:{key}'],
+                                args=[capacity, rate]))
+
+
+def create_store():
+    """Returns a RedisBucketStore if RATELIMIT_REDIS_URL is set, else a
+    MemoryBucketStore (limits are then per process)"""
+
+    url = os.getenv('RATELIMIT_REDIS_URL')
+
+    if url:
+        return RedisBucketStore(url)
+
+    return MemoryBucketStore()
+
+
+store = create_store()
+
+unknown_usernames = LRUCache(maxsize=RATELIMIT_CACHE_SIZE, ttl=UNKNOWN_USERNAME_TTL)
+
+
+def login_retry_after(username, ip):
+    """Takes a login attempt from the username's and the ip's buckets.
+
+    Returns 0 if the attempt may go ahead, else seconds to wait.
+    """
+
+    return max(
+        store.take(f'login:ip:{ip}', LOGIN_ATTEMPTS_PER_IP,
+                   LOGIN_ATTEMPTS_PER_IP / 60),
+        store.take(f'login:user:{username}', LOGIN_ATTEMPTS_PER_USERNAME,
+                   LOGIN_ATTEMPTS_PER_USERNAME / 60),
+    )
+
+
+def is_unknown_username(username):
+    return unknown_usernames.get(username, False)
+
+
+def remember_unknown_username(username):
+    unknown_usernames.set(username, True)
+
+
+def forget_unknown_username(username):
+    unknown_usernames.delete(username)
@@ -0,0 +1,220 @@
+import hashlib
+import os
+import threading
+import time
+from functools import wraps
+from itertools import chain
+from flask import g, request, make_response
+from sqlalchemy import event
+from cache import LRUCache
+from routing import RoutingSession
+
+
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 5000))
+
+# Upper bound on how stale an entry can get. Writes made through this
+# process (or any process, with the Redis backend) invalidate sooner.
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 60))
+
+
+class MemoryResponseCache:
+    """Cached responses kept in this process's memory.
+
+    Each table ("tag") has a generation number that's part of every cache
+    key, so bumping it invalidates all responses built from that table.
+    """
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self._entries = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def generations(self, tags):
+        with self._lock:
+            return [self._generations.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, entry):
+        self._entries.set(key, entry)
+
+
+class RedisResponseCache:
+    """Cached responses shared by every app process through Redis. Requires
+    the optional `redis` package."""
+
+    PREFIX = 'sharebnb:response:'
+
+    def __init__(self, url, ttl=RESPONSE_CACHE_TTL):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._ttl = ttl
+
+    def generations(self, tags):
+        values = self._redis.mget([f'{self.PREFIX}gen:{tag}' for tag in tags])
+        return [int(v or 0) for v in values]
+
+    def bump(self, tags):
+        pipe = self._redis.pipeline()
+        for tag in tags:
+            pipe.incr(f'{self.PREFIX}gen:{tag}')
+        pipe.execute()
+
+    def get(self, key):
+        entry = self._redis.hgetall(f'{self.PREFIX}{key}')
+        if not entry:
+            return None
+
+        return {
+            'body': entry[b'body'],
+            'mimetype': entry[b'mimetype'].decode('utf-8'),
+            'etag': entry[b'etag'].decode('utf-8'),
+            'last_modified': float(entry[b'last_modified']),
+        }
+
+    def set(self, key, entry):
+        name = f'{self.PREFIX}{key}'
+        pipe = self._redis.pipeline()
+        pipe.hset(name, mapping=entry)
+        pipe.expire(name, self._ttl)
+        pipe.execute()
+
+
+def create_response_cache():
+    """Returns a RedisResponseCache if RESPONSE_CACHE_REDIS_URL is set, else
+    a MemoryResponseCache"""
+
+    url = os.getenv('RESPONSE_CACHE_REDIS_URL')
+
+    if url:
+        return RedisResponseCache(url)
+
+    return MemoryResponseCache()
+
+
+response_cache = create_response_cache()
+
+stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(outcome):
+    with _stats_lock:
+        stats[outcome] += 1
+
+
+def get_response_cache_stats():
+    """Returns hits, misses and hit_ratio of the response cache"""
+
+    with _stats_lock:
+        hits, misses = stats['hits'], stats['misses']
+
+    total = hits + misses
+
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else 0.0,
+    }
+
+
+def cached_response(*tags):
+    """Decorator that caches a GET route's 200 JSON responses.
+
+    `tags` are the tables the response is built from; committing a change to
+    any of them invalidates it. Responses carry a strong ETag and
+    Last-Modified, and matching conditional requests get a 304.
+
+    Responses read from a replica aren't stored: the replica may not have
+    caught up with the write that bumped the generation, and storing its
+    answer under the new generation would keep serving stale data until the
+    next write or the TTL.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            generations = response_cache.generations(tags)
+            key = hashlib.sha1(repr((
+                request.full_path,
+                request.headers.get('Accept'),
+                generations,
+            )).encode('utf-8')).hexdigest()
+
+            entry = response_cache.get(key)
+
+            if entry is None:
+                _count('misses')
+                response = make_response(view(*args, **kwargs))
+
+                if (response.status_code != 200 or response.is_streamed
+                        or response.mimetype != 'application/json'):
+                    return response
+
+                body = response.get_data()
+                entry = {
+                    'body': body,
+                    'mimetype': response.mimetype,
+                    'etag': hashlib.sha1(body).hexdigest(),
+                    'last_modified': time.time(),
+                }
+
+                if g.get('replica_key') is None:
+                    response_cache.set(key, entry)
+            else:
+                _count('hits')
+                response = make_response(entry['body'])
+                response.mimetype = entry['mimetype']
+
+            response.set_etag(entry['etag'])
+            response.last_modified = entry['last_modified']
+            response.cache_control.no_cache = True
+
+            return response.make_conditional(request)
+
+        return wrapper
+
+    return decorator
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def collect_changed_tables(session, flush_context):
+    """Remembers which tables this transaction wrote to"""
+
+    changed = session.info.setdefault('changed_tables', set())
+
+    for obj in chain(session.new, session.dirty, session.deleted):
+        changed.add(obj.__table__.name)
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def collect_bulk_changed_tables(orm_execute_state):
+    """Remembers tables written by ORM INSERT/UPDATE/DELETE statements,
+    which bypass the flush"""
+
+    if (orm_execute_state.is_insert or orm_execute_state.is_update
+            or orm_execute_state.is_delete):
+        changed = orm_execute_state.session.info.setdefault('changed_tables', set())
+        changed.add(orm_execute_state.bind_mapper.local_table.name)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def invalidate_changed_tables(session):
+    """Invalidates cached responses built from tables this transaction wrote"""
+
+    changed = session.info.pop('changed_tables', None)
+
+    if changed:
+        response_cache.bump(sorted(changed))
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_changed_tables(session):
+    session.info.pop('changed_tables', None)
@@ -0,0 +1,151 @@
+import os
+import random
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from cache import LRUCache
+
+
+# Bind keys in SQLALCHEMY_BINDS that point at read replicas
+REPLICA_BIND_PREFIX = 'replica_'
+
+# After a client writes, its reads go to the primary for this long, so it
+# sees its own writes even if the replicas lag behind
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', 5))
+
+RECENT_WRITERS_SIZE = 100000
+
+
+class MemoryWriterStore:
+    """Clients that wrote recently, kept in this process's memory"""
+
+    def __init__(self, maxsize=RECENT_WRITERS_SIZE, ttl=READ_YOUR_WRITES_SECONDS):
+        self._writers = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def wrote_recently(self, keys):
+        """Returns True if any of the client keys wrote in the last few seconds"""
+
+        return any(self._writers.get(key, False) for key in keys)
+
+    def remember(self, keys):
+        for key in keys:
+            self._writers.set(key, True)
+
+
+class RedisWriterStore:
+    """Clients that wrote recently, shared by every app process through
+    Redis. Requires the optional `redis` package."""
+
+    prefix = 'sharebnb:writer:'
+
+    def __init__(self, url, ttl=READ_YOUR_WRITES_SECONDS):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def wrote_recently(self, keys):
+        """See MemoryWriterStore.wrote_recently"""
+
+        return bool(keys) and self._redis.exists(*(self.prefix + key for key in keys)) > 0
+
+    def remember(self, keys):
+        pipe = self._redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(self.prefix + key, 1, ex=self.ttl)
+        pipe.execute()
+
+
+def create_writer_store():
+    """Returns a RedisWriterStore if READ_YOUR_WRITES_REDIS_URL is set, else
+    a MemoryWriterStore (a write then only pins reads to the primary in the
+    process that handled it)"""
+
+    url = os.getenv('READ_YOUR_WRITES_REDIS_URL')
+
+    if url:
+        return RedisWriterStore(url)
+
+    return MemoryWriterStore()
+
+
+recent_writers = create_writer_store()
+
+
+def wrote_recently(keys):
+    return recent_writers.wrote_recently(keys)
+
+
+def remember_writer(keys):
+    recent_writers.remember(keys)
+
+
+def replica_binds(urls, engine_options=None):
+    """Returns SQLALCHEMY_BINDS for a comma separated list of replica urls.
+
+    Flask-SQLAlchemy only applies SQLALCHEMY_ENGINE_OPTIONS to the primary,
+    so each replica gets `engine_options(url)` (pool size, pre-ping,
+    statement timeout) in its bind.
+    """
+
+    if not urls:
+        return {}
+
+    return {
+        f'{REPLICA_BIND_PREFIX}{i}': {
+            'url': url.strip(),
+            **(engine_options(url.strip()) if engine_options else {}),
+        }
+        for i, url in enumerate(urls.split(','))
+        if url.strip()
+    }
+
+
+class RoutingSession(Session):
+    """Session that sends reads to a replica when the request allows it.
+
+    Requests opt in by setting `g.use_replica`. Flushes, ORM INSERT/UPDATE/
+    DELETE statements, and everything outside a request (background
+    workers, scripts), use the primary. One replica is picked per request
+    so its reads are consistent.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing
+                and not (clause is not None and clause.is_dml)
+                and has_request_context() and g.get('use_replica')):
+            engine = self._replica_engine()
+            if engine is not None:
+                return engine
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica_engine(self):
+        if 'replica_key' not in g:
+            replicas = [key for key in self._db.engines
+                        if key and key.startswith(REPLICA_BIND_PREFIX)]
+            g.replica_key = random.choice(replicas) if replicas else None
+
+        if g.replica_key is None:
+            return None
+
+        return self._db.engines[g.replica_key]
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def mark_request_wrote(session, flush_context):
+    """Notes that this request wrote to the primary"""
+
+    if has_request_context():
+        g.db_wrote = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def mark_request_wrote_bulk(orm_execute_state):
+    """Notes ORM INSERT/UPDATE/DELETE statements too, which bypass the
+    flush"""
+
+    if has_request_context() and (orm_execute_state.is_insert
+                                  or orm_execute_state.is_update
+                                  or orm_execute_state.is_delete):
+        g.db_wrote = True
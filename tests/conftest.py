@@ -0,0 +1,143 @@
+import os
+import threading
+from contextlib import contextmanager
+
+# Settings read at import time, before the app modules are imported
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+os.environ.setdefault('APP_PROFILE', 'test')
+os.environ.setdefault('BUCKET_NAME', 'sharebnb-test')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+os.environ.setdefault('BCRYPT_WORKERS', '1')
+
+import bcrypt
+import pytest
+from moto import mock_aws
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import auth
+import aws
+import ratelimit
+import response_cache
+import routing
+from app import create_app
+from helpers import create_jwt
+from models import db, User, Rental, Reservation, Message, Conversation
+
+
+PASSWORD = 'password'
+
+# Hashed once, in process, at the test cost factor
+PASSWORD_HASH = bcrypt.hashpw(
+    PASSWORD.encode('utf-8'),
+    bcrypt.gensalt(int(os.environ['BCRYPT_LOG_ROUNDS'])),
+).decode('utf-8')
+
+
+@pytest.fixture(scope='session')
+def app():
+    return create_app('test')
+
+
+@pytest.fixture(autouse=True)
+def database(app, monkeypatch):
+    """Fresh tables and empty in-process caches for every test"""
+
+    monkeypatch.setattr(response_cache, 'response_cache',
+                        response_cache.MemoryResponseCache())
+    monkeypatch.setattr(ratelimit, 'store', ratelimit.MemoryBucketStore())
+    monkeypatch.setattr(routing, 'recent_writers', routing.MemoryWriterStore())
+    auth.token_cache.clear()
+    auth.principal_cache.clear()
+    ratelimit.unknown_usernames.clear()
+
+    with app.app_context():
+        db.create_all()
+        yield db
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """An empty mocked (moto) bucket; returns the S3 client"""
+
+    with mock_aws():
+        monkeypatch.setattr(aws, '_client', None)
+        client = aws.get_s3_client()
+        client.create_bucket(Bucket=aws.bucket)
+        yield client
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def auth_headers(username):
+    return {'Authorization': f'Bearer {create_jwt(username)}'}
+
+
+@pytest.fixture
+def seed(database):
+    """Three users; five rentals owned by alice; five reservations of them
+    by bob; and five messages in each of alice's two conversations"""
+
+    for username in ('alice', 'bob', 'carol'):
+        db.session.add(User(username=username, email=f'{username}@example.com',
+                            password=PASSWORD_HASH, location='Oakland',
+                            bio=None, image_url='default.jpg'))
+    db.session.flush()
+
+    rentals = [
+        Rental.add_rental(description=f'Backyard {i}', location='Oakland',
+                          price=50 + i, owner_username='alice',
+                          url=f'backyard-{i}.jpg')
+        for i in range(5)
+    ]
+    db.session.flush()
+
+    for i, rental in enumerate(rentals):
+        Reservation.add_reservation(start_date=f'2030-01-{i + 1:02d}',
+                                    end_date=f'2030-01-{i + 2:02d}',
+                                    rental_id=rental.id, renter='bob',
+                                    rating=i % 5 + 1)
+
+    conversations = {}
+    for other in ('bob', 'carol'):
+        conversation = Conversation.create_conversation('alice', other)
+        db.session.flush()
+        conversations[other] = conversation
+        for i in range(5):
+            sender, recipient = ('alice', other) if i % 2 else (other, 'alice')
+            Message.create_message(f'Hello {i}', sender, recipient,
+                                   conversation.id)
+
+    db.session.commit()
+
+    return {'rentals': rentals, 'conversations': conversations}
+
+
+@pytest.fixture
+def count_queries():
+    """Returns a context manager that collects the SQL statements run by
+    this thread while it is open"""
+
+    @contextmanager
+    def counter():
+        statements = []
+        thread = threading.get_ident()
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if threading.get_ident() == thread:
+                statements.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(Engine, 'before_cursor_execute', record)
+
+    return counter
@@ -0,0 +1,87 @@
+import time
+
+import jwt
+import pytest
+
+import app as app_module
+import metrics
+from conftest import auth_headers
+from helpers import create_jwt, secret
+
+
+@pytest.fixture(autouse=True)
+def quick_keepalive(monkeypatch):
+    """The test client reads the first chunk of an /events stream, which
+    would otherwise wait for the keepalive"""
+
+    monkeypatch.setattr(app_module, 'SSE_KEEPALIVE_SECONDS', 0.01)
+
+
+def get(client, url, **kwargs):
+    """GETs `url` without reading the body (the /events routes never end)"""
+
+    response = client.get(url, buffered=False, **kwargs)
+    response.close()
+    return response
+
+
+def test_requires_a_valid_token(seed, client):
+    assert get(client, '/messages/alice').status_code == 401
+
+    headers = {'Authorization': 'Bearer not-a-jwt'}
+    assert get(client, '/messages/alice', headers=headers).status_code == 401
+
+    expired = jwt.encode({'username': 'alice', 'iat': 0, 'exp': int(time.time()) - 1},
+                         secret, algorithm='HS256')
+    headers = {'Authorization': f'Bearer {expired}'}
+    assert get(client, '/messages/alice', headers=headers).status_code == 401
+
+    assert get(client, '/messages/alice', headers=auth_headers('alice')).status_code == 200
+
+
+def test_token_must_belong_to_the_url_user(seed, client):
+    response = get(client, '/messages/alice', headers=auth_headers('bob'))
+    assert response.status_code == 403
+
+
+def test_token_for_deleted_user_is_rejected(seed, client):
+    assert get(client, '/messages/dave', headers=auth_headers('dave')).status_code == 401
+
+
+def test_query_token_only_on_event_routes(seed, client):
+    token = create_jwt('alice')
+
+    assert get(client, f'/messages/alice?token={token}').status_code == 401
+    assert get(client, f'/messages/alice/events?token={token}').status_code == 200
+    assert get(client, f'/conversations/1/events?token={token}').status_code == 200
+
+
+def test_repeat_requests_skip_the_user_query(seed, client, count_queries):
+    headers = auth_headers('alice')
+
+    with count_queries() as first:
+        get(client, '/messages/alice/inbox', headers=headers)
+    with count_queries() as second:
+        get(client, '/messages/alice/inbox', headers=headers)
+
+    assert len(second) == len(first) - 1
+
+
+def test_conversations_are_private_to_their_users(seed, client):
+    conversation = seed['conversations']['bob']
+
+    for url in (f'/conversations/{conversation.id}/messages',
+                f'/conversations/{conversation.id}/events',
+                '/conversations/alice/bob/messages'):
+        assert get(client, url).status_code == 401
+        assert get(client, url, headers=auth_headers('carol')).status_code == 403
+        assert get(client, url, headers=auth_headers('bob')).status_code == 200
+
+    response = client.post('/conversations', json={'user1': 'alice', 'user2': 'bob'},
+                           headers=auth_headers('carol'))
+    assert response.status_code == 403
+
+
+def test_logged_path_drops_the_token(app):
+    with app.test_request_context('/messages/alice/events?token=abc&after_id=3'):
+        assert metrics.logged_path() == '/messages/alice/events?after_id=3'
@@ -0,0 +1,136 @@
+import base64
+import io
+import os
+
+import pytest
+from PIL import Image
+
+import app as app_module
+import aws
+from aws import MB, download_fileobj, get_s3_metrics, upload_bytes, upload_file, upload_fileobj
+from conftest import auth_headers
+from images import process_rental_image
+from models import db, Rental
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics(monkeypatch):
+    monkeypatch.setattr(aws, 's3_metrics', {})
+
+
+def get_object(s3, key):
+    return s3.get_object(Bucket=aws.bucket, Key=key)
+
+
+def test_upload_bytes(s3):
+    assert upload_bytes(b'hello', 'notes.txt') is True
+
+    obj = get_object(s3, 'notes.txt')
+    assert obj['Body'].read() == b'hello'
+    assert obj['ContentType'] == 'text/plain'
+    assert obj['ContentDisposition'] == 'inline'
+
+
+def test_large_upload_is_multipart(s3):
+    data = os.urandom(9 * MB)
+
+    assert upload_fileobj(io.BytesIO(data), 'big.bin') is True
+
+    obj = get_object(s3, 'big.bin')
+    assert obj['Body'].read() == data
+    assert obj['ETag'].strip('"').endswith('-2')
+    assert get_s3_metrics()['upload']['bytes'] == len(data)
+
+
+def test_upload_file(s3, tmp_path):
+    path = tmp_path / 'yard.jpeg'
+    path.write_bytes(b'jpeg bytes')
+
+    upload_file(str(path))
+
+    obj = get_object(s3, 'yard.jpeg')
+    assert obj['Body'].read() == b'jpeg bytes'
+    assert obj['ContentType'] == 'image/jpeg'
+
+
+def test_upload_to_missing_bucket_fails(s3):
+    assert upload_bytes(b'hello', 'notes.txt', bucket='no-such-bucket') is False
+    assert get_s3_metrics()['upload']['errors'] == 1
+
+
+def test_download_fileobj(s3):
+    s3.put_object(Bucket=aws.bucket, Key='notes.txt', Body=b'hello')
+    out = io.BytesIO()
+
+    assert download_fileobj('notes.txt', out) is True
+    assert out.getvalue() == b'hello'
+    assert download_fileobj('missing.txt', io.BytesIO()) is False
+
+    stats = get_s3_metrics()['download']
+    assert stats['count'] == 2
+    assert stats['bytes'] == 5
+
+
+def test_client_is_shared_until_fork(s3, monkeypatch):
+    assert aws.get_s3_client() is s3
+
+    monkeypatch.setattr(aws, '_client_pid', -1)
+
+    assert aws.get_s3_client() is not s3
+
+
+def photo_data(url):
+    buffer = io.BytesIO()
+    Image.new('RGB', (1000, 500), 'green').save(buffer, format='JPEG')
+    encoded = base64.b64encode(buffer.getvalue()).decode('ascii')
+
+    return {'url': url, 'bytes': f'data:image/jpeg;base64,{encoded}'}
+
+
+def test_process_rental_image_uploads_variants(app, s3, seed):
+    rental = seed['rentals'][0]
+
+    process_rental_image(app, rental.id, photo_data('yard.jpeg'))
+
+    sizes = {
+        key: Image.open(get_object(s3, key)['Body']).size
+        for key in ('thumbnail/yard.jpeg', 'medium/yard.jpeg', 'yard.jpeg')
+    }
+    assert sizes == {
+        'thumbnail/yard.jpeg': (200, 100),
+        'medium/yard.jpeg': (800, 400),
+        'yard.jpeg': (1000, 500),
+    }
+
+    db.session.refresh(rental)
+    assert rental.image_status == 'ready'
+
+
+def test_process_rental_image_marks_failures(app, s3, seed):
+    rental = seed['rentals'][0]
+
+    process_rental_image(app, rental.id, {'url': 'yard.jpeg',
+                                          'bytes': 'data:image/jpeg;base64,AAAA'})
+
+    db.session.refresh(rental)
+    assert rental.image_status == 'failed'
+    assert s3.list_objects(Bucket=aws.bucket).get('Contents') is None
+
+
+def test_new_rental_responds_pending_even_if_the_image_is_done_first(
+        client, s3, seed, monkeypatch):
+    """The background job can finish before the response is serialized"""
+
+    monkeypatch.setattr(app_module, 'submit_rental_image', process_rental_image)
+
+    response = client.post('/rentals/alice/add', headers=auth_headers('alice'),
+                           json={'rentalPhotos': photo_data('patio.jpeg'),
+                                 'rentalData': {'description': 'Patio',
+                                                'location': 'Oakland',
+                                                'price': '40',
+                                                'url': 'patio.jpeg'}})
+
+    assert response.status_code == 202
+    rental = response.get_json()['rental']
+    assert rental['image_status'] == 'pending'
+    assert db.session.get(Rental, rental['id']).image_status == 'ready'
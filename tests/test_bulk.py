@@ -0,0 +1,98 @@
+import json
+
+import pytest
+from sqlalchemy import event, select
+from sqlalchemy.exc import DataError
+
+from bulk import load_rows, validate_rental, validate_reservation, INTEGER_MAX
+from conftest import auth_headers
+from models import db, Rental
+
+
+def rental_row(**values):
+    return {'description': 'Yard', 'location': 'Oakland', 'price': 100,
+            'owner_username': 'alice', **values}
+
+
+@pytest.mark.parametrize('values, error', [
+    ({'price': -1}, 'price must be from 0'),
+    ({'price': INTEGER_MAX + 1}, 'price must be from 0'),
+    ({'location': 'x' * 101}, 'location must be at most 100 characters'),
+    ({'url': 'x' * 101}, 'url must be at most 100 characters'),
+    ({'latitude': 91, 'longitude': 0}, 'out of range'),
+    ({'latitude': 10}, 'given together'),
+])
+def test_validate_rental_rejects(values, error):
+    with pytest.raises(ValueError, match=error):
+        validate_rental(rental_row(**values))
+
+
+def test_validate_rental_accepts_limits():
+    values = validate_rental(rental_row(price=INTEGER_MAX, location='x' * 100,
+                                        url='x' * 100))
+
+    assert values['price'] == INTEGER_MAX
+    assert values['geohash'] is None
+
+
+def test_validate_reservation_rejects_huge_rental_id():
+    with pytest.raises(ValueError, match='rental_id'):
+        validate_reservation({'rental_id': INTEGER_MAX + 1, 'renter': 'bob',
+                              'start_date': '2030-01-01',
+                              'end_date': '2030-01-02'})
+
+
+def test_load_rows_reports_bad_rows(seed):
+    rows = enumerate([
+        rental_row(description='Good'),
+        rental_row(price=-5),
+        rental_row(location='x' * 200),
+        rental_row(description='Also good'),
+    ], start=1)
+
+    inserted, errors = load_rows('rentals', rows)
+
+    assert inserted == 2
+    assert [e['row'] for e in errors] == [2, 3]
+
+
+def test_data_error_falls_back_to_row_by_row(seed):
+    """A value the database can't store (e.g. too long for a varchar on
+    Postgres) rejects only its row"""
+
+    def reject_bad(conn, cursor, statement, parameters, context, executemany):
+        rows = parameters if executemany else [parameters]
+        if statement.startswith('INSERT INTO rentals') and any(
+                'Bad' in str(row) for row in rows):
+            raise DataError(statement, parameters, Exception('value too long'))
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', reject_bad)
+    try:
+        rows = enumerate([rental_row(description=d)
+                          for d in ('One', 'Bad', 'Two')], start=1)
+        inserted, errors = load_rows('rentals', rows)
+    finally:
+        event.remove(engine, 'before_cursor_execute', reject_bad)
+
+    assert inserted == 2
+    assert errors == [{'row': 2, 'error': 'value too long'}]
+    assert 'Bad' not in db.session.scalars(select(Rental.description)).all()
+
+
+def test_bulk_route_reports_long_values(client, seed):
+    body = '\n'.join(json.dumps(row) for row in (
+        {'description': 'Yard', 'location': 'Oakland', 'price': 10},
+        {'description': 'Yard', 'location': 'Oakland', 'price': 10,
+         'url': 'x' * 150},
+    ))
+
+    response = client.post('/rentals/alice/bulk', data=body,
+                           headers=auth_headers('alice'),
+                           content_type='application/x-ndjson')
+
+    assert response.status_code == 200
+    assert response.get_json()['inserted'] == 1
+    assert response.get_json()['errors'] == [
+        {'row': 2, 'error': 'url must be at most 100 characters'},
+    ]
@@ -0,0 +1,86 @@
+import os
+from functools import partial
+
+from dotenv import dotenv_values
+from flask import Flask, current_app
+from flask_sqlalchemy import SQLAlchemy
+
+from app import create_app
+from config import ProdConfig, DevConfig, PROD_POOL, engine_options
+from routing import replica_binds
+
+
+def test_defaults_to_prod(monkeypatch):
+    monkeypatch.delenv('APP_PROFILE', raising=False)
+    monkeypatch.setattr(ProdConfig, 'SQLALCHEMY_DATABASE_URI', 'sqlite://')
+
+    app = create_app()
+
+    assert not app.config['SQLALCHEMY_ECHO']
+    assert not app.config['DEBUG_TOOLBAR']
+    # Set by DebugToolbarExtension.init_app
+    assert 'DEBUG_TB_ENABLED' not in app.config
+
+
+def test_dev_logs_queries_and_loads_the_toolbar(monkeypatch):
+    monkeypatch.setattr(DevConfig, 'SQLALCHEMY_DATABASE_URI', 'sqlite://')
+
+    app = create_app('dev')
+
+    assert app.config['SQLALCHEMY_ECHO']
+    assert 'DEBUG_TB_ENABLED' in app.config
+
+
+def test_flask_commands_use_dev():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    assert dotenv_values(os.path.join(root, '.flaskenv'))['APP_PROFILE'] == 'dev'
+
+
+def test_create_app_pushes_no_app_context():
+    app = create_app('test')
+
+    assert current_app._get_current_object() is not app
+
+
+def test_engine_options():
+    options = engine_options('postgresql://db/sharebnb', pool_size=10,
+                             max_overflow=20, statement_timeout_ms=5000)
+
+    assert options['pool_size'] == 10
+    assert options['max_overflow'] == 20
+    assert options['pool_pre_ping']
+    assert options['connect_args'] == {'options': '-c statement_timeout=5000'}
+
+    assert engine_options('sqlite://', 10, 20, 5000) == {}
+
+
+def test_replicas_get_the_profile_engine_options():
+    binds = replica_binds('postgresql://r0/sharebnb, postgresql://r1/sharebnb',
+                          partial(engine_options, **PROD_POOL))
+
+    assert binds == {
+        f'replica_{i}': {
+            'url': f'postgresql://r{i}/sharebnb',
+            **engine_options(f'postgresql://r{i}/sharebnb', **PROD_POOL),
+        }
+        for i in range(2)
+    }
+    assert binds['replica_0']['pool_pre_ping']
+    assert replica_binds('') == {}
+
+
+def test_replica_engines_are_built_with_their_options():
+    """Flask-SQLAlchemy applies a dict bind's options to that engine only"""
+
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI='sqlite://',
+        SQLALCHEMY_ENGINE_OPTIONS={'pool_pre_ping': True},
+        SQLALCHEMY_BINDS=replica_binds('sqlite://', lambda url: {'pool_pre_ping': True}),
+    )
+    extension = SQLAlchemy(app)
+
+    with app.app_context():
+        assert extension.engines[None].pool._pre_ping
+        assert extension.engines['replica_0'].pool._pre_ping
@@ -0,0 +1,123 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+
+from conftest import auth_headers, PASSWORD_HASH
+from models import db, User, Conversation, Message
+
+
+@pytest.fixture
+def mixed_case_users(database):
+    for username in ('Zed', 'amy'):
+        db.session.add(User(username=username, email=f'{username}@example.com',
+                            password=PASSWORD_HASH))
+    db.session.commit()
+
+
+def test_pair_is_stored_in_code_point_order(mixed_case_users):
+    conversation, created = Conversation.get_or_create('amy', 'Zed')
+    db.session.commit()
+
+    assert created
+    assert (conversation.user1_username, conversation.user2_username) == ('Zed', 'amy')
+    assert Conversation.get_or_create('Zed', 'amy') == (conversation, False)
+
+
+def test_pair_is_unique(mixed_case_users):
+    Conversation.create_conversation('Zed', 'amy')
+    db.session.commit()
+
+    Conversation.create_conversation('amy', 'Zed')
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+
+@pytest.mark.parametrize('dialect, check', [
+    (postgresql.dialect(), 'CHECK ((user1_username COLLATE "C") <= user2_username)'),
+    (sqlite.dialect(), 'CHECK (user1_username <= user2_username)'),
+])
+def test_order_check_matches_python(dialect, check):
+    ddl = str(CreateTable(Conversation.__table__).compile(dialect=dialect))
+
+    assert ddl.count('ck_conversations_user_pair_ordered') == 1
+    assert check in ddl
+
+
+def inbox_order(username, **kwargs):
+    rows, has_more = Conversation.get_inbox(username, **kwargs)
+    return [conversation.id for conversation, message, unread in rows], has_more
+
+
+def test_inbox_is_newest_conversation_first(seed):
+    bob, carol = seed['conversations']['bob'], seed['conversations']['carol']
+
+    assert inbox_order('alice') == ([carol.id, bob.id], False)
+
+    Message.create_message('Still free?', 'bob', 'alice', bob.id)
+    db.session.commit()
+
+    rows, has_more = Conversation.get_inbox('alice')
+    assert [(c.id, m.content, unread) for c, m, unread in rows] == [
+        (bob.id, 'Still free?', 4), (carol.id, 'Hello 4', 3)]
+    assert inbox_order('bob') == ([bob.id], False)
+
+
+def test_inbox_pages_before_a_conversation(seed):
+    bob, carol = seed['conversations']['bob'], seed['conversations']['carol']
+
+    assert inbox_order('alice', limit=1) == ([carol.id], True)
+    assert inbox_order('alice', before=carol.id, limit=1) == ([bob.id], False)
+    assert inbox_order('alice', before=bob.id) == ([], False)
+
+
+def test_inbox_cursor_must_be_the_users_conversation(seed, client):
+    other = Conversation.create_conversation('bob', 'carol')
+    db.session.flush()
+    Message.create_message('Hi', 'bob', 'carol', other.id)
+    db.session.commit()
+
+    with pytest.raises(ValueError):
+        Conversation.get_inbox('alice', before=other.id)
+
+    response = client.get(f'/messages/alice/inbox?before={other.id}',
+                          headers=auth_headers('alice'))
+    assert response.status_code == 400
+
+
+def test_marking_read_drops_the_unread_count(seed, client):
+    bob = seed['conversations']['bob']
+    headers = auth_headers('alice')
+
+    def unread_counts():
+        inbox = client.get('/messages/alice/inbox', headers=headers).get_json()
+        return {row['conversation']['id']: row['unread_count']
+                for row in inbox['conversations']}
+
+    assert set(unread_counts().values()) == {3}
+
+    response = client.post(f'/conversations/{bob.id}/read', headers=headers)
+
+    assert response.get_json()['marked'] == 3
+    assert unread_counts() == {bob.id: 0, seed['conversations']['carol'].id: 3}
+
+
+def test_older_message_does_not_replace_the_last_message(seed):
+    bob = seed['conversations']['bob']
+    last_id, last_at = bob.last_message_id, bob.last_message_at
+
+    # Committed after the newest message, but stamped before it
+    message = Message(content='Late', sender_username='bob',
+                      recipient_username='alice', conversation_id=bob.id,
+                      timestamp=last_at - timedelta(minutes=1))
+    db.session.add(message)
+    db.session.flush()
+    Conversation.record_message(message)
+    db.session.commit()
+
+    db.session.refresh(bob)
+    assert (bob.last_message_id, bob.last_message_at) == (last_id, last_at)
+    assert message.id > last_id
@@ -0,0 +1,73 @@
+import pytest
+
+import app as app_module
+from conftest import auth_headers
+from pubsub import broker, conversation_channel
+
+
+@pytest.fixture(autouse=True)
+def quick_keepalive(monkeypatch):
+    """Lets the stream yield a keepalive instead of blocking for a message"""
+
+    monkeypatch.setattr(app_module, 'SSE_KEEPALIVE_SECONDS', 0.01)
+
+
+def subscribers(conversation):
+    return len(broker._subscriptions.get(conversation_channel(conversation.id), ()))
+
+
+def next_event(chunks):
+    """Returns the next message event, skipping keepalives"""
+
+    for _ in range(100):
+        chunk = next(chunks)
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode()
+        if chunk.startswith('id: '):
+            return chunk
+
+    raise AssertionError('No message arrived on the stream')
+
+
+def test_sent_message_arrives_on_the_stream(client, seed):
+    conversation = seed['conversations']['bob']
+
+    response = client.get(f'/conversations/{conversation.id}/events',
+                          headers=auth_headers('bob'), buffered=False)
+    chunks = iter(response.response)
+    assert subscribers(conversation) == 1
+
+    sent = client.post('/messages', headers=auth_headers('alice'),
+                       json={'sender': 'alice', 'recipient': 'bob',
+                             'content': 'Is the yard free on Sunday?'})
+    [message] = [m for m in sent.get_json()['conversation']
+                 if m['content'] == 'Is the yard free on Sunday?']
+
+    event = next_event(chunks)
+    assert event.startswith(f"id: {message['id']}\nevent: message\n")
+    assert 'Is the yard free on Sunday?' in event
+
+    response.close()
+    assert subscribers(conversation) == 0
+
+
+def test_head_request_does_not_leak_a_subscription(client, seed):
+    conversation = seed['conversations']['bob']
+
+    response = client.head(f'/conversations/{conversation.id}/events',
+                           headers=auth_headers('bob'))
+    response.close()
+
+    assert response.status_code == 200
+    assert subscribers(conversation) == 0
+
+
+def test_unread_stream_is_unsubscribed_on_close(client, seed):
+    conversation = seed['conversations']['bob']
+
+    response = client.get(f'/conversations/{conversation.id}/events',
+                          headers=auth_headers('bob'), buffered=False)
+    assert subscribers(conversation) == 1
+
+    response.close()
+    assert subscribers(conversation) == 0
@@ -0,0 +1,86 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+import aws
+import image_cache
+from image_cache import DiskLRU, get_original
+
+
+def png_bytes(size=(40, 20)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def images(s3, tmp_path, monkeypatch):
+    """A fresh disk cache, and a photo and a text file in the bucket"""
+
+    monkeypatch.setattr(image_cache, '_cache', DiskLRU(tmp_path, 1024 * 1024))
+    s3.put_object(Bucket=aws.bucket, Key='yard.png', Body=png_bytes())
+    s3.put_object(Bucket=aws.bucket, Key='notes.png', Body=b'not an image')
+    return s3
+
+
+def test_original(client, images):
+    response = client.get('/images/yard.png')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert response.get_data() == png_bytes()
+
+
+def test_resized_and_converted(client, images):
+    response = client.get('/images/yard.png?w=10&fmt=webp')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'image/webp'
+    assert Image.open(io.BytesIO(response.get_data())).size == (10, 5)
+
+
+def test_missing(client, images):
+    assert client.get('/images/nope.png').status_code == 404
+    assert client.get('/images/nope.png?w=10').status_code == 404
+
+
+def test_undecodable_image(client, images):
+    response = client.get('/images/notes.png?w=10')
+
+    assert response.status_code == 415
+    assert os.listdir(image_cache.get_cache().directory) == [
+        'original-' + image_cache.hashlib.sha1(b'notes.png').hexdigest(),
+    ]
+
+    # Served as is when not resized
+    assert client.get('/images/notes.png').get_data() == b'not an image'
+
+
+def evict_after_first_get(monkeypatch):
+    """Deletes the original right after the first lookup returns it, as
+    an eviction by another request would"""
+
+    lookups = []
+
+    def get_original_then_evict(key):
+        path = get_original(key)
+        if not lookups:
+            os.remove(path)
+        lookups.append(path)
+        return path
+
+    monkeypatch.setattr(image_cache, 'get_original', get_original_then_evict)
+
+    return lookups
+
+
+@pytest.mark.parametrize('query', ['', '?w=10'])
+def test_original_evicted_before_read(client, images, monkeypatch, query):
+    lookups = evict_after_first_get(monkeypatch)
+
+    response = client.get('/images/yard.png' + query)
+
+    assert response.status_code == 200
+    assert len(lookups) == 2
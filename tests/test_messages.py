@@ -0,0 +1,79 @@
+import pytest
+
+from conftest import auth_headers
+from models import Message
+
+
+def message_ids(conversation):
+    """The conversation's message ids, oldest first"""
+
+    return [message.id for message in
+            Message.query.filter_by(conversation_id=conversation.id)
+            .order_by(Message.timestamp, Message.id)]
+
+
+def page(conversation, **kwargs):
+    messages, has_more = Message.get_conversation_page(conversation.id, **kwargs)
+    return [message.id for message in messages], has_more
+
+
+def test_newest_page_comes_first_oldest_message_first(seed):
+    conversation = seed['conversations']['bob']
+    ids = message_ids(conversation)
+
+    assert page(conversation) == (ids, False)
+    assert page(conversation, limit=2) == (ids[3:], True)
+
+
+def test_before_pages_back_to_the_start(seed):
+    conversation = seed['conversations']['bob']
+    ids = message_ids(conversation)
+
+    assert page(conversation, before=ids[3], limit=2) == (ids[1:3], True)
+    assert page(conversation, before=ids[1], limit=2) == (ids[:1], False)
+    assert page(conversation, before=ids[0]) == ([], False)
+
+
+def test_after_pages_forward_to_the_end(seed):
+    conversation = seed['conversations']['bob']
+    ids = message_ids(conversation)
+
+    assert page(conversation, after=ids[0], limit=2) == (ids[1:3], True)
+    assert page(conversation, after=ids[2], limit=2) == (ids[3:], False)
+    assert page(conversation, after=ids[4]) == ([], False)
+
+
+@pytest.mark.parametrize('param', ['before', 'after'])
+def test_cursor_from_another_conversation_is_rejected(seed, param):
+    other = message_ids(seed['conversations']['carol'])[2]
+
+    with pytest.raises(ValueError):
+        Message.get_conversation_page(seed['conversations']['bob'].id,
+                                      **{param: other})
+
+
+def get_page(client, conversation, query):
+    response = client.get(f'/conversations/{conversation.id}/messages?{query}',
+                          headers=auth_headers('alice'))
+    if response.status_code != 200:
+        return response.status_code
+
+    data = response.get_json()
+    return [message['id'] for message in data['messages']], data['has_more']
+
+
+def test_route_pages_with_each_cursor(client, seed):
+    conversation = seed['conversations']['bob']
+    ids = message_ids(conversation)
+
+    assert get_page(client, conversation, 'limit=2') == (ids[3:], True)
+    assert get_page(client, conversation, f'before={ids[3]}&limit=2') == (ids[1:3], True)
+    assert get_page(client, conversation, f'after={ids[2]}&limit=2') == (ids[3:], False)
+    assert get_page(client, conversation, f'after_id={ids[0]}&limit=3') == (ids[1:4], True)
+
+
+@pytest.mark.parametrize('param', ['before', 'after', 'after_id'])
+def test_route_rejects_a_cursor_from_another_conversation(client, seed, param):
+    other = message_ids(seed['conversations']['carol'])[2]
+
+    assert get_page(client, seed['conversations']['bob'], f'{param}={other}') == 400
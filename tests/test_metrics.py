@@ -0,0 +1,87 @@
+import io
+import logging
+
+import pytest
+from PIL import Image
+
+import aws
+import image_cache
+import metrics
+from image_cache import DiskLRU
+
+
+def observed(histogram, endpoint, method='GET'):
+    """Returns (count, sum) of a request histogram for an endpoint"""
+
+    stats = histogram._values.get((f'sharebnb.{endpoint}', method))
+    if stats is None:
+        return 0, 0.0
+    return stats['count'], stats['sum']
+
+
+def test_streamed_response_records_encoding_once_sent(client, seed):
+    before = observed(metrics.request_serialization_seconds, 'get_rentals')
+    queries_before = observed(metrics.request_db_queries, 'get_rentals')
+
+    response = client.get('/rentals?stream=1')
+    assert observed(metrics.request_serialization_seconds, 'get_rentals') == before
+
+    lines = response.get_data().splitlines()
+    response.close()
+
+    count, seconds = observed(metrics.request_serialization_seconds, 'get_rentals')
+    assert len(lines) == 5
+    assert count == before[0] + 1
+    assert seconds > before[1]
+
+    # The rows were queried while streaming
+    count, queries = observed(metrics.request_db_queries, 'get_rentals')
+    assert queries >= queries_before[1] + 1
+
+
+def test_json_response_records_encoding(client, seed):
+    before = observed(metrics.request_serialization_seconds, 'get_rentals')
+
+    client.get('/rentals')
+
+    count, seconds = observed(metrics.request_serialization_seconds, 'get_rentals')
+    assert count == before[0] + 1
+    assert seconds > before[1]
+
+
+@pytest.fixture
+def image(s3, tmp_path, monkeypatch):
+    monkeypatch.setattr(image_cache, '_cache', DiskLRU(tmp_path, 1024 * 1024))
+    buffer = io.BytesIO()
+    Image.new('RGB', (10, 10)).save(buffer, format='PNG')
+    s3.put_object(Bucket=aws.bucket, Key='yard.png', Body=buffer.getvalue())
+
+
+def test_s3_time_is_recorded_per_request(client, image, app, monkeypatch, caplog):
+    monkeypatch.setitem(app.config, 'SLOW_REQUEST_MS', -1)
+    before = observed(metrics.request_s3_seconds, 'get_image')
+
+    with caplog.at_level(logging.WARNING):
+        client.get('/images/yard.png').close()
+        client.get('/images/yard.png').close()
+
+    count, seconds = observed(metrics.request_s3_seconds, 'get_image')
+    assert count == before[0] + 2
+    assert seconds > before[1]
+
+    # Only the first request went to S3
+    s3_times = [record.args[-1] for record in caplog.records
+                if record.getMessage().startswith('Slow request: GET /images/')]
+    assert len(s3_times) == 2
+    assert s3_times[0] > 0
+    assert s3_times[1] == 0
+
+
+def test_s3_outside_a_request_only_counts_globally(app, s3, monkeypatch):
+    monkeypatch.setattr(aws, 's3_metrics', {})
+
+    with app.app_context():
+        with aws.timed_s3('upload'):
+            pass
+
+    assert aws.get_s3_metrics()['upload']['count'] == 1
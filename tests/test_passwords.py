@@ -0,0 +1,66 @@
+import os
+import signal
+import time
+
+import pytest
+
+import passwords
+from passwords import (hash_password, check_password, needs_rehash,
+                       PasswordPoolBusy, BCRYPT_LOG_ROUNDS)
+
+
+def test_hash_and_check():
+    hashed = hash_password('secret')
+
+    assert check_password(hashed, 'secret')
+    assert not check_password(hashed, 'wrong')
+    assert not needs_rehash(hashed)
+
+
+def test_needs_rehash_when_cost_changes():
+    hashed = hash_password('secret')
+    other_cost = hashed.replace(f'${BCRYPT_LOG_ROUNDS:02d}$',
+                                f'${BCRYPT_LOG_ROUNDS + 1:02d}$', 1)
+
+    assert needs_rehash(other_cost)
+    assert needs_rehash('not-a-bcrypt-hash')
+
+
+def test_busy_pool_is_rejected(monkeypatch):
+    monkeypatch.setattr(passwords, '_pending', passwords.threading.BoundedSemaphore(1))
+    passwords._pending.acquire()
+
+    with pytest.raises(PasswordPoolBusy):
+        hash_password('secret')
+
+
+def test_pool_is_replaced_after_a_worker_dies():
+    hash_password('secret')
+    pool = passwords.get_pool()
+
+    for pid in list(pool._processes):
+        os.kill(pid, signal.SIGKILL)
+
+    deadline = time.monotonic() + 10
+    while not pool._broken and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    hashed = hash_password('secret')
+
+    assert check_password(hashed, 'secret')
+    assert passwords.get_pool() is not pool
+
+
+def test_login_rehashes_an_old_cost_factor(seed, client):
+    from conftest import PASSWORD
+    from models import db, User
+
+    old_hash = passwords._hashpw(PASSWORD, BCRYPT_LOG_ROUNDS + 1)
+    db.session.get(User, 'alice').password = old_hash
+    db.session.commit()
+
+    response = client.post('/login', json={'username': 'alice', 'password': PASSWORD})
+
+    assert response.status_code == 200
+    db.session.expire_all()
+    assert not needs_rehash(db.session.get(User, 'alice').password)
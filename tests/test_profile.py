@@ -0,0 +1,63 @@
+from conftest import auth_headers
+
+
+def get_profile(client, username, include, as_user=None):
+    return client.get(f'/users/{username}/profile?include={include}',
+                      headers=auth_headers(as_user or username))
+
+
+def test_sections_are_opt_in(seed, client):
+    response = get_profile(client, 'alice', '')
+
+    assert response.status_code == 200
+    assert set(response.json) == {'user'}
+    assert response.json['user']['username'] == 'alice'
+
+
+def test_all_sections(seed, client):
+    response = get_profile(client, 'bob', 'rentals,reservations,messages')
+
+    assert response.json['rentals'] == []
+    assert response.json['reservations'] == {'total': 5, 'upcoming': 5}
+    # bob received two of the five messages in his conversation with alice
+    assert response.json['unread_messages'] == 2
+
+    response = get_profile(client, 'alice', 'rentals')
+    assert len(response.json['rentals']) == 5
+
+
+def test_reading_a_conversation_clears_its_unread_count(seed, client):
+    conversation = seed['conversations']['bob']
+
+    response = client.post(f'/conversations/{conversation.id}/read',
+                           headers=auth_headers('bob'))
+    assert response.json == {'marked': 2}
+
+    response = get_profile(client, 'bob', 'messages')
+    assert response.json['unread_messages'] == 0
+
+
+def test_counts_come_from_one_query(seed, client, count_queries):
+    # Warm the auth cache, so only the profile's own queries are counted
+    get_profile(client, 'alice', '')
+
+    with count_queries() as statements:
+        get_profile(client, 'alice', 'reservations,messages')
+    assert len(statements) == 1
+
+    with count_queries() as statements:
+        get_profile(client, 'alice', 'rentals,reservations,messages')
+    assert len(statements) == 2
+
+
+def test_rejects_unknown_sections_and_other_users(seed, client):
+    assert get_profile(client, 'alice', 'passwords').status_code == 400
+    assert get_profile(client, 'alice', '', as_user='bob').status_code == 403
+
+
+def test_public_user_route_includes_rentals(seed, client):
+    response = client.get('/users/alice')
+
+    assert response.json['user']['username'] == 'alice'
+    assert len(response.json['rentals']) == 5
+    assert client.get('/users/nobody').status_code == 404
@@ -0,0 +1,130 @@
+import pytest
+
+import app as app_module
+from conftest import PASSWORD, auth_headers
+
+
+# Most SQL statements each route may run, against the `seed` fixture's
+# data. The seeded lists have five or more rows, so a per-row query (N+1)
+# pushes a route over budget. Auth lookups are included: the token and
+# user caches start empty. Bulk loads are allowed one statement per chunk
+# plus one rating update per distinct rental, so theirs book one rental.
+ROUTE_BUDGETS = [
+    # (method, rule, url, budget, request kwargs)
+    ('GET', '/metrics', '/metrics', 0, {}),
+    ('POST', '/signup', '/signup', 1, {'json': {
+        'username': 'dave', 'password': PASSWORD, 'email': 'dave@example.com',
+        'location': '', 'bio': '', 'image_url': ''}}),
+    ('POST', '/login', '/login', 1, {'json': {
+        'username': 'alice', 'password': PASSWORD}}),
+    ('GET', '/rentals', '/rentals', 1, {}),
+    ('GET', '/rentals', '/rentals?ids=1,2,3,4,5', 1, {}),
+    ('GET', '/rentals', '/rentals?stream=1', 1, {}),
+    ('GET', '/rentals/search', '/rentals/search?q=backyard', 1, {}),
+    ('GET', '/rentals/search', '/rentals/search?lat=37.8&lon=-122.27', 1, {}),
+    ('GET', '/rentals/available', '/rentals/available?start=2030-01-01&end=2030-01-03', 1, {}),
+    ('POST', '/rentals/<username>/add', '/rentals/alice/add', 3, {
+        'headers': auth_headers('alice'),
+        'json': {'rentalPhotos': '', 'rentalData': {
+            'description': 'Garden', 'location': 'Oakland', 'price': 40,
+            'url': 'garden.jpg'}}}),
+    ('POST', '/rentals/<username>/bulk', '/rentals/alice/bulk', 4, {
+        'headers': auth_headers('alice'),
+        'data': '\n'.join(
+            f'{{"description": "Yard {i}", "location": "Oakland", "price": {i + 10}, "url": "yard-{i}.jpg"}}'
+            for i in range(5))}),
+    ('GET', '/rentals/<username>', '/rentals/alice', 2, {}),
+    ('GET', '/rentals/<int:rental_id>', '/rentals/1', 1, {}),
+    ('GET', '/users/<username>', '/users/alice', 2, {}),
+    ('GET', '/users/<username>/profile', '/users/alice/profile?include=rentals,reservations,messages', 3, {
+        'headers': auth_headers('alice')}),
+    ('GET', '/reservations/<username>/', '/reservations/bob/', 2, {
+        'headers': auth_headers('bob')}),
+    ('GET', '/reservations/<username>/<int:reservation_id>', '/reservations/bob/1', 2, {
+        'headers': auth_headers('bob')}),
+    ('POST', '/reservations/<username>/add', '/reservations/carol/add', 6, {
+        'headers': auth_headers('carol'),
+        'json': {'rental_id': 1, 'start_date': '2031-01-01',
+                 'end_date': '2031-01-02', 'rating': 5}}),
+    ('POST', '/reservations/<username>/bulk', '/reservations/carol/bulk', 5, {
+        'headers': auth_headers('carol'),
+        'data': '\n'.join(
+            f'{{"rental_id": 1, "start_date": "2032-01-{i * 2 + 1:02d}", "end_date": "2032-01-{i * 2 + 2:02d}", "rating": 4}}'
+            for i in range(5))}),
+    ('GET', '/messages/<username>', '/messages/alice', 3, {
+        'headers': auth_headers('alice')}),
+    ('GET', '/messages/<username>/inbox', '/messages/alice/inbox', 2, {
+        'headers': auth_headers('alice')}),
+    ('GET', '/messages/<username>/events', '/messages/alice/events', 2, {
+        'headers': auth_headers('alice')}),
+    ('GET', '/messages/<username>/<int:message_id>', '/messages/alice/2', 2, {
+        'headers': auth_headers('alice')}),
+    ('POST', '/messages', '/messages', 9, {
+        'headers': auth_headers('alice'),
+        'json': {'sender': 'alice', 'recipient': 'bob', 'content': 'Hi'}}),
+    ('POST', '/conversations', '/conversations', 9, {
+        'headers': auth_headers('bob'),
+        'json': {'user1': 'bob', 'user2': 'carol'}}),
+    ('GET', '/conversations/<username>', '/conversations/alice', 3, {
+        'headers': auth_headers('alice')}),
+    ('GET', '/conversations/<int:conversation_id>/messages', '/conversations/1/messages', 3, {
+        'headers': auth_headers('alice')}),
+    ('GET', '/conversations/<int:conversation_id>/events', '/conversations/1/events', 2, {
+        'headers': auth_headers('alice')}),
+    ('POST', '/conversations/<int:conversation_id>/read', '/conversations/1/read', 3, {
+        'headers': auth_headers('alice')}),
+    ('GET', '/conversations/<sender>/<recipient>/messages', '/conversations/alice/bob/messages', 3, {
+        'headers': auth_headers('alice')}),
+]
+
+# Routes that can't run against the test database alone
+UNBUDGETED_RULES = {
+    '/images/<path:key>',  # reads from S3; no database queries
+}
+
+
+@pytest.fixture(autouse=True)
+def no_image_processing(monkeypatch):
+    """Photo processing runs (and queries) on a background thread"""
+
+    monkeypatch.setattr(app_module, 'submit_rental_image',
+                        lambda app, rental_id, photo_data: None)
+
+
+@pytest.fixture(autouse=True)
+def quick_keepalive(monkeypatch):
+    """The test client reads the first chunk of an /events stream"""
+
+    monkeypatch.setattr(app_module, 'SSE_KEEPALIVE_SECONDS', 0.01)
+
+
+def test_every_route_has_a_budget(app):
+    rules = {(method, rule.rule)
+             for rule in app.url_map.iter_rules()
+             if rule.endpoint.startswith('sharebnb.')
+             for method in rule.methods - {'HEAD', 'OPTIONS'}}
+    budgeted = {(method, rule) for method, rule, *_ in ROUTE_BUDGETS}
+
+    missing = {(method, rule) for method, rule in rules - budgeted
+               if rule not in UNBUDGETED_RULES}
+
+    assert not missing, f'Add query budgets for {sorted(missing)}'
+
+
+@pytest.mark.parametrize(
+    'method, rule, url, budget, kwargs', ROUTE_BUDGETS,
+    ids=[f'{method} {url}' for method, rule, url, *_ in ROUTE_BUDGETS],
+)
+def test_route_query_budget(seed, client, count_queries, method, rule, url,
+                            budget, kwargs):
+    with count_queries() as statements:
+        response = client.open(url, method=method, buffered=False, **kwargs)
+        status = response.status_code
+        if not response.is_streamed or rule.endswith('/events'):
+            response.close()
+        else:
+            response.get_data()
+            response.close()
+
+    assert status < 400, response.get_data(as_text=True)
+    assert len(statements) <= budget, '\n'.join(statements)
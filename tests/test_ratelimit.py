@@ -0,0 +1,101 @@
+import math
+from types import SimpleNamespace
+
+import pytest
+
+import ratelimit
+from conftest import PASSWORD
+from ratelimit import (MemoryBucketStore, is_unknown_username,
+                       remember_unknown_username)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Lets a test move the bucket store's clock by hand"""
+
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(ratelimit, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_bucket_refills_at_its_rate(clock):
+    store = MemoryBucketStore()
+
+    assert [store.take('k', 3, 1) for _ in range(3)] == [0, 0, 0]
+    assert store.take('k', 3, 1) == pytest.approx(1)
+
+    clock.now += 0.5
+    assert store.take('k', 3, 1) == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert store.take('k', 3, 1) == 0
+    assert store.take('other', 3, 1) == 0
+
+
+def test_bucket_refills_no_further_than_its_capacity(clock):
+    store = MemoryBucketStore()
+    store.take('k', 3, 1)
+
+    clock.now += 100
+
+    assert [store.take('k', 3, 1) for _ in range(3)] == [0, 0, 0]
+    assert store.take('k', 3, 1) > 0
+
+
+def login(client, username, password='wrong', ip='127.0.0.1'):
+    return client.post('/login', json={'username': username, 'password': password},
+                       environ_base={'REMOTE_ADDR': ip})
+
+
+def test_too_many_attempts_get_429_with_retry_after(client, seed):
+    for _ in range(ratelimit.LOGIN_ATTEMPTS_PER_USERNAME):
+        assert login(client, 'alice').status_code == 401
+
+    response = login(client, 'alice', PASSWORD)
+
+    # One token refills every 60 / LOGIN_ATTEMPTS_PER_USERNAME seconds
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == str(math.ceil(
+        60 / ratelimit.LOGIN_ATTEMPTS_PER_USERNAME))
+
+
+def test_username_bucket_spans_ips(client, seed):
+    for i in range(ratelimit.LOGIN_ATTEMPTS_PER_USERNAME):
+        login(client, 'alice', ip=f'10.0.0.{i}')
+
+    assert login(client, 'alice', PASSWORD, ip='10.0.1.1').status_code == 429
+    assert login(client, 'bob', PASSWORD, ip='10.0.1.1').status_code == 200
+
+
+def test_ip_bucket_spans_usernames(client, seed, monkeypatch):
+    monkeypatch.setattr(ratelimit, 'LOGIN_ATTEMPTS_PER_IP', 3)
+
+    for username in ('alice', 'bob', 'carol'):
+        assert login(client, username).status_code == 401
+
+    assert login(client, 'bob', PASSWORD).status_code == 429
+    assert login(client, 'bob', PASSWORD, ip='10.0.0.2').status_code == 200
+
+
+def test_unknown_username_skips_the_db(client, seed, count_queries):
+    with count_queries() as first:
+        assert login(client, 'mallory').status_code == 401
+    assert is_unknown_username('mallory')
+
+    with count_queries() as second:
+        assert login(client, 'mallory').status_code == 401
+
+    assert first
+    assert second == []
+
+
+def test_signup_forgets_the_unknown_username(client, seed):
+    remember_unknown_username('dave')
+
+    response = client.post('/signup', json={
+        'username': 'dave', 'password': PASSWORD, 'email': 'dave@example.com',
+        'location': '', 'bio': '', 'image_url': ''})
+
+    assert response.status_code == 200
+    assert not is_unknown_username('dave')
+    assert login(client, 'dave', PASSWORD).status_code == 200
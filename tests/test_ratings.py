@@ -0,0 +1,75 @@
+import pytest
+
+from conftest import auth_headers
+from models import db, Rental, Rating, Reservation
+from test_rentals import add_rentals, all_pages
+
+
+def aggregates(rental):
+    db.session.refresh(rental)
+    data = rental.serialize()
+    return (data['rating_count'], rental.rating_sum, data['rating_mean'],
+            data['rating_histogram'])
+
+
+def test_ratings_and_rated_reservations_update_aggregates(database):
+    [rental] = add_rentals([100])
+    assert aggregates(rental) == (0, 0, None, dict.fromkeys('12345', 0))
+
+    Rating.add_rating(5, rental.id)
+    Rating.add_rating(4, rental.id)
+    Reservation.add_reservation('2031-01-01', '2031-01-02', rental.id, 'alice', rating=4)
+    Reservation.add_reservation('2031-02-01', '2031-02-02', rental.id, 'alice')
+    db.session.commit()
+
+    assert aggregates(rental) == (3, 13, pytest.approx(13 / 3),
+                                  {'1': 0, '2': 0, '3': 0, '4': 2, '5': 1})
+
+
+def test_record_ratings_adds_many_at_once(database):
+    [rental] = add_rentals([100])
+
+    Rental.record_ratings(rental.id, [1, 1, 3])
+    Rental.record_ratings(rental.id, [])
+    db.session.commit()
+
+    assert aggregates(rental) == (3, 5, pytest.approx(5 / 3),
+                                  {'1': 2, '2': 0, '3': 1, '4': 0, '5': 0})
+
+
+@pytest.mark.parametrize('rating', [0, 6, 4.0, True, '4', None])
+def test_record_ratings_rejects_non_ratings(database, rating):
+    [rental] = add_rentals([100])
+
+    with pytest.raises(ValueError):
+        Rental.record_ratings(rental.id, [5, rating])
+
+
+@pytest.mark.parametrize('rating', [4.0, True, '4', 0])
+def test_reservation_route_rejects_non_ratings(client, seed, rating):
+    rental = seed['rentals'][0]
+    before = aggregates(rental)
+
+    response = client.post('/reservations/bob/add', headers=auth_headers('bob'),
+                           json={'rental_id': rental.id, 'rating': rating,
+                                 'start_date': '2031-01-01',
+                                 'end_date': '2031-01-02'})
+
+    assert response.status_code == 400
+    assert aggregates(rental) == before
+    assert Reservation.query.filter_by(rental_id=rental.id).count() == 1
+
+
+def test_sort_by_rating_pages_best_first(client, seed):
+    # The seed rates its rentals 1 to 5; add two more ties and an unrated one
+    extra = add_rentals([10, 20, 30])
+    Rental.record_ratings(extra[0].id, [3])
+    Rental.record_ratings(extra[1].id, [5, 5])
+    db.session.commit()
+
+    rentals, pages = all_pages(client, '/rentals?sort=rating&limit=3')
+
+    keys = [(r['rating_mean'] or 0, r['id']) for r in rentals]
+    assert keys == sorted(keys, reverse=True)
+    assert len({r['id'] for r in rentals}) == 8
+    assert pages == 3
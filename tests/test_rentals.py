@@ -0,0 +1,77 @@
+from helpers import encode_cursor
+from models import db, Rental
+
+
+def add_rentals(prices, location='Oakland', owner='alice'):
+    rentals = [
+        Rental.add_rental(description=f'Yard {i}', location=location,
+                          price=price, owner_username=owner, url=f'yard-{i}.jpg')
+        for i, price in enumerate(prices)
+    ]
+    db.session.commit()
+    return rentals
+
+
+def all_pages(client, url):
+    """Follows next_cursor from `url` to the last page. Returns every
+    rental and the number of pages"""
+
+    rentals, pages = [], 0
+    separator = '&' if '?' in url else '?'
+    next_url = url
+
+    while next_url:
+        response = client.get(next_url)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        rentals += response.json['rentals']
+        pages += 1
+        cursor = response.json['next_cursor']
+        next_url = f'{url}{separator}cursor={cursor}' if cursor else None
+
+    return rentals, pages
+
+
+def test_pages_by_id_cover_every_rental_once(seed, client):
+    add_rentals(range(100, 150))
+
+    rentals, pages = all_pages(client, '/rentals?limit=7')
+
+    ids = [r['id'] for r in rentals]
+    assert ids == sorted(ids)
+    assert len(ids) == len(set(ids)) == 55
+    assert pages == 8
+
+
+def test_pages_by_price_break_ties_on_id(seed, client):
+    add_rentals([70, 60, 60, 60, 80, 60])
+
+    rentals, pages = all_pages(client, '/rentals?sort=price&limit=2')
+
+    keys = [(r['price'], r['id']) for r in rentals]
+    assert keys == sorted(keys)
+    assert len(set(keys)) == 11
+
+
+def test_filters(seed, client):
+    add_rentals([10, 20, 30], location='Berkeley', owner='bob')
+
+    response = client.get('/rentals?location=Berkeley&min_price=15&max_price=30')
+    assert [r['price'] for r in response.json['rentals']] == [20, 30]
+
+    response = client.get('/rentals?owner=bob')
+    assert {r['owner_username'] for r in response.json['rentals']} == {'bob'}
+
+
+def test_cursor_must_match_sort(seed, client):
+    response = client.get(f'/rentals?sort=price&cursor={encode_cursor((3,))}')
+    assert response.status_code == 400
+
+    response = client.get('/rentals?cursor=not-a-cursor')
+    assert response.status_code == 400
+
+
+def test_limit_is_capped(seed, client):
+    add_rentals(range(150))
+
+    response = client.get('/rentals?limit=1000')
+    assert len(response.json['rentals']) == 100
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+
+from conftest import auth_headers
+from models import db, Reservation, RESERVATIONS_NO_OVERLAP
+
+
+def book(client, rental_id, start='2031-01-01', end='2031-01-03'):
+    return client.post('/reservations/bob/add', headers=auth_headers('bob'),
+                       json={'rental_id': rental_id, 'start_date': start,
+                             'end_date': end})
+
+
+def test_book_and_overlap(client, seed):
+    rental_id = seed['rentals'][0].id
+
+    assert book(client, rental_id).status_code == 200
+    assert book(client, rental_id, '2031-01-03', '2031-01-05').status_code == 409
+    assert book(client, rental_id, '2031-01-04', '2031-01-05').status_code == 200
+
+
+@pytest.mark.parametrize('rental_id', ['abc', '1', 1.0, True, 0, -1, 2 ** 31, None])
+def test_rental_id_must_be_an_int(client, seed, rental_id):
+    assert book(client, rental_id).status_code == 400
+    assert Reservation.query.filter_by(renter='bob').count() == 5
+
+
+def test_unknown_rental_is_not_found(client, seed):
+    assert book(client, 999).status_code == 404
+    assert Reservation.query.filter_by(renter='bob').count() == 5
+
+
+@pytest.fixture
+def commit_fails(monkeypatch):
+    """Makes the next commit raise an IntegrityError naming `constraint`,
+    as psycopg reports it"""
+
+    def fail_with(constraint):
+        orig = Exception('violates constraint')
+        orig.diag = SimpleNamespace(constraint_name=constraint)
+
+        def commit():
+            raise IntegrityError('INSERT', {}, orig)
+
+        monkeypatch.setattr(db.session, 'commit', commit)
+
+    return fail_with
+
+
+@pytest.mark.parametrize('constraint, rental_index, status', [
+    (RESERVATIONS_NO_OVERLAP, 0, 409),
+    ('reservations_rental_id_fkey', None, 404),
+    ('reservations_renter_fkey', 0, 400),
+    (None, 0, 400),
+])
+def test_integrity_errors(client, seed, commit_fails, constraint,
+                          rental_index, status):
+    rental_id = 999 if rental_index is None else seed['rentals'][rental_index].id
+    commit_fails(constraint)
+
+    assert book(client, rental_id).status_code == status
+
+
+def test_overlapping_uses_daterange_on_postgres(seed, monkeypatch):
+    dialect = db.session.get_bind(mapper=Reservation).dialect
+    with monkeypatch.context() as m:
+        m.setattr(dialect, 'name', 'postgresql')
+        query = Reservation.overlapping(1, '2031-01-01', '2031-01-02')
+
+    sql = str(query.statement.compile(dialect=postgresql.dialect()))
+
+    assert 'daterange(reservations.start_date, reservations.end_date' in sql
+    assert '&&' in sql
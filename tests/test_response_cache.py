@@ -0,0 +1,63 @@
+import pytest
+from flask import g
+
+import response_cache
+from conftest import auth_headers
+from models import db
+from routing import RoutingSession
+
+
+def test_repeat_get_is_a_hit(client, seed):
+    first = client.get('/rentals')
+    second = client.get('/rentals')
+
+    assert second.get_data() == first.get_data()
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert client.get('/rentals', headers={
+        'If-None-Match': first.headers['ETag'],
+    }).status_code == 304
+
+
+def test_commit_invalidates(client, seed):
+    before = client.get('/rentals').get_json()
+
+    rental = seed['rentals'][0]
+    rental.location = 'Berkeley'
+    db.session.commit()
+
+    after = client.get('/rentals').get_json()
+
+    assert after != before
+
+
+@pytest.fixture
+def replica_read(monkeypatch):
+    """Every request reads from a pretend replica, which is really the
+    primary"""
+
+    def replica_engine(session):
+        g.replica_key = 'replica_0'
+
+    monkeypatch.setattr(RoutingSession, '_replica_engine', replica_engine)
+
+
+def test_replica_reads_are_not_stored(client, seed, replica_read, monkeypatch):
+    stored = []
+    monkeypatch.setattr(response_cache.response_cache, 'set',
+                        lambda key, entry: stored.append(key))
+
+    response = client.get('/rentals')
+
+    assert response.status_code == 200
+    assert response.headers['ETag']
+    assert stored == []
+
+
+def test_primary_reads_are_stored(client, seed, monkeypatch):
+    stored = []
+    monkeypatch.setattr(response_cache.response_cache, 'set',
+                        lambda key, entry: stored.append(key))
+
+    client.get('/rentals', headers=auth_headers('bob'))
+
+    assert len(stored) == 1
@@ -0,0 +1,80 @@
+from flask import g, request_finished
+from sqlalchemy import select, update
+
+import routing
+from conftest import auth_headers, PASSWORD
+from models import db, Message
+from routing import RoutingSession
+
+
+def test_bulk_update_counts_as_a_write(client, seed):
+    """mark_read is a single UPDATE statement, with nothing to flush"""
+
+    conversation = seed['conversations']['bob']
+
+    response = client.post(f'/conversations/{conversation.id}/read',
+                           headers=auth_headers('alice'))
+
+    assert response.get_json()['marked'] > 0
+    assert routing.wrote_recently(['user:alice'])
+
+
+def test_reads_are_not_writes(client, seed):
+    conversation = seed['conversations']['bob']
+
+    client.get(f'/conversations/{conversation.id}/messages',
+               headers=auth_headers('alice'))
+
+    assert not routing.wrote_recently(['user:alice'])
+
+
+def test_dml_statements_use_the_primary(app, seed, monkeypatch):
+    replica = object()
+    monkeypatch.setattr(RoutingSession, '_replica_engine', lambda session: replica)
+    primary = db.session.get_bind(mapper=Message)
+
+    with app.test_request_context('/'):
+        g.use_replica = True
+
+        assert db.session.get_bind(mapper=Message, clause=select(Message)) is replica
+        assert db.session.get_bind(mapper=Message, clause=update(Message)) is primary
+
+
+def uses_replica(app, client, *args, **kwargs):
+    """Returns whether a GET was allowed to read from a replica"""
+
+    used = []
+    def record(sender, response):
+        used.append(g.use_replica)
+
+    with request_finished.connected_to(record, app):
+        client.get(*args, **kwargs)
+
+    return used[0]
+
+
+def test_signup_pins_the_new_users_reads_to_the_primary(app, client, seed):
+    """Signup is unauthenticated, but the next request carries the new token"""
+
+    response = client.post('/signup', json={
+        'username': 'dave', 'password': PASSWORD, 'email': 'dave@example.com',
+        'location': '', 'bio': '', 'image_url': ''})
+    token = response.get_json()['token']
+
+    # Even from another address, e.g. behind a different load balancer hop
+    assert not uses_replica(app, client, '/users/dave',
+                            headers={'Authorization': f'Bearer {token}'},
+                            environ_base={'REMOTE_ADDR': '10.0.0.2'})
+    assert not uses_replica(app, client, '/rentals')
+    assert uses_replica(app, client, '/rentals',
+                        environ_base={'REMOTE_ADDR': '10.0.0.2'})
+
+
+def test_any_recent_key_pins_reads(app, client, seed):
+    routing.remember_writer(['ip:127.0.0.1'])
+
+    # An unauthenticated write from this address, then a signed in read
+    assert not uses_replica(app, client, '/users/alice',
+                            headers=auth_headers('alice'))
+    assert uses_replica(app, client, '/users/bob', headers=auth_headers('bob'),
+                        environ_base={'REMOTE_ADDR': '10.0.0.2'})
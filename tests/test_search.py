@@ -0,0 +1,81 @@
+import pytest
+
+from geo import bounding_box, haversine_km
+from models import db, Rental
+
+
+OAKLAND = (37.8044, -122.2712)
+
+# (description, latitude, longitude), km from Oakland in the name
+PLACES = [
+    ('Lake Merritt 1', 37.8030, -122.2570),
+    ('Berkeley 7', 37.8716, -122.2727),
+    ('San Francisco 13', 37.7749, -122.4194),
+    ('San Jose 61', 37.3382, -121.8863),
+    ('Los Angeles 560', 34.0522, -118.2437),
+]
+
+
+@pytest.fixture
+def places(seed):
+    for description, lat, lon in PLACES:
+        Rental.add_rental(description=description, location='CA', price=10,
+                          owner_username='alice', url=None,
+                          latitude=lat, longitude=lon)
+    db.session.commit()
+
+
+def test_bounding_box_holds_the_circle():
+    lat, lon = OAKLAND
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, 50)
+
+    assert haversine_km(lat, lon, min_lat, lon) == pytest.approx(50)
+    assert haversine_km(lat, lon, max_lat, lon) == pytest.approx(50)
+    assert haversine_km(lat, lon, lat, min_lon) >= 50
+    assert haversine_km(lat, lon, lat, max_lon) >= 50
+
+
+@pytest.mark.parametrize('lat, lon', [(89.9, 0), (-89.9, 0), (0, 179.99), (0, -179.99)])
+def test_bounding_box_without_longitudes(lat, lon):
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, 50)
+
+    assert -90 <= min_lat < lat < max_lat <= 90
+    assert min_lon is None and max_lon is None
+
+
+def test_near_is_closest_first_within_radius(places):
+    results = Rental.search(near=(*OAKLAND, 20))
+
+    assert [rental.description for rental, _ in results] == [
+        'Lake Merritt 1', 'Berkeley 7', 'San Francisco 13',
+    ]
+    for rental, distance in results:
+        assert distance == pytest.approx(
+            haversine_km(*OAKLAND, rental.latitude, rental.longitude))
+
+
+def test_near_limit_is_the_closest(places, count_queries):
+    with count_queries() as statements:
+        results = Rental.search(near=(*OAKLAND, 100), limit=2)
+
+    assert [rental.description for rental, _ in results] == [
+        'Lake Merritt 1', 'Berkeley 7',
+    ]
+    assert len(statements) == 1
+    assert 'LIMIT' in statements[0]
+
+
+def test_near_with_text(places):
+    results = Rental.search(text='berkeley', near=(*OAKLAND, 20))
+
+    assert [rental.description for rental, _ in results] == ['Berkeley 7']
+
+
+def test_search_route_distances(client, places):
+    response = client.get('/rentals/search?lat=37.8044&lon=-122.2712&radius_km=10')
+
+    assert response.status_code == 200
+    assert [(r['description'], round(r['distance_km'])) for r in
+            response.get_json()['rentals']] == [
+        ('Lake Merritt 1', 1), ('Berkeley 7', 7),
+    ]
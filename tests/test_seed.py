@@ -0,0 +1,39 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_seed_script(tmp_path, workers):
+    """seed.py runs as a script while bcrypt workers re-import it"""
+
+    database = tmp_path / 'seed.db'
+    env = {
+        **os.environ,
+        'SECRET_KEY': 'test-secret',
+        'BUCKET_NAME': 'sharebnb-test',
+        'DATABASE_URL': f'sqlite:///{database}',
+        'APP_PROFILE': 'prod',
+        'BCRYPT_LOG_ROUNDS': '4',
+        'BCRYPT_WORKERS': workers,
+    }
+
+    result = subprocess.run([sys.executable, 'seed.py'], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=120)
+
+    assert result.returncode == 0, result.stderr
+    assert 'Traceback' not in result.stderr
+
+    with sqlite3.connect(database) as conn:
+        counts = {table: conn.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+                  for table in ('users', 'rentals', 'reservations',
+                                'conversations', 'messages')}
+
+    assert counts == {'users': 3, 'rentals': 3, 'reservations': 3,
+                      'conversations': 3, 'messages': 6}
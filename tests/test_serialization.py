@@ -0,0 +1,70 @@
+import json
+from datetime import date, datetime
+
+import pytest
+
+from json_provider import FastJSONProvider
+from models import db, Rental, Reservation, Message
+
+
+@pytest.fixture(params=['orjson', 'stdlib'])
+def provider(request, app):
+    provider = FastJSONProvider(app)
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+        assert provider.orjson is not None
+    else:
+        provider.orjson = None
+    return provider
+
+
+def test_dumps_matches_the_default_provider(provider, app):
+    obj = {'b': 1, 'a': [1.5, None, True], 'day': date(2030, 1, 2),
+           'at': datetime(2030, 1, 2, 3, 4, 5), 'name': 'café',
+           'histogram': {'1': 0, '5': 2}}
+
+    assert json.loads(provider.dumps(obj)) == json.loads(app.json.dumps(obj))
+    # Dates are still encoded by Flask's default, as HTTP dates
+    assert json.loads(provider.dumps(obj))['day'] == 'Wed, 02 Jan 2030 00:00:00 GMT'
+    assert list(json.loads(provider.dumps(obj))) == ['a', 'at', 'b', 'day', 'histogram', 'name']
+
+
+def test_dumps_falls_back_for_stdlib_only_options(provider):
+    assert provider.dumps({'a': 1}, indent=4) == json.dumps({'a': 1}, indent=4)
+
+
+def test_dumps_rejects_unknown_types(provider):
+    with pytest.raises(TypeError):
+        provider.dumps({'a': object()})
+
+
+def test_loads(provider):
+    assert provider.loads('{"a": [1, "b"]}') == {'a': [1, 'b']}
+    assert provider.loads(b'{"a": 1}') == {'a': 1}
+
+    with pytest.raises(ValueError):
+        provider.loads('{')
+
+
+def test_responses_use_the_fast_provider(app):
+    assert isinstance(app.json, FastJSONProvider)
+
+
+def test_row_serializers_match_serialize(seed):
+    for model, columns in ((Rental, Rental.row_columns()),
+                           (Reservation, Reservation.row_columns()),
+                           (Message, Message.row_columns())):
+        objects = {obj.id: obj.serialize() for obj in model.query}
+        rows = db.session.query(*columns).all()
+
+        assert rows
+        for row in rows:
+            assert model.serialize_row(row) == objects[row.id]
+
+
+def test_rental_fields(seed):
+    fields = ['price', 'rating_mean']
+    row = db.session.query(*Rental.row_columns(fields)).first()
+
+    assert set(row._fields) == {'id', 'price', 'rating_mean', 'rating_count'}
+    assert list(Rental.serialize_row(row, fields)) == fields